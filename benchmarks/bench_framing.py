@@ -0,0 +1,68 @@
+"""Compare response framing against the previous re-parse-every-line loop on multi-MB REPL outputs.
+
+Run with `python -m benchmarks.bench_framing` from the repository root, no Lean installation is needed.
+"""
+
+import io
+import json
+import time
+
+from lean_repl_py.handler import _ResponseFramer
+
+
+def make_response(num_tactics: int) -> str:
+    """Build a pretty-printed `allTactics` response, one tactic entry per line as the REPL does."""
+    tactics = [
+        json.dumps(
+            {
+                "tactic": f"exact foo_{i}",
+                "proofState": i,
+                "pos": {"line": i, "column": 2},
+                "goals": "x y : Nat\\nh : x = y\\n" * 20 + f"⊢ f x = f y + {i}",
+                "endPos": {"line": i, "column": 14},
+            },
+            ensure_ascii=False,
+        )
+        for i in range(num_tactics)
+    ]
+    return '{"tactics":\n [' + ",\n  ".join(tactics) + '],\n "env": 0}\n\n'
+
+
+def reparse_every_line(stream: io.StringIO) -> dict:
+    output = stream.readline().strip()
+    while True:
+        try:
+            return json.loads(output)
+        except json.JSONDecodeError:
+            pass
+        output += stream.readline().strip()
+
+
+def framed(stream: io.StringIO) -> dict:
+    framer = _ResponseFramer()
+    while True:
+        response = framer.feed(stream.readline())
+        if response is not None:
+            return response
+
+
+def bench(fn, text: str) -> float:
+    start = time.perf_counter()
+    fn(io.StringIO(text))
+    return time.perf_counter() - start
+
+
+def main():
+    for num_tactics in (500, 1500, 3000):
+        text = make_response(num_tactics)
+        old = bench(reparse_every_line, text)
+        new = bench(framed, text)
+        print(
+            f"{len(text) / 1e6:6.2f} MB, {num_tactics:5d} lines: "
+            f"re-parse {old * 1000:9.1f} ms, framed {new * 1000:7.1f} ms, "
+            f"speedup {old / new:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
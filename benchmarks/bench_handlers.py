@@ -0,0 +1,256 @@
+"""Measure the overhead the handlers add on top of the REPL, using a fake REPL replaying recorded responses.
+
+Run with `python -m benchmarks.bench_handlers` from the repository root, no Lean installation is needed.
+Every scenario is also replayed by a bare client that only writes requests and reads raw response lines, the
+difference is the time spent in the handler. With `--check`, exits with an error if the overhead per request
+of any scenario exceeds its budget, so CI catches regressions in the Python layer.
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from unittest.mock import patch
+
+from lean_repl_py import LeanREPLHandler, LeanREPLAsyncHandler
+from lean_repl_py.launch import LeanREPLLaunchSpec
+
+from benchmarks import scenarios
+
+REPLAY_REPL_PATH = Path(__file__).parent / "replay_repl.py"
+
+TINY_COMMANDS = 2000
+HUGE_FILE_TACTICS = 5000
+HUGE_FILE_REPEATS = 5
+BURST_STATES = 20
+BURST_TACTICS = 128
+
+# Maximum overhead per request in microseconds, by scenario and handler, about twice the measured overhead so
+# regressions fail. The handlers differ by an order of magnitude on huge files, so each gets its own budget.
+BUDGETS = {
+    "tiny commands": {"sync": 200, "sync binary": 100, "async": 150},
+    "huge allTactics file": {
+        "sync": 300_000,
+        "sync lazy": 280_000,
+        "sync binary": 30_000,
+        "async": 320_000,
+        "async lazy": 220_000,
+    },
+    "tactic burst": {"sync": 100, "async": 80},
+    "concurrent commands": {"async": 80},
+}
+
+
+@contextmanager
+def replay_repl(recording: Path) -> Iterator[LeanREPLLaunchSpec]:
+    """Make handlers launch the replaying fake REPL instead of Lean."""
+    spec = LeanREPLLaunchSpec(
+        command=[sys.executable, str(REPLAY_REPL_PATH), str(recording)],
+        env={},
+        cwd=REPLAY_REPL_PATH.parent,
+    )
+    with patch("lean_repl_py.handler.resolve_repl", lambda project_path=None: spec):
+        with patch(
+            "lean_repl_py.async_handler.resolve_repl", lambda project_path=None: spec
+        ):
+            yield spec
+
+
+def bare_client(spec: LeanREPLLaunchSpec, requests: List[Dict[str, Any]]) -> float:
+    """Replay requests one after another, only reading raw response lines."""
+    process = subprocess.Popen(
+        spec.command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        cwd=spec.cwd,
+    )
+
+    def round_trip(request: Dict[str, Any]) -> None:
+        process.stdin.write(json.dumps(request, ensure_ascii=False) + "\n\n")
+        process.stdin.flush()
+        line = process.stdout.readline()
+        while line.strip():
+            line = process.stdout.readline()
+
+    try:
+        # Let the process start before measuring, like the handlers below
+        round_trip({"cmd": "def warmup := 0"})
+        start = time.perf_counter()
+        for request in requests:
+            round_trip(request)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def timed_sync(run: Callable[[LeanREPLHandler], None], **kwargs: Any) -> float:
+    handler = LeanREPLHandler(**kwargs)
+    try:
+        # Let the process start before measuring
+        handler.run_command("def warmup := 0")
+        start = time.perf_counter()
+        run(handler)
+        return time.perf_counter() - start
+    finally:
+        handler.close()
+
+
+def timed_async(run: Callable[[LeanREPLAsyncHandler], Any], **kwargs: Any) -> float:
+    async def main() -> float:
+        handler = LeanREPLAsyncHandler(**kwargs)
+        try:
+            await handler.run_command("def warmup := 0")
+            start = time.perf_counter()
+            await run(handler)
+            return time.perf_counter() - start
+        finally:
+            await handler.close()
+
+    return asyncio.run(main())
+
+
+def run_tiny_sync(handler: LeanREPLHandler) -> None:
+    for i in range(TINY_COMMANDS):
+        handler.run_command(f"def f{i} := {i}")
+
+
+async def run_tiny_async(handler: LeanREPLAsyncHandler) -> None:
+    for i in range(TINY_COMMANDS):
+        await handler.run_command(f"def f{i} := {i}")
+
+
+async def run_tiny_concurrent(handler: LeanREPLAsyncHandler) -> None:
+    await asyncio.gather(
+        *(handler.run_command(f"def f{i} := {i}") for i in range(TINY_COMMANDS))
+    )
+
+
+def run_file_sync(handler: LeanREPLHandler) -> None:
+    for _ in range(HUGE_FILE_REPEATS):
+        handler.run_file(Path(scenarios.HUGE_FILE_PATH))
+
+
+async def run_file_async(handler: LeanREPLAsyncHandler) -> None:
+    for _ in range(HUGE_FILE_REPEATS):
+        await handler.run_file(Path(scenarios.HUGE_FILE_PATH))
+
+
+def run_burst_sync(handler: LeanREPLHandler) -> None:
+    tactics = [f"candidate_{i}" for i in range(BURST_TACTICS)]
+    for state in range(BURST_STATES):
+        handler.run_tactics(state, tactics)
+
+
+async def run_burst_async(handler: LeanREPLAsyncHandler) -> None:
+    tactics = [f"candidate_{i}" for i in range(BURST_TACTICS)]
+    for state in range(BURST_STATES):
+        await handler.run_tactics(state, tactics)
+
+
+def scenario_requests() -> Dict[str, List[Dict[str, Any]]]:
+    tiny = [request for request, _ in scenarios.tiny_commands(TINY_COMMANDS)]
+    return {
+        "tiny commands": tiny,
+        "huge allTactics file": [
+            request for request, _ in scenarios.huge_file(HUGE_FILE_TACTICS)
+        ]
+        * HUGE_FILE_REPEATS,
+        "tactic burst": [
+            request
+            for request, _ in scenarios.tactic_burst(BURST_STATES, BURST_TACTICS)
+        ],
+        "concurrent commands": tiny,
+    }
+
+
+HANDLERS = {
+    "sync": lambda run: timed_sync(run),
+    "sync lazy": lambda run: timed_sync(run, lazy_responses=True),
+    "sync binary": lambda run: timed_sync(run, binary_io=True),
+    "async": lambda run: timed_async(run),
+    "async lazy": lambda run: timed_async(run, lazy_responses=True),
+}
+
+RUNS = {
+    "tiny commands": [
+        ("sync", run_tiny_sync),
+        ("sync binary", run_tiny_sync),
+        ("async", run_tiny_async),
+    ],
+    "huge allTactics file": [
+        ("sync", run_file_sync),
+        ("sync lazy", run_file_sync),
+        ("sync binary", run_file_sync),
+        ("async", run_file_async),
+        ("async lazy", run_file_async),
+    ],
+    "tactic burst": [("sync", run_burst_sync), ("async", run_burst_async)],
+    "concurrent commands": [("async", run_tiny_concurrent)],
+}
+
+
+def best_of(repeat: int, measure: Callable[[], float]) -> float:
+    return min(measure() for _ in range(repeat))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--check", action="store_true", help="Enforce BUDGETS.")
+    parser.add_argument("--json", type=Path, help="Also write the results here.")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        recording = scenarios.write(
+            Path(directory) / "recording.jsonl",
+            scenarios.tiny_commands(TINY_COMMANDS),
+            scenarios.huge_file(HUGE_FILE_TACTICS),
+            scenarios.tactic_burst(BURST_STATES, BURST_TACTICS),
+        )
+        with replay_repl(recording) as spec:
+            for scenario, requests in scenario_requests().items():
+                baseline = best_of(args.repeat, lambda: bare_client(spec, requests))
+                for handler, run in RUNS[scenario]:
+                    elapsed = best_of(args.repeat, lambda: HANDLERS[handler](run))
+                    results.append(
+                        {
+                            "scenario": scenario,
+                            "handler": handler,
+                            "requests": len(requests),
+                            "seconds": elapsed,
+                            "baseline_seconds": baseline,
+                            "overhead_us": (elapsed - baseline) / len(requests) * 1e6,
+                        }
+                    )
+
+    failed = False
+    print(
+        f"{'scenario':22} {'handler':11} {'requests':>8} {'total ms':>9} "
+        f"{'bare ms':>9} {'overhead µs/req':>16}"
+    )
+    for result in results:
+        budget = BUDGETS[result["scenario"]][result["handler"]]
+        over_budget = result["overhead_us"] > budget
+        failed |= over_budget
+        print(
+            f"{result['scenario']:22} {result['handler']:11} {result['requests']:8d} "
+            f"{result['seconds'] * 1000:9.1f} {result['baseline_seconds'] * 1000:9.1f} "
+            f"{result['overhead_us']:16.1f}" + (" OVER BUDGET" if over_budget else "")
+        )
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+    return 1 if args.check and failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
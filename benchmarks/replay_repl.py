@@ -0,0 +1,54 @@
+"""A stand-in for the Lean REPL that answers with recorded responses, for benchmarking without Lean.
+
+Usage: `python benchmarks/replay_repl.py RECORDING`, where RECORDING is a JSON lines file of
+`{"request": ..., "response": ...}` objects. Requests are matched on their content, and answered as fast as
+possible with the recorded response, laid out over lines like the REPL does. Unknown requests get an error
+message, like invalid requests do in Lean.
+"""
+
+import json
+import sys
+
+
+def canonical(request):
+    return json.dumps(request, sort_keys=True, ensure_ascii=False)
+
+
+def render(response):
+    """Lay out a response like the REPL: one top-level field per line, long lists one element per line."""
+    fields = []
+    for key, value in response.items():
+        if isinstance(value, list) and value:
+            elements = ",\n  ".join(json.dumps(v, ensure_ascii=False) for v in value)
+            fields.append(f'"{key}":\n [{elements}]')
+        else:
+            fields.append(f"{json.dumps(key)}: {json.dumps(value, ensure_ascii=False)}")
+    return "{" + ",\n ".join(fields) + "}\n\n"
+
+
+def load(path):
+    responses = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                responses[canonical(entry["request"])] = render(entry["response"])
+    return responses
+
+
+def main():
+    responses = load(sys.argv[1])
+    unknown = render({"message": "No recorded response for this request."})
+    buffer = ""
+    for line in sys.stdin:
+        if line.strip():
+            buffer += line
+            continue
+        if buffer:
+            sys.stdout.write(responses.get(canonical(json.loads(buffer)), unknown))
+            sys.stdout.flush()
+            buffer = ""
+
+
+if __name__ == "__main__":
+    main()
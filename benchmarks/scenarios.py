@@ -0,0 +1,97 @@
+"""Recordings of request/response pairs for the handler benchmarks, shaped like real Lean REPL output.
+
+Each scenario is generated deterministically, so runs are comparable. A recording of a real Lean session in
+the same format, see `benchmarks/replay_repl.py`, can be used in their place.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+Recording = List[Tuple[Dict[str, Any], Dict[str, Any]]]
+
+# Sent by `run_file`, which makes the path absolute
+HUGE_FILE_PATH = "/benchmarks/huge.lean"
+
+
+def _pos(line: int, column: int) -> Dict[str, int]:
+    return {"line": line, "column": column}
+
+
+def _goal(idx: int) -> str:
+    return "x y : Nat\nh : x = y\n" * 5 + f"⊢ f x = f y + {idx}"
+
+
+def tiny_commands(count: int) -> Recording:
+    return [({"cmd": f"def f{i} := {i}"}, {"env": i}) for i in range(count)]
+
+
+def huge_file(num_tactics: int) -> Recording:
+    response = {
+        "sorries": [
+            {
+                "proofState": i,
+                "pos": _pos(10 * i, 4),
+                "goal": _goal(i),
+                "endPos": _pos(10 * i, 9),
+            }
+            for i in range(num_tactics // 100)
+        ],
+        "messages": [
+            {
+                "severity": "warning",
+                "pos": _pos(10 * i, 0),
+                "endPos": _pos(10 * i, 9),
+                "data": "declaration uses 'sorry'",
+            }
+            for i in range(num_tactics // 100)
+        ],
+        "tactics": [
+            {
+                "tactic": f"exact foo_{i}",
+                "proofState": i,
+                "pos": _pos(i, 2),
+                "goals": _goal(i),
+                "endPos": _pos(i, 14),
+            }
+            for i in range(num_tactics)
+        ],
+        "env": 0,
+    }
+    return [({"path": HUGE_FILE_PATH, "allTactics": True}, response)]
+
+
+def tactic_burst(num_states: int, num_tactics: int) -> Recording:
+    recording = []
+    for state in range(num_states):
+        for i in range(num_tactics):
+            response: Dict[str, Any] = {
+                "proofState": num_states + state * num_tactics + i,
+                "goals": [_goal(i)] if i % 3 else [],
+            }
+            if i % 5 == 0:
+                response["messages"] = [
+                    {
+                        "severity": "error",
+                        "pos": _pos(1, 0),
+                        "endPos": None,
+                        "data": "unsolved goals",
+                    }
+                ]
+            recording.append(
+                ({"tactic": f"candidate_{i}", "proofState": state}, response)
+            )
+    return recording
+
+
+def write(path: Path, *recordings: Recording) -> Path:
+    with open(path, "w") as f:
+        for recording in recordings:
+            for request, response in recording:
+                f.write(
+                    json.dumps(
+                        {"request": request, "response": response}, ensure_ascii=False
+                    )
+                    + "\n"
+                )
+    return path
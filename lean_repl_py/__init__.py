@@ -5,8 +5,52 @@ from .handler import (
     LeanREPLPos,
     LeanREPLMessage,
     LeanREPLNextProofState,
+    LeanREPLPosView,
+    LeanREPLProofStateView,
+    LeanREPLMessageView,
+    LeanREPLNextProofStateView,
+    LeanREPLProofStateCheckpoint,
+    LeanREPLTacticResult,
+    LeanREPLTimeoutError,
+    LeanREPLAbortedError,
+    split_header,
 )
 from .async_handler import LeanREPLAsyncHandler
+from .pool import LeanREPLPool, LeanREPLPoolStats
+from .executor import LeanREPLExecutor
+from .cache import LeanREPLCache, LeanREPLCacheStats
+from .snapshot import EnvSnapshotStore
+from .bulk import check_files, LeanREPLFileResult, LeanREPLCheckStats
+from .batch import (
+    verify_candidates,
+    verify_candidates_async,
+    LeanREPLCandidateResult,
+)
+from .incremental import (
+    LeanREPLIncrementalChecker,
+    LeanREPLAsyncIncrementalChecker,
+    LeanREPLIncrementalResult,
+    split_commands,
+)
+from .search import (
+    LeanREPLProofSearch,
+    LeanREPLSearchNode,
+    LeanREPLSearchResult,
+)
+from .server import (
+    LeanREPLServer,
+    LeanREPLClient,
+    LeanREPLServerError,
+    LeanREPLServerStats,
+)
+from .scheduler import LeanREPLScheduler, LeanREPLSchedulerStats
+from .supervisor import LeanREPLSupervisor, LeanREPLSupervisorStats
+from .tracing import (
+    LeanREPLTrace,
+    LeanREPLTraceHistogram,
+    LeanREPLTraceStats,
+    LeanREPLPhaseStats,
+)
 
 __all__ = [
     "LeanREPLHandler",
@@ -15,5 +59,45 @@ __all__ = [
     "LeanREPLNextProofState",
     "LeanREPLPos",
     "LeanREPLMessage",
+    "LeanREPLPosView",
+    "LeanREPLProofStateView",
+    "LeanREPLMessageView",
+    "LeanREPLNextProofStateView",
+    "LeanREPLProofStateCheckpoint",
+    "LeanREPLTacticResult",
+    "LeanREPLTimeoutError",
+    "LeanREPLAbortedError",
+    "split_header",
     "LeanREPLAsyncHandler",
+    "LeanREPLPool",
+    "LeanREPLPoolStats",
+    "LeanREPLExecutor",
+    "LeanREPLCache",
+    "LeanREPLCacheStats",
+    "EnvSnapshotStore",
+    "check_files",
+    "LeanREPLFileResult",
+    "LeanREPLCheckStats",
+    "verify_candidates",
+    "verify_candidates_async",
+    "LeanREPLCandidateResult",
+    "LeanREPLIncrementalChecker",
+    "LeanREPLAsyncIncrementalChecker",
+    "LeanREPLIncrementalResult",
+    "split_commands",
+    "LeanREPLProofSearch",
+    "LeanREPLSearchNode",
+    "LeanREPLSearchResult",
+    "LeanREPLServer",
+    "LeanREPLClient",
+    "LeanREPLServerError",
+    "LeanREPLServerStats",
+    "LeanREPLScheduler",
+    "LeanREPLSchedulerStats",
+    "LeanREPLSupervisor",
+    "LeanREPLSupervisorStats",
+    "LeanREPLTrace",
+    "LeanREPLTraceHistogram",
+    "LeanREPLTraceStats",
+    "LeanREPLPhaseStats",
 ]
@@ -1,58 +1,190 @@
-import subprocess
+import copy
 import json
+import time
 import warnings
 from pathlib import Path
-from typing import Optional, Dict, Union, Tuple
+from typing import (
+    Optional,
+    Dict,
+    Union,
+    Tuple,
+    Deque,
+    Any,
+    Iterable,
+    List,
+    AsyncIterator,
+    TYPE_CHECKING,
+)
+from collections import deque, OrderedDict
 import asyncio
+from lean_repl_py.cache import LeanREPLCache, _CacheSession, toolchain_version
+from lean_repl_py.coalesce import _SingleFlight, _request_key
+from lean_repl_py.launch import LEAN_REPL_PATH, resolve_repl
+from lean_repl_py.tracing import LeanREPLTrace, LeanREPLTracer, _TraceRecorder
 from lean_repl_py.handler import (
+    REPL_READ_CHUNK,
+    REPL_STDERR_GRACE,
     LeanREPLEnvironment,
     LeanREPLProofState,
     LeanREPLNextProofState,
     LeanREPLMessage,
-    REPL_MAX_OUTPUT_LINES,
+    LeanREPLProofStateView,
+    LeanREPLMessageView,
+    LeanREPLNextProofStateView,
+    LeanREPLProofStateCheckpoint,
+    LeanREPLTacticResult,
+    LeanREPLTimeoutError,
+    LeanREPLAbortedError,
+    _ResponseFramer,
+    _ResponseStream,
+    _StderrLog,
+    _parse_stream_item,
+    _shift_response,
+    _header_failed,
+    split_header,
+    _checkpoint_paths,
+    _check_pickle_responses,
+    _tactic_result,
+    _tactic_requests,
+    _group_tactic_results,
 )
 
+if TYPE_CHECKING:
+    from lean_repl_py.supervisor import LeanREPLSupervisor
+
+# Max items of a streamed response decoded ahead of the consumer, before reading pauses
+REPL_STREAM_BUFFER = 64
+
+
+async def _drain_stderr(stream: asyncio.StreamReader, log: _StderrLog) -> None:
+    """Read stderr into the log until the process exits."""
+    while True:
+        chunk = await stream.read(REPL_READ_CHUNK)
+        if not chunk:
+            return
+        log.feed(chunk)
+
 
 class LeanREPLAsyncHandler:
-    def __init__(self, project_path: Optional[Path] = None):
+    def __init__(
+        self,
+        project_path: Optional[Path] = None,
+        lazy_responses: bool = False,
+        cache: Optional[LeanREPLCache] = None,
+        supervisor: Optional["LeanREPLSupervisor"] = None,
+        tracer: Optional[LeanREPLTracer] = None,
+        header_cache_size: Optional[int] = None,
+        coalesce: bool = False,
+    ):
         """Initialize the asynchronous Lean REPL handler.
 
         :param project_path: An optional path for a Lean project directory, containing the desired Lean environment.
-            If set, will run repl using `lake env repl` from the project directory.
+            If set, will run repl with the environment of `lake env` in the project directory.
+        :param lazy_responses: If set, sorries, messages and next proof states are returned as lightweight views
+            (e.g. `LeanREPLProofStateView`) that convert fields on access, instead of validated pydantic models.
+        :param cache: An optional response cache used by the `run_*` methods. Envs and proof states served from
+            the cache might be returned with negative indices, they are created in Lean once they are needed.
+        :param supervisor: An optional supervisor, recycling the REPL process once it exceeds a memory or request
+            budget, see `LeanREPLSupervisor`.
+        :param tracer: An optional callback receiving a `LeanREPLTrace` with phase timings and sizes for every
+            response, e.g. a `LeanREPLTraceHistogram`.
+        :param header_cache_size: If set, commands without an env reuse the environment of their header, see
+            `LeanREPLHandler`. Concurrent commands with a new header wait for one elaboration of it.
+        :param coalesce: If set, a request identical to one in flight, with the same timeout, is not sent again but
+            gets a copy of that request's response, or its error. `coalesced` counts the requests saved this way.
         """
+        self.lazy_responses = lazy_responses
+        self._tracing = _TraceRecorder(tracer) if tracer is not None else None
+        self.supervisor = supervisor
+        self.header_cache_size = header_cache_size
+        # Copies of a shared response are traced once, by the request that ran
+        self._single_flight = (
+            _SingleFlight(lambda result: (copy.deepcopy(result[0]), result[1], None))
+            if coalesce
+            else None
+        )
+        # Futures of header environments, None for headers with errors
+        self._header_envs: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self._project_path = project_path
+        self._cache_session = (
+            _CacheSession(cache, toolchain_version(project_path))
+            if cache is not None
+            else None
+        )
         # Path to the Lean REPL submodule
-        self.lean_repl_path = Path(__file__).parent.parent / "repl"
-        # Start the Lean REPL subprocess with pipes for stdin, stdout, and stderr
-        if project_path is None:
-            self.process_future = asyncio.create_subprocess_exec(
-                "lake",
-                "exe",
-                "repl",
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.lean_repl_path,
-            )
-        else:
-            # Need to ensure repl is built - this is a bit hacky, as it might take a second to detect if already built
-            subprocess.check_call(["lake", "build"], cwd=self.lean_repl_path)
-            repl_bin_path = self.lean_repl_path / ".lake" / "build" / "bin" / "repl"
-            self.process_future = asyncio.create_subprocess_exec(
-                "lake",
-                "env",
-                str(repl_bin_path.resolve()),
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=project_path,
-            )
+        self.lean_repl_path = LEAN_REPL_PATH
+        # Start the Lean REPL subprocess with pipes for stdin, stdout, and stderr on first use
+        self.process_future = self._spawn(project_path)
         self._env: Optional[LeanREPLEnvironment] = None
         self.process: Optional[asyncio.subprocess.Process] = None
+        self._process_task: Optional[asyncio.Future] = None
+        # Futures of in-flight requests in the order they were written to the REPL, each paired with a future
+        # that is resolved with the loop time at which the request reaches the head of the queue
+        self._pending: Deque[Tuple[asyncio.Future, asyncio.Future]] = deque()
+        # Queues receiving the items of pending `stream_file` requests, by their request future
+        self._streams: Dict[asyncio.Future, asyncio.Queue] = {}
+        self._reader_task: Optional[asyncio.Task] = None
+        self._stderr = _StderrLog()
+        self._stderr_task: Optional[asyncio.Task] = None
+
+    async def _spawn(self, project_path: Optional[Path]) -> asyncio.subprocess.Process:
+        # Builds the repl on first use only, off the event loop, later handlers exec the binary right away
+        spec = await asyncio.to_thread(resolve_repl, project_path)
+        process = await asyncio.create_subprocess_exec(
+            *spec.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=spec.cwd,
+            env=spec.process_env(),
+        )
+        self._stderr = _StderrLog()
+        self._stderr_task = asyncio.ensure_future(
+            _drain_stderr(process.stderr, self._stderr)
+        )
+        return process
+
+    async def restart(self, abort: bool = False) -> None:
+        """Kill the REPL process and start a new one, e.g. because it uses too much memory.
+
+        All envs and proof states are lost and the handler's env is reset. Requests must not be pending.
+
+        :param abort: Kill the process even if requests are pending, e.g. an abandoned one that keeps Lean busy.
+            The pending requests fail with a `RuntimeError`, the ones that were queued with a
+            `LeanREPLAbortedError`.
+        """
+        await self._stop(abort)
+        self._env = None
+        self._header_envs.clear()
+        if self._cache_session is not None:
+            self._cache_session.forget_process()
+        if self.supervisor is not None:
+            self.supervisor.reset()
+
+    async def _stop(self, abort: bool = False) -> None:
+        if self._pending and not abort:
+            raise RuntimeError("Cannot restart while requests are pending.")
+        await self.await_process()
+        if self.process.returncode is None:
+            self.process.kill()
+        await self.process.wait()
+        if self._reader_task is not None:
+            # Fails the pending requests once it reads the end of the output
+            await asyncio.wait({self._reader_task})
+        if self._tracing is not None:
+            self._tracing.reset()
+        # The next request spawns a new process
+        self.process = None
+        self._process_task = None
+        self.process_future = self._spawn(self._project_path)
 
     async def await_process(self) -> asyncio.subprocess.Process:
         if self.process is not None:
             return self.process
-        self.process = await self.process_future
+        # Wrap the spawn in a task on first use, so concurrent callers all await the same process
+        if self._process_task is None:
+            self._process_task = asyncio.ensure_future(self.process_future)
+        self.process = await asyncio.shield(self._process_task)
         return self.process
 
     @property
@@ -82,44 +214,475 @@ class LeanREPLAsyncHandler:
     async def send_json_str(self, data: str) -> None:
         return await self._send_json(json.loads(data))
 
+    def _write_json(self, data: Dict[str, Union[str, int]]) -> None:
+        # Only commands run in an env, e.g. a proof state pickle with an env would pickle the env instead
+        if "cmd" in data and self.env is not None and "env" not in data:
+            data["env"] = self.env.env_index
+        if self._tracing is not None:
+            start = time.perf_counter()
+        json_data = json.dumps(data, ensure_ascii=False)
+        self.process.stdin.write((json_data + "\n\n").encode())
+        if self._tracing is not None:
+            self._tracing.request(data, json_data, start)
+
     async def _send_json(self, data: Dict[str, Union[str, int]]) -> None:
         """Send a JSON object to the Lean REPL."""
-        if self.env is not None:
+        if self._pending:
+            raise RuntimeError(
+                "Cannot send manually while requests from run_* are pending."
+            )
+        await self.await_process()
+        self._write_json(data)
+        await self.process.stdin.drain()
+
+    async def _request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[
+        Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+        Optional[LeanREPLEnvironment],
+    ]:
+        """Send a JSON object to the Lean REPL and return its parsed response, going through the cache if set."""
+        if self.supervisor is None:
+            return await self._cached_request(data, timeout)
+        # Do not send to a process that is being recycled
+        await self.supervisor.before_request_async()
+        try:
+            result = await self._cached_request(data, timeout)
+        finally:
+            self.supervisor.request_finished()
+        # Only recycle once the response is tracked, so its indices are valid when returned
+        await self.supervisor.after_request_async(self)
+        return result
+
+    async def _cached_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[
+        Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+        Optional[LeanREPLEnvironment],
+    ]:
+        session = self._cache_session
+        if session is None:
+            response, _, trace = await self._timed_raw_request(data, timeout)
+            return self._parse_response(response, trace)
+        if "cmd" in data and "env" not in data and self.env is not None:
             data["env"] = self.env.env_index
-        json_data = json.dumps(data, ensure_ascii=False)
+        key = session.key(data)
+        request = data
+        if key is not None:
+            response = session.lookup(key, request)
+            if response is not None:
+                return self._parse_response(response)
+        # Create the env or proof state the request runs on, if it was only served from the cache so far
+        steps = session.prepare(data)
+        step_response = None
+        try:
+            while True:
+                step_response = await self._raw_request(steps.send(step_response))
+        except StopIteration as stop:
+            data = stop.value
+        response, _, trace = await self._timed_raw_request(data, timeout)
+        session.record(key, request, response)
+        return self._parse_response(response, trace)
+
+    async def _raw_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        response, _, trace = await self._timed_raw_request(data, timeout)
+        if trace is not None:
+            self._tracing.emit(trace)
+        return response
+
+    async def _timed_raw_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], float, Optional[LeanREPLTrace]]:
+        """Send a JSON object to the Lean REPL, or share the response of an identical request in flight."""
+        if self._single_flight is None:
+            return await self._pipelined_request(data, timeout)
+        if "cmd" in data and self.env is not None and "env" not in data:
+            data["env"] = self.env.env_index
+        return await self._single_flight.run(
+            _request_key(data, timeout),
+            lambda: self._pipelined_request(data, timeout),
+        )
+
+    @property
+    def coalesced(self) -> int:
+        """The number of requests that shared the response of an identical request, see `coalesce`."""
+        return self._single_flight.coalesced if self._single_flight is not None else 0
+
+    async def _pipelined_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], float, Optional[LeanREPLTrace]]:
+        """Send a JSON object to the Lean REPL and wait for its decoded response, the time it took and its trace.
+
+        Responses are read by a single background task and matched to requests in FIFO order, so any number of
+        coroutines can have requests in flight at the same time.
+        The timeout only starts once all earlier requests have been answered, so time spent queued behind a
+        slow request does not count. If it expires, the response is still consumed once it arrives, keeping
+        the pipe in sync.
+        """
         await self.await_process()
-        self.process.stdin.write((json_data + "\n\n").encode())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        at_head = loop.create_future()
+        if not self._pending:
+            at_head.set_result(loop.time())
+        # No await between writing and enqueueing, so the queue order is the write order
+        self._write_json(data)
+        self._pending.append((future, at_head))
+        if self._reader_task is None:
+            self._reader_task = asyncio.ensure_future(self._read_responses())
         await self.process.stdin.drain()
+        if timeout is not None:
+            # Wait without timeout while queued, the future might also fail before reaching the head
+            await asyncio.wait({future, at_head}, return_when=asyncio.FIRST_COMPLETED)
+        try:
+            response, trace = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise LeanREPLTimeoutError(
+                self._stderr.annotate("Timeout while waiting for the Lean REPL.")
+            )
+        return response, loop.time() - at_head.result(), trace
+
+    async def _read_responses(self) -> None:
+        """Resolve pending request futures with responses, until no request is pending."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                future, _ = self._pending[0]
+                queue = self._streams.get(future)
+                if queue is None:
+                    response = await self._get_output()
+                else:
+                    response = None
+                    await self._stream_output(future, queue)
+                trace = self._take_trace()
+                self._pending.popleft()
+                self._streams.pop(future, None)
+                if self._pending and not self._pending[0][1].done():
+                    self._pending[0][1].set_result(loop.time())
+                # The caller might have timed out or been cancelled in the meantime
+                if future.done() or queue is not None:
+                    if trace is not None:
+                        self._tracing.emit(trace)
+                    continue
+                future.set_result((response, trace))
+        except BaseException as e:
+            # The pipe is unusable from here on, fail everything still waiting on it
+            error = (
+                e
+                if isinstance(e, Exception)
+                else RuntimeError("Lean REPL reader was cancelled.")
+            )
+            aborted = LeanREPLAbortedError(str(error))
+            while self._pending:
+                future, at_head = self._pending.popleft()
+                if not future.done():
+                    # Only the request at the head was running when the pipe broke
+                    future.set_exception(error if at_head.done() else aborted)
+                queue = self._streams.pop(future, None)
+                if queue is not None:
+                    # Wake up the consumer, dropping items it will not get to anyway
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self._reader_task = None
+
+    async def _stream_output(
+        self, future: asyncio.Future, queue: asyncio.Queue
+    ) -> None:
+        """Read a response and put its items into the queue, followed by None, see `stream_file`."""
+        stream = _ResponseStream()
+        while not stream.done:
+            line = await self._readline_timeout()
+            if self._tracing is not None and line.strip():
+                self._tracing.line(line)
+            for item in stream.feed(line):
+                # Once the consumer is gone, only read on to keep the pipe in sync
+                if not future.done():
+                    await queue.put(item)
+        if self._tracing is not None:
+            self._tracing.response()
+        if not future.done():
+            future.set_result(None)
+            await queue.put(None)
+
+    async def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Run a command and return its response, see `receive_json`.
+
+        :param command: The Lean command to run.
+        :param env: The environment to run the command in, defaults to the handler's environment.
+        :param timeout: The maximum time to wait for a response, counted from when all earlier requests have
+            been answered.
+        """
+        if env is None and self.env is None and self.header_cache_size:
+            return await self._run_with_header(command, timeout)
+        data: Dict[str, Union[str, int]] = {"cmd": command}
+        if env is not None:
+            data["env"] = env.env_index if isinstance(env, LeanREPLEnvironment) else env
+        return await self._request(data, timeout)
+
+    async def _run_with_header(self, command: str, timeout: Optional[float] = None):
+        header, body, offset = split_header(command, opens=True)
+        env = await self._header_env(header, timeout) if header else None
+        if env is None:
+            # No header, or one that does not elaborate on its own, whose errors are reported as usual
+            return await self._request({"cmd": command}, timeout)
+        response, body_env = await self._request(
+            {"cmd": body, "env": env.env_index}, timeout
+        )
+        _shift_response(response, offset)
+        return response, body_env
+
+    async def _header_env(
+        self, header: str, timeout: Optional[float] = None
+    ) -> Optional[LeanREPLEnvironment]:
+        """The environment of a header, elaborated on first use, or None if it has errors."""
+        envs = self._header_envs
+        future = envs.get(header)
+        if future is not None:
+            envs.move_to_end(header)
+        else:
+            future = envs[header] = asyncio.ensure_future(
+                self._elaborate_header(header, timeout)
+            )
+
+            def forget(future: asyncio.Future) -> None:
+                # Elaborate again next time, e.g. after a timeout
+                if (future.cancelled() or future.exception() is not None) and envs.get(
+                    header
+                ) is future:
+                    del envs[header]
+
+            future.add_done_callback(forget)
+            if len(envs) > self.header_cache_size:
+                envs.popitem(last=False)
+        return await asyncio.shield(future)
+
+    async def _elaborate_header(
+        self, header: str, timeout: Optional[float] = None
+    ) -> Optional[LeanREPLEnvironment]:
+        response, env = await self._request({"cmd": header}, timeout)
+        return None if _header_failed(response) else env
+
+    async def run_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ):
+        """Run a tactic on a proof state and return its response, see `receive_json`."""
+        return await self._request(
+            {"tactic": tactic, "proofState": proof_state_idx}, timeout
+        )
+
+    async def run_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ):
+        """Check a file and return its response, see `receive_json`."""
+        return await self._request(
+            {"path": str(path.absolute()), "allTactics": all_tactics}, timeout
+        )
+
+    async def stream_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Check a file and yield its response piece by piece, while it is being read from the REPL.
+
+        See `LeanREPLHandler.stream_file`. Reading pauses once `REPL_STREAM_BUFFER` items are waiting for the
+        consumer, so memory stays bounded however large the response is. The request is pipelined with other
+        requests like `run_file`, closing the iterator early discards the rest of the response.
+
+        :param timeout: The maximum time to wait for the whole response, counted from when all earlier requests
+            have been answered. If it expires, the rest of the response is discarded once it arrives.
+        """
+        if self.supervisor is not None:
+            await self.supervisor.before_request_async()
+        try:
+            async for item in self._stream_file(path, all_tactics, timeout):
+                yield item
+        finally:
+            if self.supervisor is not None:
+                self.supervisor.request_finished()
+        if self.supervisor is not None:
+            await self.supervisor.after_request_async(self)
+
+    async def _stream_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        await self.await_process()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        at_head = loop.create_future()
+        queue: asyncio.Queue = asyncio.Queue(REPL_STREAM_BUFFER)
+        if not self._pending:
+            at_head.set_result(loop.time())
+        self._write_json({"path": str(path.absolute()), "allTactics": all_tactics})
+        self._pending.append((future, at_head))
+        self._streams[future] = queue
+        if self._reader_task is None:
+            self._reader_task = asyncio.ensure_future(self._read_responses())
+        try:
+            await self.process.stdin.drain()
+            deadline = None
+            if timeout is not None:
+                # Wait without timeout while queued, like `_pipelined_request`
+                await asyncio.wait(
+                    {future, at_head}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if at_head.done():
+                    deadline = at_head.result() + timeout
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(),
+                        deadline - loop.time() if deadline is not None else None,
+                    )
+                except asyncio.TimeoutError:
+                    raise LeanREPLTimeoutError(
+                        self._stderr.annotate(
+                            "Timeout while waiting for the Lean REPL."
+                        )
+                    )
+                if item is None:
+                    # Raises if reading failed
+                    future.result()
+                    break
+                field, value = item
+                value = _parse_stream_item(field, value, self.lazy_responses)
+                if self.supervisor is not None:
+                    if field == "env":
+                        self.supervisor.track({}, value)
+                    elif field == "sorries":
+                        self.supervisor.track(value, None)
+                yield field, value
+        finally:
+            if not future.done():
+                future.cancel()
+            # Unblock the reader if it waits for space in the queue
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def run_tactics(
+        self,
+        proof_state_idx: int,
+        tactics: List[str],
+        timeout: Optional[float] = None,
+    ) -> List[LeanREPLTacticResult]:
+        """Run several candidate tactics on one proof state, pipelined, see `run_tactics_many`.
+
+        :return: One result per tactic, in input order.
+        """
+        results = await self.run_tactics_many({proof_state_idx: tactics}, timeout)
+        return results[proof_state_idx]
+
+    async def run_tactics_many(
+        self, candidates: Dict[int, List[str]], timeout: Optional[float] = None
+    ) -> Dict[int, List[LeanREPLTacticResult]]:
+        """Run candidate tactics on several proof states, with all requests in flight at once.
+
+        :param candidates: The tactics to try, by the proof state to try them on.
+        :param timeout: The maximum time for each tactic, see `run_command`.
+        :return: One result per tactic, by proof state and in input order. A rejected or timed out tactic gives
+            a result with `error` set instead of raising.
+        """
+        requests = _tactic_requests(candidates)
+        # With a cache, each tactic goes through `_request`, which is supervised on its own
+        supervised = self.supervisor is not None and self._cache_session is None
+        if supervised:
+            await self.supervisor.before_request_async()
+        try:
+            results = await asyncio.gather(
+                *(
+                    self._timed_tactic(tactic, proof_state_idx, timeout)
+                    for proof_state_idx, tactic in requests
+                )
+            )
+        finally:
+            if supervised:
+                self.supervisor.request_finished()
+        if supervised:
+            await self.supervisor.after_request_async(self, len(requests))
+        return _group_tactic_results(candidates, results)
+
+    async def _timed_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ) -> LeanREPLTacticResult:
+        data: Dict[str, Union[str, int]] = {
+            "tactic": tactic,
+            "proofState": proof_state_idx,
+        }
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            if self._cache_session is None:
+                raw_response, elapsed, trace = await self._timed_raw_request(
+                    data, timeout
+                )
+                response, _ = self._parse_response(raw_response, trace)
+            else:
+                # Cache hits take no time in Lean, misses might include materializing the proof state
+                response, _ = await self._request(data, timeout)
+                elapsed = loop.time() - start
+        except TimeoutError as e:
+            return LeanREPLTacticResult(
+                tactic=tactic,
+                proof_state=proof_state_idx,
+                error=str(e),
+                elapsed=timeout,
+            )
+        return _tactic_result(tactic, proof_state_idx, response, elapsed)
 
     async def _readline_timeout(self, timeout: Optional[float] = None) -> str:
         try:
             line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
         except asyncio.TimeoutError:
-            raise TimeoutError("Timeout while reading from Lean REPL.")
-        return line.decode().strip()
-
-    async def _get_output(self, timeout: Optional[float] = None) -> str:
-        output = await self._readline_timeout(timeout)
-        # Since we know repl only returns valid json, we can use this while here
-        # We might want to have some way to ensure we do not get stuck
-        i = 0
+            raise LeanREPLTimeoutError(
+                self._stderr.annotate("Timeout while reading from Lean REPL.")
+            )
+        if not line:
+            # Lean usually says why it exited, give the drainer a moment to read the rest
+            await asyncio.wait({self._stderr_task}, timeout=REPL_STDERR_GRACE)
+            raise RuntimeError(self._stderr.annotate("Lean REPL closed its output."))
+        return line.decode()
+
+    @property
+    def recent_stderr(self) -> str:
+        """The last lines the current REPL process wrote to stderr, at most `REPL_STDERR_LINES`."""
+        return self._stderr.text()
+
+    async def _get_output(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Read and decode the next response from the Lean REPL."""
+        framer = _ResponseFramer()
+        tracing = self._tracing
         while True:
-            if i >= REPL_MAX_OUTPUT_LINES:
-                raise RuntimeError(f"Read more than {REPL_MAX_OUTPUT_LINES} lines!")
-            # If we have a valid json, we can stop reading
-            try:
-                json.loads(output)
-                break
-            except json.JSONDecodeError:
-                pass
-            output += await self._readline_timeout(timeout)
-            i += 1
-        return output
+            line = await self._readline_timeout(timeout)
+            if tracing is not None and line.strip():
+                tracing.line(line)
+            response = framer.feed(line)
+            if response is not None:
+                if tracing is not None:
+                    tracing.response()
+                return response
+
+    def _take_trace(self) -> Optional[LeanREPLTrace]:
+        """Take the trace of the response just read, to emit it once the response is parsed."""
+        return self._tracing.take() if self._tracing is not None else None
 
     def _has_sorries(self, response: Dict[str, str]):
         return "sorries" in response
 
     def _parse_sorries(self, response: Dict[str, str]) -> None:
+        if self.lazy_responses:
+            response["sorries"] = [
+                LeanREPLProofStateView(sorry) for sorry in response["sorries"]
+            ]
+            return
         for idx, sorry in enumerate(response["sorries"]):
             response["sorries"][idx] = LeanREPLProofState.model_validate(sorry)
 
@@ -130,6 +693,11 @@ class LeanREPLAsyncHandler:
         return "messages" in response
 
     def _parse_messages(self, response: Dict[str, str]) -> None:
+        if self.lazy_responses:
+            response["messages"] = [
+                LeanREPLMessageView(message) for message in response["messages"]
+            ]
+            return
         for idx, message in enumerate(response["messages"]):
             response["messages"][idx] = LeanREPLMessage.model_validate(message)
 
@@ -146,59 +714,120 @@ class LeanREPLAsyncHandler:
         :param timeout: The maximum time to wait for a response.
         :return: A tuple containing the JSON object and the environment.
         """
-        output = await self._get_output(timeout)
-        try:
-            response = json.loads(output)
-            # Env is not send in tactic mode
-            if "env" in response:
-                env = response["env"]
-                del response["env"]
+        if self._pending:
+            raise RuntimeError(
+                "Cannot receive manually while requests from run_* are pending."
+            )
+        response = await self._get_output(timeout)
+        return self._parse_response(response, self._take_trace())
+
+    def _parse_response(
+        self, response: Dict[str, Any], trace: Optional[LeanREPLTrace] = None
+    ) -> Optional[
+        Tuple[
+            Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+            Optional[LeanREPLEnvironment],
+        ]
+    ]:
+        if trace is not None:
+            start = time.perf_counter()
+            result = self._parse_response(response)
+            self._tracing.parsed(trace, start)
+            return result
+        # Env is not send in tactic mode
+        if "env" in response:
+            env = response["env"]
+            del response["env"]
+        else:
+            env = None
+        env = LeanREPLEnvironment(env_index=int(env)) if env is not None else None
+        # If we have top level proof states, we can simply return this
+        if self._is_next_proof_state(response):
+            if self.lazy_responses:
+                response = LeanREPLNextProofStateView(response)
             else:
-                env = None
-            env = LeanREPLEnvironment(env_index=int(env)) if env is not None else None
-            # If we have top level proof states, we can simply return this
-            if self._is_next_proof_state(response):
-                return LeanREPLNextProofState.model_validate(response), env
+                response = LeanREPLNextProofState.model_validate(response)
+        else:
             # If we have sorries, we can return proof states
             if self._has_sorries(response):
                 self._parse_sorries(response)
             if self._has_messages(response):
                 self._parse_messages(response)
-            return response, env
-        except json.JSONDecodeError:
-            return None
+        if self.supervisor is not None:
+            self.supervisor.track(response, env)
+        return response, env
 
     async def pickle_env(
         self, pickle_to: Path, env: LeanREPLEnvironment
     ) -> Optional[Tuple[Dict[str, str], LeanREPLEnvironment]]:
-        await self._send_json(
+        return await self._request(
             {"pickleTo": str(pickle_to.absolute()), "env": env.env_index}
         )
-        return await self.receive_json()
 
     async def pickle_proof_state(
         self, pickle_to: Path, proof_state_idx: int
     ) -> Optional[Dict[str, Union[str, int]]]:
-        await self._send_json(
+        return await self._request(
             {
                 "pickleTo": str(pickle_to.absolute()),
                 "proofState": proof_state_idx,
             }
         )
-        return await self.receive_json()
 
     async def unpickle_env(self, env_from: Path) -> None:
-        await self._send_json({"unpickleEnvFrom": str(env_from.absolute())})
-        return await self.receive_json()
+        return await self._request({"unpickleEnvFrom": str(env_from.absolute())})
 
     async def unpickle_proof_state(self, proof_state_from: Path) -> None:
-        await self._send_json(
+        return await self._request(
             {"unpickleProofStateFrom": str(proof_state_from.absolute())}
         )
-        return await self.receive_json()
+
+    async def checkpoint_proof_states(
+        self, proof_states: Iterable[int], directory: Path
+    ) -> LeanREPLProofStateCheckpoint:
+        """Pickle several proof states into a directory in one batch, to restore them with `restore_proof_states`.
+
+        :param proof_states: The indices of the proof states to checkpoint.
+        :param directory: The directory to write the pickled proof states to, created if missing.
+        """
+        paths = _checkpoint_paths(proof_states, directory)
+        responses = await asyncio.gather(
+            *(
+                self._raw_request({"pickleTo": str(path.absolute()), "proofState": idx})
+                for idx, path in paths.items()
+            )
+        )
+        _check_pickle_responses(responses, "pickle")
+        return LeanREPLProofStateCheckpoint(paths=paths)
+
+    async def restore_proof_states(
+        self, checkpoint: LeanREPLProofStateCheckpoint
+    ) -> Dict[int, int]:
+        """Unpickle checkpointed proof states, e.g. into another handler, in one batch.
+
+        :return: A mapping from the proof state indices at checkpoint time to the indices in this handler.
+        """
+        responses = await asyncio.gather(
+            *(
+                self._raw_request({"unpickleProofStateFrom": str(path.absolute())})
+                for path in checkpoint.paths.values()
+            )
+        )
+        _check_pickle_responses(responses, "unpickle")
+        return {
+            old_idx: response["proofState"]
+            for old_idx, response in zip(checkpoint.paths, responses)
+        }
 
     async def close(self):
         """Close the subprocess."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._stderr_task is not None:
+            self._stderr_task.cancel()
+        if self.process.returncode is not None:
+            # Exited on its own, e.g. crashed
+            return
         self.process.terminate()
         # Wait gracefully, kill if not done in 10 seconds
         try:
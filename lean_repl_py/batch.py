@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+from typing import Optional, Dict, Union, Tuple, List, Any, Generator
+from pydantic import BaseModel, ConfigDict
+from lean_repl_py.handler import (
+    LeanREPLHandler,
+    LeanREPLEnvironment,
+    LeanREPLMessage,
+    LeanREPLMessageView,
+    LeanREPLProofState,
+    LeanREPLProofStateView,
+    _shift_positions,
+)
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+from lean_repl_py.pool import LeanREPLPool
+
+# Candidates packed into one command by `verify_candidates`
+REPL_BATCH_SIZE = 100
+# Namespaces wrapping the candidates of a batch, numbered by position
+_NAMESPACE = "LeanREPLBatch"
+
+
+class LeanREPLCandidateResult(BaseModel):
+    """The outcome of one candidate of `verify_candidates`, positions refer to the candidate's own lines."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    messages: List[Union[LeanREPLMessage, LeanREPLMessageView]] = []
+    sorries: List[Union[LeanREPLProofState, LeanREPLProofStateView]] = []
+    # Set if the REPL rejected the command
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the candidate elaborated without errors and without sorries, i.e. its proofs are complete."""
+        return (
+            self.error is None
+            and not self.sorries
+            and all(message.severity != "error" for message in self.messages)
+        )
+
+
+def _pack(candidates: List[str]) -> Tuple[str, List[Tuple[int, int]]]:
+    """Wrap each candidate in a namespace of its own, followed by a marker, and join them into one command.
+
+    :return: The command and the first and last line of each candidate in it.
+    """
+    lines: List[str] = []
+    spans = []
+    for idx, candidate in enumerate(candidates):
+        name = f"{_NAMESPACE}{idx}"
+        lines.append(f"namespace {name}")
+        start = len(lines) + 1
+        lines += candidate.splitlines() or [""]
+        spans.append((start, len(lines)))
+        lines.append(f"end {name}")
+        # Only printed if Lean got through the candidate, e.g. an unterminated comment swallows the rest
+        lines.append(f'#print "{name}"')
+    return "\n".join(lines) + "\n", spans
+
+
+def _alone(response: Dict[str, Any]) -> LeanREPLCandidateResult:
+    return LeanREPLCandidateResult(
+        messages=response.get("messages", []),
+        sorries=response.get("sorries", []),
+        error=response.get("message"),
+    )
+
+
+def _demux(
+    response: Dict[str, Any], spans: List[Tuple[int, int]]
+) -> List[LeanREPLCandidateResult]:
+    """Assign the messages and sorries of a packed command to the candidates they are positioned in.
+
+    :return: The results of the leading candidates that can be trusted. From the first candidate whose block shows
+        trouble on, e.g. messages on the wrapper lines or a missing marker, the results are dropped, as the
+        candidate might have changed how Lean read the rest of the command.
+    """
+    if "message" in response:
+        return [_alone(response) for _ in spans]
+    results = [LeanREPLCandidateResult() for _ in spans]
+    # Each block starts with the namespace line before its candidate
+    block_starts = [start - 1 for start, _ in spans]
+    trusted = len(spans)
+    printed = set()
+    for field in ("messages", "sorries"):
+        for item in response.get(field, []):
+            line = item.pos.line
+            idx = max(bisect.bisect_right(block_starts, line) - 1, 0)
+            start, end = spans[idx]
+            if field == "messages" and item.severity == "info" and line == end + 2:
+                if item.data.strip().strip('"') == f"{_NAMESPACE}{idx}":
+                    printed.add(idx)
+                    continue
+            if not start <= line <= end:
+                trusted = min(trusted, idx)
+                continue
+            _shift_positions(item, 1 - start)
+            getattr(results[idx], field).append(item)
+    missing = [idx for idx in range(len(spans)) if idx not in printed]
+    return results[: min([trusted] + missing)]
+
+
+def _verify(
+    candidates: List[str], batch_size: int, results: List[Any]
+) -> Generator[str, Dict[str, Any], None]:
+    """Yield the commands verifying the candidates, receiving their responses, and fill in `results`.
+
+    A candidate that makes the rest of its batch untrustworthy is run on its own, and the candidates after it are
+    packed again, so every candidate gets the result it would get alone.
+    """
+    batches = [
+        list(range(start, min(start + batch_size, len(candidates))))
+        for start in range(0, len(candidates), batch_size)
+    ]
+    batches.reverse()
+    while batches:
+        batch = batches.pop()
+        if len(batch) == 1:
+            results[batch[0]] = _alone((yield candidates[batch[0]]))
+            continue
+        command, spans = _pack([candidates[idx] for idx in batch])
+        trusted = _demux((yield command), spans)
+        for idx, result in zip(batch, trusted):
+            results[idx] = result
+        if len(trusted) < len(batch):
+            if batch[len(trusted) + 1 :]:
+                batches.append(batch[len(trusted) + 1 :])
+            batches.append([batch[len(trusted)]])
+
+
+def verify_candidates(
+    handler: LeanREPLHandler,
+    candidates: List[str],
+    env: Union[LeanREPLEnvironment, int, None] = None,
+    batch_size: int = REPL_BATCH_SIZE,
+    timeout: Optional[float] = None,
+) -> List[LeanREPLCandidateResult]:
+    """Check many independent candidates, e.g. proofs of one theorem, packing them into few commands.
+
+    Each candidate is wrapped in a namespace of its own, so their declarations can share names, and up to
+    `batch_size` of them are run as one command. Messages and sorries are mapped back to the candidate they are
+    positioned in, with positions relative to the candidate. Candidates must not contain imports, nor change
+    global state that would leak into the candidates after them, e.g. with non-local `attribute` commands.
+
+    :param handler: The handler to run the commands on.
+    :param candidates: The Lean code of each candidate.
+    :param env: The environment to check the candidates in, e.g. one with the imports they need.
+    :param batch_size: The maximum number of candidates per command.
+    :param timeout: The maximum time for each command.
+    :return: One result per candidate, in input order.
+    """
+    results: List[Any] = [None] * len(candidates)
+    steps = _verify(candidates, batch_size, results)
+    response = None
+    try:
+        while True:
+            response, _ = handler.run_command(steps.send(response), env, timeout)
+    except StopIteration:
+        pass
+    return results
+
+
+async def verify_candidates_async(
+    runner: Union[LeanREPLAsyncHandler, LeanREPLPool],
+    candidates: List[str],
+    env: Union[LeanREPLEnvironment, int, None] = None,
+    batch_size: int = REPL_BATCH_SIZE,
+    timeout: Optional[float] = None,
+) -> List[LeanREPLCandidateResult]:
+    """Check many independent candidates on an async handler or a pool, see `verify_candidates`.
+
+    The batches are sent at once, so they are pipelined on a handler and spread over the workers of a pool if no
+    env is given.
+    """
+    results: List[Any] = [None] * len(candidates)
+
+    async def run(start: int) -> None:
+        chunk = candidates[start : start + batch_size]
+        chunk_results: List[Any] = [None] * len(chunk)
+        steps = _verify(chunk, batch_size, chunk_results)
+        response = None
+        try:
+            while True:
+                response, _ = await runner.run_command(
+                    steps.send(response), env, timeout
+                )
+        except StopIteration:
+            pass
+        results[start : start + batch_size] = chunk_results
+
+    await asyncio.gather(
+        *(run(start) for start in range(0, len(candidates), batch_size))
+    )
+    return results
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Dict, Tuple, List, Any, Iterable, Iterator, Set
+from pydantic import BaseModel
+from lean_repl_py.handler import (
+    LeanREPLEnvironment,
+    LeanREPLAbortedError,
+    LeanREPLMessage,
+    LeanREPLProofState,
+    split_header,
+    _shift_positions,
+)
+from lean_repl_py.pool import LeanREPLPool
+from lean_repl_py.snapshot import EnvSnapshotStore
+
+# Files in flight per worker, enough to keep each REPL busy while the results of the previous file are written
+_FILES_PER_WORKER = 2
+
+
+class LeanREPLFileResult(BaseModel):
+    """The outcome of checking one file with `check_files`, one line of its JSONL output."""
+
+    path: str
+    messages: List[LeanREPLMessage] = []
+    sorries: List[LeanREPLProofState] = []
+    # The `allTactics` entries, if requested
+    tactics: Optional[List[Dict[str, Any]]] = None
+    # Set if the REPL rejected the request or did not answer in time
+    error: Optional[str] = None
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and all(
+            message.severity != "error" for message in self.messages
+        )
+
+
+class LeanREPLCheckStats(BaseModel):
+    checked: int
+    skipped: int
+    failed: int
+    elapsed: float
+    throughput: float
+
+
+def lean_files(paths: Iterable[Path]) -> List[Path]:
+    """Expand directories into the `.lean` files below them, skipping lake build directories."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files += sorted(
+                file for file in path.rglob("*.lean") if ".lake" not in file.parts
+            )
+        else:
+            files.append(path)
+    return [file.resolve() for file in files]
+
+
+def _load_checkpoint(output: Path) -> Set[str]:
+    """Read the paths already checked from a previous run's output, dropping a partly written last line."""
+    if not output.exists():
+        return set()
+    data = output.read_bytes()
+    if data and not data.endswith(b"\n"):
+        # Interrupted while writing, truncate so appended results start on a new line
+        data = data[: data.rfind(b"\n") + 1]
+        output.write_bytes(data)
+    return {
+        LeanREPLFileResult.model_validate_json(line).path
+        for line in data.decode().splitlines()
+        if line.strip()
+    }
+
+
+class _FileChecker:
+    def __init__(
+        self,
+        pool: LeanREPLPool,
+        snapshots: EnvSnapshotStore,
+        all_tactics: bool,
+        timeout: Optional[float],
+    ):
+        self.pool = pool
+        self.snapshots = snapshots
+        self.all_tactics = all_tactics
+        self.timeout = timeout
+        # Header environments, one handle per worker, or None if the header did not elaborate, with the worker
+        # restarts they were restored after
+        self._headers: Dict[str, Tuple[asyncio.Future, List[int]]] = {}
+
+    async def _header_envs(self, header: str) -> Optional[List[LeanREPLEnvironment]]:
+        restored = self._headers.get(header)
+        if restored is None or restored[1] != self.pool.restarts:
+            # A restarted worker lost its copy, restore again
+            restored = self._headers[header] = (
+                asyncio.ensure_future(self._restore(header)),
+                list(self.pool.restarts),
+            )
+        return await asyncio.shield(restored[0])
+
+    async def _restore(self, header: str) -> Optional[List[LeanREPLEnvironment]]:
+        try:
+            return await self.pool.restore_env(self.snapshots, header)
+        except ValueError:
+            # Let Lean report the broken header for each file, by checking them whole
+            return None
+
+    async def check(self, path: Path) -> LeanREPLFileResult:
+        """Check a file, recording a timeout or crash as the file's `error`.
+
+        A file queued behind one that made its worker hang or crash is checked again after the restart.
+        """
+        start = time.monotonic()
+        header, body, offset = split_header(path.read_text())
+        for attempt in range(2):
+            try:
+                return await self._check(path, header, body, offset, start)
+            except LeanREPLAbortedError as e:
+                error = e
+            except (TimeoutError, RuntimeError) as e:
+                # The pool restarted the worker, so the files queued behind this one do not wait forever
+                error = e
+                break
+        return LeanREPLFileResult(
+            path=str(path), error=str(error), elapsed=time.monotonic() - start
+        )
+
+    async def _check(
+        self, path: Path, header: str, body: str, offset: int, start: float
+    ) -> LeanREPLFileResult:
+        envs = await self._header_envs(header) if header else None
+        if envs is None:
+            response, _ = await self.pool.run_file(path, self.all_tactics, self.timeout)
+            offset = 0
+        else:
+            response, _ = await self.pool.run_command_replicated(
+                body, envs, self.timeout, self.all_tactics
+            )
+        result = LeanREPLFileResult(
+            path=str(path),
+            messages=response.get("messages", []),
+            sorries=response.get("sorries", []),
+            tactics=response.get("tactics") if self.all_tactics else None,
+            error=response.get("message"),
+            elapsed=time.monotonic() - start,
+        )
+        if offset:
+            # The body was run on its own, report positions in the whole file
+            for item in [*result.messages, *result.sorries, *(result.tactics or [])]:
+                _shift_positions(item, offset)
+        return result
+
+
+async def check_files(
+    paths: Iterable[Path],
+    output: Path,
+    workers: Optional[int] = None,
+    project_path: Optional[Path] = None,
+    snapshots: Optional[EnvSnapshotStore] = None,
+    all_tactics: bool = False,
+    timeout: Optional[float] = None,
+) -> LeanREPLCheckStats:
+    """Check many Lean files on a pool of REPL processes, appending one `LeanREPLFileResult` per file to a JSONL file.
+
+    Files sharing a header of `import` lines elaborate it once: it is pickled and unpickled on every worker, see
+    `EnvSnapshotStore`, and only the body of each file is run in that environment. Results are written as soon as
+    each file is done. Files already in `output`, e.g. from an interrupted run, are skipped, so running again
+    resumes where the previous run stopped.
+
+    :param paths: The files to check, directories are searched for `.lean` files.
+    :param output: The JSONL file to append results to.
+    :param workers: The number of REPL processes, defaults to the number of CPUs.
+    :param project_path: An optional path for a Lean project directory, see `LeanREPLPool`.
+    :param snapshots: An optional store to keep header environments in across runs, defaults to a temporary one.
+    :param all_tactics: Also record the tactics of each file.
+    :param timeout: The maximum time to check each file, a file timing out is recorded with an `error` and its
+        worker is restarted. Files crashing the REPL are recorded with an `error` too.
+    """
+    start = time.monotonic()
+    done = _load_checkpoint(output)
+    all_files = lean_files(paths)
+    files = [file for file in all_files if str(file) not in done]
+    skipped = len(all_files) - len(files)
+    checked = failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        if snapshots is None:
+            snapshots = EnvSnapshotStore(Path(directory), project_path)
+        pool = LeanREPLPool(workers, project_path, restart_failed=True)
+        checker = _FileChecker(pool, snapshots, all_tactics, timeout)
+        todo: Iterator[Path] = iter(files)
+        try:
+            with output.open("a") as f:
+
+                async def run() -> None:
+                    nonlocal checked, failed
+                    for path in todo:
+                        result = await checker.check(path)
+                        f.write(result.model_dump_json(by_alias=True) + "\n")
+                        f.flush()
+                        checked += 1
+                        if not result.ok:
+                            failed += 1
+
+                await asyncio.gather(
+                    *(
+                        run()
+                        for _ in range(min(len(files), pool.size * _FILES_PER_WORKER))
+                    )
+                )
+        finally:
+            await pool.close()
+    elapsed = time.monotonic() - start
+    return LeanREPLCheckStats(
+        checked=checked,
+        skipped=skipped,
+        failed=failed,
+        elapsed=elapsed,
+        throughput=checked / elapsed if elapsed > 0 else 0.0,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="lean-repl-py-check",
+        description="Check Lean files on a pool of REPL processes, writing one JSON result per file.",
+    )
+    parser.add_argument("paths", nargs="+", type=Path, help="Files or directories.")
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    parser.add_argument("-j", "--workers", type=int)
+    parser.add_argument("--project", type=Path, help="A Lean project directory.")
+    parser.add_argument(
+        "--snapshots", type=Path, help="Keep header environments in this directory."
+    )
+    parser.add_argument("--all-tactics", action="store_true")
+    parser.add_argument("--timeout", type=float, help="Seconds per file.")
+    args = parser.parse_args(argv)
+    stats = asyncio.run(
+        check_files(
+            args.paths,
+            args.output,
+            workers=args.workers,
+            project_path=args.project,
+            snapshots=(
+                EnvSnapshotStore(args.snapshots, args.project)
+                if args.snapshots is not None
+                else None
+            ),
+            all_tactics=args.all_tactics,
+            timeout=args.timeout,
+        )
+    )
+    print(
+        f"Checked {stats.checked} files ({stats.skipped} done before, {stats.failed} failed) "
+        f"in {stats.elapsed:.1f}s, {stats.throughput:.2f} files/s."
+    )
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Union, Tuple, List, Any, Generator
+from pydantic import BaseModel
+
+# Response fields holding indices that were produced by a request
+_ENV = "env"
+_PROOF_STATE = "proofState"
+
+
+def toolchain_version(project_path: Optional[Path] = None) -> str:
+    """Identify the REPL and Lean toolchain a handler runs with.
+
+    Combines the toolchain of the bundled repl with the toolchain and dependency manifest of the project, so
+    cached responses are not reused after upgrading Lean or e.g. Mathlib.
+    """
+    repl_path = Path(__file__).parent.parent / "repl"
+    parts = []
+    for path in (
+        repl_path / "lean-toolchain",
+        *(
+            (project_path / "lean-toolchain", project_path / "lake-manifest.json")
+            if project_path is not None
+            else ()
+        ),
+    ):
+        parts.append(path.read_text().strip() if path.exists() else "")
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class LeanREPLCacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    memory_entries: int
+
+
+class LeanREPLCache:
+    def __init__(self, path: Optional[Path] = None, max_memory_entries: int = 10000):
+        """A content-addressed cache of REPL responses, shareable between handlers.
+
+        Responses are kept in an in-memory LRU and, if a path is given, in an SQLite database so they survive
+        across runs. Pass the cache to `LeanREPLHandler` or `LeanREPLAsyncHandler` to use it for `run_*` calls.
+
+        :param path: An optional path for the SQLite database.
+        :param max_memory_entries: The maximum number of responses kept in memory.
+        """
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, response: str) -> None:
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached response for a key, if any."""
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    response = row[0]
+                    self._remember(key, response)
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(response)
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        encoded = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, encoded)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                    (key, encoded),
+                )
+                self._db.commit()
+
+    def stats(self) -> LeanREPLCacheStats:
+        return LeanREPLCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            memory_entries=len(self._memory),
+        )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class _CacheSession:
+    """Per-process bookkeeping for using a `LeanREPLCache` from one handler.
+
+    Env and proof state indices are only valid in the process that created them, so requests are keyed on the
+    identity of the request that produced their env or proof state instead of on the index itself. A cache hit
+    can thus reference envs and proof states that do not exist in this process. They are handed out as negative
+    virtual indices and only created in Lean, by replaying the requests that produced them, once a request
+    using them misses the cache.
+    """
+
+    def __init__(self, cache: LeanREPLCache, version: str):
+        self.cache = cache
+        self.version = version
+        # (field, index) -> identity, for real (non-negative) and virtual (negative) indices
+        self._identities: Dict[Tuple[str, int], str] = {}
+        # identity -> real index in this process
+        self._real: Dict[str, int] = {}
+        # cache key -> (request, field of the env or proof state it was run on), only for requests that produced
+        # envs or proof states, least recently used first and bounded like the cache's memory
+        self._recipes: "OrderedDict[str, Tuple[Dict[str, Any], Optional[str]]]" = (
+            OrderedDict()
+        )
+        # cache key -> the (field, index) entries of `_identities` it produced, dropped with its recipe
+        self._produced: Dict[str, List[Tuple[str, int]]] = {}
+        self._next_virtual = -1
+
+    @staticmethod
+    def _parent_field(data: Dict[str, Any]) -> Optional[str]:
+        if "cmd" in data:
+            return _ENV
+        if "tactic" in data:
+            return _PROOF_STATE
+        return None
+
+    def key(self, data: Dict[str, Any]) -> Optional[str]:
+        """Compute the cache key of a request, or None if it cannot be cached."""
+        if not any(field in data for field in ("cmd", "tactic", "path")):
+            return None
+        request = dict(data)
+        origin = "root"
+        field = self._parent_field(data)
+        if field is not None and data.get(field) is not None:
+            origin = self._identities.get((field, data[field]))
+            if origin is None:
+                # Created outside of the cache, e.g. by send_command, so its lineage is unknown
+                return None
+            del request[field]
+        if "path" in data:
+            # The response depends on the file content, not its name
+            request["content"] = hashlib.sha256(
+                Path(data["path"]).read_bytes()
+            ).hexdigest()
+        canonical = json.dumps(
+            {"request": request, "origin": origin, "version": self.version},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _remember(self, key: str, data: Dict[str, Any]) -> None:
+        """Keep the request that produced a key's envs and proof states, to replay it, evicting the oldest."""
+        self._recipes[key] = (dict(data), self._parent_field(data))
+        self._recipes.move_to_end(key)
+        while len(self._recipes) > self.cache.max_memory_entries:
+            evicted, _ = self._recipes.popitem(last=False)
+            # Its indices can no longer be created or looked up, requests using them are sent to Lean as they are
+            for field_index in self._produced.pop(evicted, []):
+                identity = self._identities.pop(field_index, None)
+                if identity is not None:
+                    self._real.pop(identity, None)
+
+    def _bind(self, field: str, index: int, identity: str) -> None:
+        self._identities[(field, index)] = identity
+        self._produced.setdefault(identity.split("/", 1)[0], []).append((field, index))
+
+    @staticmethod
+    def _slots(response: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """List (slot name, field, object holding the field) for all indices a response produced."""
+        slots = []
+        if _ENV in response:
+            slots.append((_ENV, _ENV, response))
+        if _PROOF_STATE in response:
+            slots.append((_PROOF_STATE, _PROOF_STATE, response))
+        for list_name in ("sorries", "tactics"):
+            for idx, entry in enumerate(response.get(list_name, [])):
+                if _PROOF_STATE in entry:
+                    slots.append((f"{list_name}/{idx}", _PROOF_STATE, entry))
+        return slots
+
+    def lookup(self, key: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a key, with indices usable from this handler.
+
+        :param data: The request the key was computed for.
+        """
+        response = self.cache.get(key)
+        if response is None:
+            return None
+        slots = self._slots(response)
+        if slots:
+            self._remember(key, data)
+        for slot, field, holder in slots:
+            identity = f"{key}/{slot}"
+            index = self._real.get(identity)
+            if index is None:
+                index = self._next_virtual
+                self._next_virtual -= 1
+                self._bind(field, index, identity)
+            holder[field] = index
+        return response
+
+    def record(
+        self, key: Optional[str], data: Dict[str, Any], response: Dict[str, Any]
+    ) -> None:
+        """Register the indices of a response produced by Lean, and store it in the cache.
+
+        :param data: The request the key was computed for.
+        """
+        if key is None:
+            return
+        slots = self._slots(response)
+        if slots:
+            self._remember(key, data)
+        for slot, field, holder in slots:
+            identity = f"{key}/{slot}"
+            self._bind(field, holder[field], identity)
+            self._real[identity] = holder[field]
+        self.cache.put(key, response)
+
+    def forget_process(
+        self, remap: Optional[Dict[Tuple[str, int], int]] = None
+    ) -> None:
+        """Drop all real indices, after the handler's REPL process was replaced by a new one.
+
+        Virtual indices stay valid, they are replayed in the new process once needed.
+
+        :param remap: The new index of envs and proof states carried over into the new process, by field and old
+            index. They keep their identity.
+        """
+        identities = self._identities
+        self._real.clear()
+        self._identities = {
+            (field, index): identity
+            for (field, index), identity in identities.items()
+            if index < 0
+        }
+        self._produced = {}
+        for (field, index), identity in self._identities.items():
+            self._produced.setdefault(identity.split("/", 1)[0], []).append(
+                (field, index)
+            )
+        for (field, index), new_index in (remap or {}).items():
+            identity = identities.get((field, index))
+            if identity is not None:
+                self._bind(field, new_index, identity)
+                self._real[identity] = new_index
+
+    def materialize(
+        self, field: str, index: int
+    ) -> Generator[Dict[str, Any], Dict[str, Any], int]:
+        """Yield the requests needed to create a virtual index in Lean, receiving their raw responses.
+
+        :return: The real index corresponding to `index`.
+        """
+        if index >= 0:
+            return index
+        identity = self._identities.get((field, index))
+        if identity is None:
+            raise RuntimeError(
+                f"Cannot create {field} {index}, the request producing it was evicted from the cache session."
+            )
+        if identity in self._real:
+            return self._real[identity]
+        key, slot = identity.split("/", 1)
+        recipe, parent_field = self._recipes[key]
+        self._recipes.move_to_end(key)
+        request = copy.deepcopy(recipe)
+        if parent_field is not None and request.get(parent_field) is not None:
+            request[parent_field] = yield from self.materialize(
+                parent_field, request[parent_field]
+            )
+        response = yield request
+        self.record(key, recipe, response)
+        if identity not in self._real:
+            raise RuntimeError(f"Replaying request did not produce {slot}.")
+        return self._real[identity]
+
+    def prepare(
+        self, data: Dict[str, Union[str, int]]
+    ) -> Generator[Dict[str, Any], Dict[str, Any], Dict[str, Union[str, int]]]:
+        """Materialize the env or proof state a request runs on, returning the request to send to Lean."""
+        field = self._parent_field(data)
+        if field is None or data.get(field) is None or data[field] >= 0:
+            return data
+        data = dict(data)
+        data[field] = yield from self.materialize(field, data[field])
+        return data
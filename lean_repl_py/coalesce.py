@@ -0,0 +1,101 @@
+import asyncio
+import copy
+import json
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Any, Callable, Awaitable
+
+
+def _request_key(data: Dict[str, Any], timeout: Optional[float]) -> str:
+    """The key under which identical requests share an evaluation, the timeout included as it decides the outcome."""
+    return json.dumps([data, timeout], sort_keys=True, ensure_ascii=False)
+
+
+class _SingleFlight:
+    """Concurrent identical requests share one in-flight evaluation, which needs no storage or invalidation.
+
+    The first request runs, the ones arriving while it is in flight wait for it and get a copy of its result, or
+    its error. Once it is done, the next identical request runs again.
+    """
+
+    def __init__(self, share: Callable[[Any], Any] = copy.deepcopy):
+        """:param share: Makes the result handed to each waiting request, so callers can modify what they get."""
+        self.share = share
+        self._in_flight: Dict[str, List[asyncio.Future]] = {}
+        # Evaluations saved, i.e. requests that got the result of one already in flight
+        self.coalesced = 0
+
+    async def run(self, key: str, make: Callable[[], Awaitable[Any]]) -> Any:
+        followers = self._in_flight.get(key)
+        if followers is not None:
+            follower = asyncio.get_running_loop().create_future()
+            followers.append(follower)
+            self.coalesced += 1
+            return await follower
+        followers = self._in_flight[key] = []
+        task = asyncio.ensure_future(make())
+
+        def share(task: asyncio.Future) -> None:
+            del self._in_flight[key]
+            for follower in followers:
+                if follower.done():
+                    continue
+                if task.cancelled():
+                    follower.cancel()
+                elif task.exception() is not None:
+                    follower.set_exception(task.exception())
+                else:
+                    follower.set_result(self.share(task.result()))
+
+        # Runs before the first request resumes, so the copies are taken from the untouched result
+        task.add_done_callback(share)
+        # Cancelling the first request leaves the evaluation running for the others
+        return await asyncio.shield(task)
+
+
+class _ThreadSingleFlight:
+    """`_SingleFlight` for `concurrent.futures`, shared between threads."""
+
+    def __init__(self, share: Callable[[Any], Any] = copy.deepcopy):
+        self.share = share
+        self._in_flight: Dict[str, List[Future]] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def run(self, key: str, submit: Callable[[], Future]) -> Future:
+        """Submit the request, or return a future of a copy of the identical request's result if one is in flight."""
+        with self._lock:
+            followers = self._in_flight.get(key)
+            if followers is not None:
+                follower: Future = Future()
+                followers.append(follower)
+                self.coalesced += 1
+                return follower
+            followers = self._in_flight[key] = []
+        try:
+            future = submit()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            for follower in followers:
+                if follower.set_running_or_notify_cancel():
+                    follower.set_exception(e)
+            raise
+
+        def share(future: Future) -> None:
+            with self._lock:
+                del self._in_flight[key]
+            for follower in followers:
+                if not follower.set_running_or_notify_cancel():
+                    continue
+                if future.cancelled():
+                    follower.set_exception(
+                        RuntimeError("The shared request was cancelled.")
+                    )
+                elif future.exception() is not None:
+                    follower.set_exception(future.exception())
+                else:
+                    follower.set_result(self.share(future.result()))
+
+        future.add_done_callback(share)
+        return future
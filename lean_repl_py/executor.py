@@ -0,0 +1,262 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Optional, Dict, Union, Tuple, List, Any, Callable
+from lean_repl_py.handler import (
+    LeanREPLHandler,
+    LeanREPLEnvironment,
+    LeanREPLNextProofState,
+    LeanREPLTacticResult,
+)
+from lean_repl_py.coalesce import _ThreadSingleFlight, _request_key
+from lean_repl_py.launch import resolve_repl
+from lean_repl_py.pool import LeanREPLPoolStats, _WorkerHandles
+from lean_repl_py.tracing import LeanREPLTracer
+
+# A call waiting for its worker thread, None tells the thread to stop
+_WorkItem = Optional[Tuple[Future, Callable[..., Any], tuple, Dict[str, Any]]]
+
+
+class LeanREPLExecutor(_WorkerHandles, Executor):
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        project_path: Optional[Path] = None,
+        timeout: Optional[float] = None,
+        tracer: Optional[LeanREPLTracer] = None,
+        binary_io: bool = False,
+        coalesce: bool = False,
+    ):
+        """A `concurrent.futures.Executor` over several `LeanREPLHandler` processes, for threaded code.
+
+        Each process is owned by one thread, which runs the calls submitted to it one after another. `submit` and
+        `map` take a function receiving the handler as its first argument and run it on the least loaded
+        worker, e.g. `executor.submit(LeanREPLHandler.run_command, "def f := 1")`. `run_command`, `run_tactic`,
+        `run_file` and `run_tactics` return futures of the usual results, with pool-wide env and proof state
+        handles like `LeanREPLPool`, and run on the worker owning the env or proof state they reference.
+
+        :param workers: The number of REPL processes, defaults to the number of CPUs.
+        :param project_path: An optional path for a Lean project directory, passed on to every handler.
+        :param timeout: An optional timeout for every response, see `LeanREPLHandler`.
+        :param tracer: An optional tracer shared by all handlers, called from the worker threads.
+        :param binary_io: Read responses as bytes, see `LeanREPLHandler`.
+        :param coalesce: If set, `run_command`, `run_tactic` and `run_file` calls identical to one that is queued or
+            running, with the same timeout, are not run again but get a copy of its result, see `LeanREPLPool`.
+        """
+        self.size = workers if workers is not None else os.cpu_count() or 1
+        if self.size < 1:
+            raise ValueError("Executor needs at least 1 worker.")
+        # Build the repl once here, not in every worker
+        resolve_repl(project_path)
+        self.handlers = [
+            LeanREPLHandler(
+                project_path, timeout=timeout, tracer=tracer, binary_io=binary_io
+            )
+            for _ in range(self.size)
+        ]
+        self._queues: List["queue.SimpleQueue[_WorkItem]"] = [
+            queue.SimpleQueue() for _ in range(self.size)
+        ]
+        self._queue_depths = [0] * self.size
+        self._round_robin = itertools.cycle(range(self.size))
+        # Guards the queue depths, counters and shutdown flag, which submitting and worker threads share
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._completed = 0
+        self._failed = 0
+        self._started = time.monotonic()
+        self._single_flight = _ThreadSingleFlight() if coalesce else None
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(worker_idx,),
+                name=f"lean-repl-{worker_idx}",
+                daemon=True,
+            )
+            for worker_idx in range(self.size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, worker_idx: int) -> None:
+        handler = self.handlers[worker_idx]
+        try:
+            while True:
+                item = self._queues[worker_idx].get()
+                if item is None:
+                    return
+                future, fn, args, kwargs = item
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(handler, *args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+                with self._lock:
+                    self._queue_depths[worker_idx] -= 1
+                    if future.cancelled() or future.exception() is not None:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+        finally:
+            handler.close()
+
+    def submit_to(
+        self, worker_idx: int, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+    ) -> Future:
+        """Run `fn(handler, *args, **kwargs)` on the handler of a specific worker."""
+        future: Future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot schedule new calls after shutdown.")
+            self._queue_depths[worker_idx] += 1
+            self._queues[worker_idx].put((future, fn, args, kwargs))
+        return future
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        """Run `fn(handler, *args, **kwargs)` on the handler of the least loaded worker."""
+        with self._lock:
+            worker_idx = self._least_loaded()
+        return self.submit_to(worker_idx, fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        """Stop the workers once they ran the calls already submitted, and close their REPL processes.
+
+        :param wait: Wait until the workers are done.
+        :param cancel_futures: Cancel the calls that did not start yet, instead of running them.
+        """
+        with self._lock:
+            if not self._shutdown:
+                self._shutdown = True
+                for worker_idx, work in enumerate(self._queues):
+                    while cancel_futures:
+                        try:
+                            item = work.get_nowait()
+                        except queue.Empty:
+                            break
+                        item[0].cancel()
+                        self._queue_depths[worker_idx] -= 1
+                        self._failed += 1
+                    work.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _call(self, worker_idx: int, fn: Callable[..., Any], *args: Any) -> Future:
+        """Run a handler method on a worker, translating the indices in its result into pool-wide handles."""
+        return self.submit_to(
+            worker_idx,
+            lambda handler: self._translate(worker_idx, *fn(handler, *args)),
+        )
+
+    def _coalesced(
+        self,
+        data: Dict[str, Any],
+        timeout: Optional[float],
+        submit: Callable[[], Future],
+    ) -> Future:
+        """Submit a call, unless an identical one is in flight whose result it can share, see `coalesce`."""
+        if self._single_flight is None:
+            return submit()
+        return self._single_flight.run(_request_key(data, timeout), submit)
+
+    def _least_loaded_call(self, fn: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            worker_idx = self._least_loaded()
+        return self._call(worker_idx, fn, *args)
+
+    def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Run a command on the worker owning `env`, or on the least loaded worker if no env is given."""
+        if env is None:
+            return self._coalesced(
+                {"cmd": command},
+                timeout,
+                lambda: self._least_loaded_call(
+                    LeanREPLHandler.run_command, command, None, timeout
+                ),
+            )
+        handle = env.env_index if isinstance(env, LeanREPLEnvironment) else env
+        worker_idx, local_idx = self._from_handle(handle)
+        return self._coalesced(
+            {"cmd": command, "env": handle},
+            timeout,
+            lambda: self._call(
+                worker_idx, LeanREPLHandler.run_command, command, local_idx, timeout
+            ),
+        )
+
+    def run_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ) -> Future:
+        """Run a tactic on the worker owning the proof state."""
+        worker_idx, local_idx = self._from_handle(proof_state_idx)
+        return self._coalesced(
+            {"tactic": tactic, "proofState": proof_state_idx},
+            timeout,
+            lambda: self._call(
+                worker_idx, LeanREPLHandler.run_tactic, tactic, local_idx, timeout
+            ),
+        )
+
+    def run_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ) -> Future:
+        """Check a file on the least loaded worker."""
+        return self._coalesced(
+            {"path": str(path.absolute()), "allTactics": all_tactics},
+            timeout,
+            lambda: self._least_loaded_call(
+                LeanREPLHandler.run_file, path, all_tactics, timeout
+            ),
+        )
+
+    def run_tactics(
+        self,
+        proof_state_idx: int,
+        tactics: List[str],
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Run several candidate tactics on the worker owning the proof state, pipelined.
+
+        :return: A future of one `LeanREPLTacticResult` per tactic, in input order.
+        """
+        worker_idx, local_idx = self._from_handle(proof_state_idx)
+
+        def run(handler: LeanREPLHandler) -> List[LeanREPLTacticResult]:
+            results = handler.run_tactics(local_idx, tactics, timeout)
+            for result in results:
+                result.proof_state = proof_state_idx
+                if isinstance(result.next_proof_state, LeanREPLNextProofState):
+                    result.next_proof_state.proof_state = self._to_handle(
+                        worker_idx, result.next_proof_state.proof_state
+                    )
+            return results
+
+        return self.submit_to(worker_idx, run)
+
+    def stats(self) -> LeanREPLPoolStats:
+        uptime = time.monotonic() - self._started
+        with self._lock:
+            return LeanREPLPoolStats(
+                workers=self.size,
+                busy_workers=sum(1 for depth in self._queue_depths if depth),
+                queue_depth=sum(self._queue_depths),
+                worker_queue_depths=list(self._queue_depths),
+                completed=self._completed,
+                failed=self._failed,
+                uptime=uptime,
+                throughput=self._completed / uptime if uptime > 0 else 0.0,
+                coalesced=self._single_flight.coalesced
+                if self._single_flight is not None
+                else 0,
+            )
@@ -1,11 +1,256 @@
 import subprocess
 import json
+import re
+import selectors
+import threading
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
-from pydantic import BaseModel, Field, model_validator
-from typing import Optional, Dict, Union, Tuple, Literal, Any
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import (
+    Optional,
+    Dict,
+    Union,
+    Tuple,
+    Literal,
+    Any,
+    List,
+    Iterable,
+    Iterator,
+    Deque,
+    BinaryIO,
+    TYPE_CHECKING,
+)
+from lean_repl_py.cache import LeanREPLCache, _CacheSession, toolchain_version
+from lean_repl_py.launch import LEAN_REPL_PATH, resolve_repl
+from lean_repl_py.tracing import LeanREPLTrace, LeanREPLTracer, _TraceRecorder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    from lean_repl_py.supervisor import LeanREPLSupervisor
 
 # Max lines a single repl output is expected to be, will raise if longer than this
 REPL_MAX_OUTPUT_LINES = 10000
+# Max requests the synchronous handler writes ahead of the responses it has read, when batching requests
+REPL_PIPELINE_WINDOW = 32
+# Bytes read from the pipe at a time by handlers with `binary_io`, into a buffer reused for every read
+REPL_READ_CHUNK = 1 << 16
+# Lines of stderr kept per REPL process, and the longest line kept whole
+REPL_STDERR_LINES = 100
+REPL_STDERR_LINE_LENGTH = 4096
+# Seconds to wait for the rest of stderr once the REPL closed its output, it usually says why it exited
+REPL_STDERR_GRACE = 1.0
+
+# JSON string literals, which never span lines in the REPL output as newlines are escaped
+_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+# Top-level lists of a response that are streamed element by element, see `LeanREPLHandler.stream_file`
+_STREAMED_FIELDS = ("messages", "sorries", "tactics")
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_SEPARATORS = re.compile(r"[ \t\r\n,]*")
+_DECODER = json.JSONDecoder()
+# The blank line the REPL ends every response with
+_FRAME_END = b"\n\n"
+# Returned by `_ResponseStream._step` for progress without a value
+_NOTHING = object()
+
+
+class _ResponseFramer:
+    """Collects REPL output lines until they form one complete JSON value.
+
+    Tracks the bracket nesting depth of each new line only, so a response is decoded exactly once, when its
+    outermost object closes, instead of re-parsing the accumulated output after every line.
+    """
+
+    def __init__(self):
+        self.lines: list[str] = []
+        self.depth = 0
+
+    def feed(self, line: str) -> Optional[Any]:
+        """Add a line of output, returning the decoded response once it is complete."""
+        line = line.strip()
+        if not line:
+            return None
+        self.lines.append(line)
+        if len(self.lines) > REPL_MAX_OUTPUT_LINES:
+            raise RuntimeError(f"Read more than {REPL_MAX_OUTPUT_LINES} lines!")
+        structure = _JSON_STRING.sub("", line)
+        self.depth += (
+            structure.count("{")
+            + structure.count("[")
+            - structure.count("}")
+            - structure.count("]")
+        )
+        if self.depth > 0:
+            return None
+        try:
+            response = json.loads("".join(self.lines))
+        except json.JSONDecodeError:
+            # Not a complete value after all, keep reading like before
+            return None
+        self.lines = []
+        self.depth = 0
+        return response
+
+
+class _ResponseStream:
+    """Incrementally decodes one REPL response object, field by field, as its lines arrive.
+
+    The elements of the top-level lists in `_STREAMED_FIELDS` are returned one at a time, so only the element
+    currently being read is held in memory, not the whole response. Other fields are returned once their value
+    is complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.state = "open"
+        self.field: Optional[str] = None
+        # Lines read since the last value was decoded
+        self.lines = 0
+        self.done = False
+
+    def feed(self, line: str) -> List[Tuple[str, Any]]:
+        """Add a line of output, returning the `(field, value)` pairs it completed."""
+        if self.done or not line.strip():
+            return []
+        self.lines += 1
+        if self.lines > REPL_MAX_OUTPUT_LINES:
+            raise RuntimeError(
+                f"Read more than {REPL_MAX_OUTPUT_LINES} lines for one value!"
+            )
+        self.text = self.text[self.pos :] + line
+        self.pos = 0
+        items = []
+        while not self.done:
+            item = self._step()
+            if item is None:
+                break
+            if item is not _NOTHING:
+                items.append(item)
+        return items
+
+    def _skip(self, pattern: re.Pattern) -> Optional[str]:
+        """Skip whitespace (and commas), returning the next character or None if more input is needed."""
+        pos = pattern.match(self.text, self.pos).end()
+        if pos == len(self.text):
+            return None
+        self.pos = pos
+        return self.text[pos]
+
+    def _decode(self) -> Any:
+        """Decode the value at the current position, raising `ValueError` if it is incomplete."""
+        value, self.pos = _DECODER.raw_decode(self.text, self.pos)
+        self.lines = 0
+        return value
+
+    def _step(self) -> Optional[Any]:
+        """Advance by one token or value, returning None if more input is needed."""
+        start = self.pos
+        try:
+            if self.state == "open":
+                char = self._skip(_WHITESPACE)
+                if char is None:
+                    return None
+                if char != "{":
+                    raise RuntimeError(f"Expected a JSON object, got {char!r}.")
+                self.pos += 1
+                self.state = "field"
+            elif self.state == "field":
+                char = self._skip(_SEPARATORS)
+                if char is None:
+                    return None
+                if char == "}":
+                    self.pos += 1
+                    self.done = True
+                    return _NOTHING
+                field = self._decode()
+                if self._skip(_WHITESPACE) != ":":
+                    raise ValueError("Incomplete field name.")
+                self.pos += 1
+                self.field = field
+                self.state = "value"
+            elif self.state == "value":
+                char = self._skip(_WHITESPACE)
+                if char is None:
+                    return None
+                if char == "[" and self.field in _STREAMED_FIELDS:
+                    self.pos += 1
+                    self.state = "elements"
+                    return _NOTHING
+                value = self._decode()
+                self.state = "field"
+                return self.field, value
+            else:
+                char = self._skip(_SEPARATORS)
+                if char is None:
+                    return None
+                if char == "]":
+                    self.pos += 1
+                    self.state = "field"
+                    return _NOTHING
+                return self.field, self._decode()
+        except ValueError:
+            # The value continues on the next line, decode it again from its start once that arrived
+            self.pos = start
+            return None
+        return _NOTHING
+
+
+class LeanREPLTimeoutError(TimeoutError):
+    """Raised if the Lean REPL does not answer a request in time.
+
+    The synchronous handler has restarted its REPL process when this is raised, see `LeanREPLHandler.restart`.
+    """
+
+
+class LeanREPLAbortedError(RuntimeError):
+    """Raised for the requests queued behind one the Lean REPL crashed or was restarted on.
+
+    They never ran, so they can be sent again once the process is restarted, see `LeanREPLAsyncHandler.restart`.
+    """
+
+
+class _StderrLog:
+    """The last lines a REPL process wrote to stderr.
+
+    Fed by a drainer reading the pipe as long as the process lives, so the REPL never blocks on a full stderr pipe.
+    """
+
+    def __init__(self):
+        self.lines: Deque[str] = deque(maxlen=REPL_STDERR_LINES)
+        self._partial = b""
+
+    def feed(self, chunk: bytes) -> None:
+        *lines, partial = (self._partial + chunk).split(b"\n")
+        self.lines.extend(
+            line[-REPL_STDERR_LINE_LENGTH:].decode(errors="replace") for line in lines
+        )
+        self._partial = partial[-REPL_STDERR_LINE_LENGTH:]
+
+    def text(self) -> str:
+        lines = list(self.lines)
+        if self._partial:
+            lines.append(self._partial.decode(errors="replace"))
+        return "\n".join(lines)
+
+    def annotate(self, message: str) -> str:
+        """Append the recent stderr to an error message, if there is any."""
+        text = self.text()
+        return f"{message}\nLean REPL stderr:\n{text}" if text else message
+
+
+def _drain_stderr(stream: BinaryIO, log: _StderrLog) -> None:
+    """Read stderr into the log until the process exits, run on a daemon thread."""
+    with stream:
+        while True:
+            chunk = stream.read(REPL_READ_CHUNK)
+            if not chunk:
+                return
+            log.feed(chunk)
 
 
 class LeanREPLPos(BaseModel):
@@ -44,40 +289,417 @@ class LeanREPLNextProofState(BaseModel):
         return value
 
 
+class LeanREPLProofStateCheckpoint(BaseModel):
+    """Pickled proof states, by the index they had in the handler they were checkpointed from."""
+
+    paths: Dict[int, Path]
+
+
+def _check_pickle_responses(
+    responses: List[Dict[str, Any]], action: str, what: str = "proof state"
+) -> None:
+    for response in responses:
+        if "message" in response:
+            raise RuntimeError(f"Could not {action} {what}: {response['message']}")
+
+
+def _checkpoint_paths(proof_states: Iterable[int], directory: Path) -> Dict[int, Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    return {idx: directory / f"proof_state_{idx}.olean" for idx in proof_states}
+
+
+class _LeanREPLView:
+    """A read-only view on a raw REPL response object.
+
+    Construction only stores the decoded JSON dict, fields are converted when accessed. Use `to_model` to get
+    the validated pydantic model.
+    """
+
+    # Weak references let a `LeanREPLSupervisor` track which proof states are still in use
+    __slots__ = ("_raw", "__weakref__")
+    _model: Any = None
+
+    def __init__(self, raw: Dict[str, Any]):
+        self._raw = raw
+
+    @property
+    def raw(self) -> Dict[str, Any]:
+        return self._raw
+
+    def to_model(self):
+        return self._model.model_validate(self._raw)
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and other._raw == self._raw
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._raw!r})"
+
+
+class LeanREPLPosView(_LeanREPLView):
+    __slots__ = ()
+    _model = LeanREPLPos
+
+    @property
+    def line(self) -> int:
+        return self._raw["line"]
+
+    @property
+    def column(self) -> int:
+        return self._raw["column"]
+
+
+class LeanREPLProofStateView(_LeanREPLView):
+    __slots__ = ()
+    _model = LeanREPLProofState
+
+    @property
+    def proof_state(self) -> int:
+        return self._raw["proofState"]
+
+    @property
+    def goal(self) -> str:
+        return self._raw["goal"]
+
+    @property
+    def pos(self) -> LeanREPLPosView:
+        return LeanREPLPosView(self._raw["pos"])
+
+    @property
+    def end_pos(self) -> LeanREPLPosView:
+        return LeanREPLPosView(self._raw["endPos"])
+
+
+class LeanREPLMessageView(_LeanREPLView):
+    __slots__ = ()
+    _model = LeanREPLMessage
+
+    @property
+    def data(self) -> str:
+        return self._raw["data"]
+
+    @property
+    def severity(self) -> str:
+        return self._raw["severity"]
+
+    @property
+    def pos(self) -> LeanREPLPosView:
+        return LeanREPLPosView(self._raw["pos"])
+
+    @property
+    def end_pos(self) -> Optional[LeanREPLPosView]:
+        end_pos = self._raw.get("endPos")
+        return LeanREPLPosView(end_pos) if end_pos is not None else None
+
+
+class LeanREPLNextProofStateView(_LeanREPLView):
+    __slots__ = ()
+    _model = LeanREPLNextProofState
+
+    @property
+    def proof_state(self) -> int:
+        return self._raw["proofState"]
+
+    @property
+    def goals(self) -> List[str]:
+        return self._raw["goals"]
+
+    @property
+    def messages(self) -> List[LeanREPLMessageView]:
+        return [
+            LeanREPLMessageView(message) for message in self._raw.get("messages", [])
+        ]
+
+    def to_model(self):
+        # The model's validator fills in missing messages in place, do not touch the raw dict
+        return self._model.model_validate(dict(self._raw))
+
+
+class LeanREPLTacticResult(BaseModel):
+    """The outcome of one tactic of a `run_tactics` batch."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    tactic: str
+    # The proof state the tactic was run on
+    proof_state: int
+    # Set if the tactic ran, even if it left error messages
+    next_proof_state: Optional[
+        Union[LeanREPLNextProofState, LeanREPLNextProofStateView]
+    ] = None
+    # Set if the REPL rejected the tactic, or it timed out
+    error: Optional[str] = None
+    # Seconds the REPL took for the tactic, not counting time queued behind other requests
+    elapsed: float
+
+
+def _parse_stream_item(field: str, value: Any, lazy_responses: bool) -> Any:
+    """Convert a streamed field or list element, like `receive_json` converts whole responses."""
+    if field == "env":
+        return LeanREPLEnvironment(env_index=int(value))
+    if field == "sorries":
+        if lazy_responses:
+            return LeanREPLProofStateView(value)
+        return LeanREPLProofState.model_validate(value)
+    if field == "messages":
+        if lazy_responses:
+            return LeanREPLMessageView(value)
+        return LeanREPLMessage.model_validate(value)
+    return value
+
+
+def split_header(content: str, opens: bool = False) -> Tuple[str, str, int]:
+    """Split Lean code into its header of leading `import` lines and the body after it.
+
+    Leading blank and `--` comment lines count towards the header. If the code has no header, or it cannot be
+    split off cleanly, the header is empty and the body is all of the code.
+
+    :param opens: Also count leading `open` commands towards the header, not only imports.
+    :return: The header, the body and the number of lines the header spans.
+    """
+    lines = content.splitlines(keepends=True)
+    end = 0
+    header = []
+    for idx, line in enumerate(lines):
+        stripped = line.strip()
+        # `open ... in` only applies to the command after it, which is part of the body
+        is_open = stripped.startswith("open ") and " in " not in stripped + " "
+        if stripped.startswith("import ") or (opens and is_open):
+            header.append(stripped)
+            end = idx + 1
+        elif stripped and not stripped.startswith("--"):
+            break
+    body = "".join(lines[end:])
+    # e.g. imports after a block comment, which Lean would reject in the body
+    if (
+        not header
+        or not body.strip()
+        or any(line.startswith("import ") for line in lines[end:])
+    ):
+        return "", content, 0
+    return "\n".join(header), body, end
+
+
+def _shift_positions(item: Any, lines: int) -> None:
+    """Move the positions of a parsed sorry or message, or of a raw tactic entry, down by `lines`."""
+    if isinstance(item, dict):
+        positions = [item.get("pos"), item.get("endPos")]
+    elif isinstance(item, _LeanREPLView):
+        positions = [item.raw.get("pos"), item.raw.get("endPos")]
+    else:
+        positions = [item.pos, item.end_pos]
+    for pos in positions:
+        if isinstance(pos, dict):
+            pos["line"] += lines
+        elif pos is not None:
+            pos.line += lines
+
+
+def _shift_response(response: Any, lines: int) -> None:
+    """Make the positions in the response to a command's body refer to the whole command."""
+    if not isinstance(response, dict):
+        return
+    for field in ("sorries", "messages", "tactics"):
+        for item in response.get(field, []):
+            _shift_positions(item, lines)
+
+
+def _header_failed(response: Dict[str, Any]) -> bool:
+    return "message" in response or any(
+        message.severity == "error" for message in response.get("messages", [])
+    )
+
+
+def _tactic_result(
+    tactic: str,
+    proof_state_idx: int,
+    response: Union[Dict[str, Any], LeanREPLNextProofState, LeanREPLNextProofStateView],
+    elapsed: float,
+) -> LeanREPLTacticResult:
+    if isinstance(response, (LeanREPLNextProofState, LeanREPLNextProofStateView)):
+        return LeanREPLTacticResult(
+            tactic=tactic,
+            proof_state=proof_state_idx,
+            next_proof_state=response,
+            elapsed=elapsed,
+        )
+    return LeanREPLTacticResult(
+        tactic=tactic,
+        proof_state=proof_state_idx,
+        error=response.get("message", json.dumps(response, ensure_ascii=False)),
+        elapsed=elapsed,
+    )
+
+
+def _tactic_requests(
+    candidates: Dict[int, List[str]],
+) -> List[Tuple[int, str]]:
+    return [
+        (proof_state_idx, tactic)
+        for proof_state_idx, tactics in candidates.items()
+        for tactic in tactics
+    ]
+
+
+def _group_tactic_results(
+    candidates: Dict[int, List[str]], results: Iterable[LeanREPLTacticResult]
+) -> Dict[int, List[LeanREPLTacticResult]]:
+    grouped: Dict[int, List[LeanREPLTacticResult]] = {idx: [] for idx in candidates}
+    for result in results:
+        grouped[result.proof_state].append(result)
+    return grouped
+
+
 class LeanREPLHandler:
-    def __init__(self, project_path: Optional[Path] = None):
+    def __init__(
+        self,
+        project_path: Optional[Path] = None,
+        lazy_responses: bool = False,
+        cache: Optional[LeanREPLCache] = None,
+        timeout: Optional[float] = None,
+        base_env: Optional[Path] = None,
+        supervisor: Optional["LeanREPLSupervisor"] = None,
+        tracer: Optional[LeanREPLTracer] = None,
+        header_cache_size: Optional[int] = None,
+        binary_io: bool = False,
+    ):
         """Initialize the Lean REPL handler.
 
         :param project_path: An optional path for a Lean project directory, containing the desired Lean environment.
-            If set, will run repl using `lake env repl` from the project directory.
+            If set, will run repl with the environment of `lake env` in the project directory.
+        :param lazy_responses: If set, sorries, messages and next proof states are returned as lightweight views
+            (e.g. `LeanREPLProofStateView`) that convert fields on access, instead of validated pydantic models.
+        :param cache: An optional response cache used by the `run_*` methods. Envs and proof states served from
+            the cache might be returned with negative indices, they are created in Lean once they are needed.
+        :param timeout: An optional maximum time in seconds to wait for each response. If it expires, the REPL
+            process is killed and restarted, losing all envs and proof states, and `LeanREPLTimeoutError` is
+            raised. Setting it also enables the `timeout` parameter of `receive_json` and the `run_*` methods.
+        :param base_env: An optional pickled environment, e.g. a snapshot from `EnvSnapshotStore.path`. It is
+            unpickled on start and after every restart and becomes the handler's env.
+        :param supervisor: An optional supervisor, recycling the REPL process once it exceeds a memory or request
+            budget, see `LeanREPLSupervisor`.
+        :param tracer: An optional callback receiving a `LeanREPLTrace` with phase timings and sizes for every
+            response, e.g. a `LeanREPLTraceHistogram`.
+        :param header_cache_size: If set, `run_command` splits commands without an env into a header of
+            leading `import` and `open` lines and a body, see `split_header`. Each distinct header is elaborated
+            once and the body runs in its environment, positions in the response still refer to the whole
+            command. The environments of this many most recently used headers are kept.
+        :param binary_io: If set, the output is read as bytes into a reusable buffer and each response is decoded
+            straight from it once the blank line ending it arrives, with orjson if it is installed. Saves decoding
+            and joining every line of large responses before decoding the JSON.
         """
+        self.lazy_responses = lazy_responses
+        self.binary_io = binary_io
+        self._tracing = _TraceRecorder(tracer) if tracer is not None else None
+        self.header_cache_size = header_cache_size
+        self._header_envs: "OrderedDict[str, Optional[LeanREPLEnvironment]]" = (
+            OrderedDict()
+        )
+        self._cache_session = (
+            _CacheSession(cache, toolchain_version(project_path))
+            if cache is not None
+            else None
+        )
+        self.timeout = timeout
+        self.base_env = base_env
+        self.supervisor = supervisor
         # Path to the Lean REPL submodule
-        self.lean_repl_path = Path(__file__).parent.parent / "repl"
+        self.lean_repl_path = LEAN_REPL_PATH
+        self._project_path = project_path
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._start()
+
+    def _start(self) -> None:
+        # Builds the repl on first use only, later handlers exec the binary right away
+        spec = resolve_repl(self._project_path)
         # Start the Lean REPL subprocess with pipes for stdin, stdout, and stderr
-        if project_path is None:
-            self.process = subprocess.Popen(
-                ["lake", "exe", "repl"],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,  # Handle input/output as text (string)
-                bufsize=1,
-                cwd=self.lean_repl_path,
-            )
-        else:
-            # Need to ensure repl is built - this is a bit hacky, as it might take a second to detect if already built
-            subprocess.check_call(["lake", "build"], cwd=self.lean_repl_path)
-            repl_bin_path = self.lean_repl_path / ".lake" / "build" / "bin" / "repl"
-            self.process = subprocess.Popen(
-                ["lake", "env", str(repl_bin_path.absolute())],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,  # Handle input/output as text (string)
-                bufsize=1,
-                cwd=project_path,
-            )
+        self.process = subprocess.Popen(
+            spec.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=not self.binary_io,  # Handle input/output as text (string)
+            bufsize=-1 if self.binary_io else 1,
+            cwd=spec.cwd,
+            env=spec.process_env(),
+        )
         self._env: Optional[LeanREPLEnvironment] = None
+        # Set while a response from `stream_file` is only partly read
+        self._streaming = False
+        self._stderr = _StderrLog()
+        self._stderr_thread = threading.Thread(
+            target=_drain_stderr,
+            args=(
+                (
+                    self.process.stderr
+                    if self.binary_io
+                    else self.process.stderr.buffer
+                ).raw,
+                self._stderr,
+            ),
+            daemon=True,
+        )
+        self._stderr_thread.start()
+        self._read_buffer: Optional[bytearray] = None
+        if self.binary_io or self.timeout is not None:
+            # Read the pipe directly instead of through the text wrapper, so waiting for output can time out and
+            # responses can be decoded from bytes
+            self._read_buffer = bytearray()
+            self._stdout = (
+                self.process.stdout if self.binary_io else self.process.stdout.buffer
+            ).raw
+            self._chunk = memoryview(bytearray(REPL_READ_CHUNK))
+        if self.timeout is not None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.process.stdout, selectors.EVENT_READ)
+        if self.base_env is not None:
+            self._send_json({"unpickleEnvFrom": str(self.base_env.absolute())})
+            # Unpickling a large environment takes a while, do not count it towards the timeout
+            response = self._get_output()
+            response, env = self._parse_response(response, self._take_trace())
+            if env is None:
+                self.close()
+                raise RuntimeError(
+                    f"Could not unpickle base environment: {response.get('message')}"
+                )
+            self._env = env
+
+    def restart(self) -> None:
+        """Kill the REPL process and start a new one, e.g. because it stopped responding.
+
+        All envs and proof states are lost. The handler's env is reset to the base env, if any.
+        """
+        self._stop()
+        if self._tracing is not None:
+            self._tracing.reset()
+        self._header_envs.clear()
+        if self._cache_session is not None:
+            self._cache_session.forget_process()
+        if self.supervisor is not None:
+            self.supervisor.reset()
+        self._start()
+
+    def _stop(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        # The stderr drainer closes stderr once it read everything
+        self.process.stdout.close()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+    def _timeout(self, timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            return self.timeout
+        if self._selector is None:
+            raise ValueError(
+                "Per-request timeouts need a handler created with a timeout."
+            )
+        return timeout
 
     @property
     def env(self):
@@ -108,34 +730,160 @@ class LeanREPLHandler:
 
     def _send_json(self, data: Dict[str, Union[str, int]]) -> None:
         """Send a JSON object to the Lean REPL."""
-        if self.env is not None:
+        if self._streaming:
+            raise RuntimeError(
+                "Cannot send while a streamed response is being read, exhaust or close its iterator first."
+            )
+        # Only commands run in an env, e.g. a proof state pickle with an env would pickle the env instead
+        if "cmd" in data and self.env is not None and "env" not in data:
             data["env"] = self.env.env_index
-        json_data = json.dumps(data, ensure_ascii=False)
-        self.process.stdin.write(json_data + "\n\n")
+        if self._tracing is not None:
+            start = time.perf_counter()
+        if self.binary_io:
+            json_data = (
+                orjson.dumps(data)
+                if orjson is not None
+                else json.dumps(data, ensure_ascii=False).encode()
+            )
+            self.process.stdin.write(json_data + b"\n\n")
+        else:
+            json_data = json.dumps(data, ensure_ascii=False)
+            self.process.stdin.write(json_data + "\n\n")
         self.process.stdin.flush()
+        if self._tracing is not None:
+            self._tracing.request(data, json_data, start)
 
-    def _get_output(self) -> str:
-        output = self.process.stdout.readline().strip()
-        # Since we know repl only returns valid json, we can use this while here
-        # We might want to have some way to ensure we do not get stuck
-        i = 0
+    def _get_output(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Read and decode the next response from the Lean REPL, restarting it if the timeout expires."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self.binary_io:
+            return self._get_frame(deadline, timeout)
+        framer = _ResponseFramer()
         while True:
-            if i >= REPL_MAX_OUTPUT_LINES:
-                raise RuntimeError(f"Read more than {REPL_MAX_OUTPUT_LINES} lines!")
-            # If we have a valid json, we can stop reading
-            try:
-                json.loads(output)
-                break
-            except json.JSONDecodeError:
-                pass
-            output += self.process.stdout.readline().strip()
-            i += 1
-        return output
+            response = framer.feed(self._next_line(deadline, timeout))
+            if response is not None:
+                if self._tracing is not None:
+                    self._tracing.response()
+                return response
+
+    def _next_line(self, deadline: Optional[float], timeout: Optional[float]) -> str:
+        """Read the next line of output, restarting the REPL if the deadline passes first."""
+        line = self._readline(deadline)
+        if line is None:
+            raise self._expired(timeout)
+        if not line:
+            raise self._closed()
+        if self._tracing is not None and line.strip():
+            self._tracing.line(line)
+        return line
+
+    def _get_frame(
+        self, deadline: Optional[float], timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        """Decode the next response straight from the read buffer, without splitting the output into lines."""
+        buffer = self._read_buffer
+        # Where to look for the end of the response next, and up to where lines were counted
+        scan = counted = lines = 0
+        first_at = None
+        while True:
+            if first_at is None and buffer:
+                first_at = time.perf_counter()
+            end = buffer.find(_FRAME_END, scan)
+            if end == -1:
+                lines += buffer.count(b"\n", counted)
+                if lines > REPL_MAX_OUTPUT_LINES:
+                    raise RuntimeError(f"Read more than {REPL_MAX_OUTPUT_LINES} lines!")
+                counted = len(buffer)
+                # The blank line might be split between two reads
+                scan = max(counted - 1, 0)
+                size = self._fill(deadline)
+                if size is None:
+                    raise self._expired(timeout)
+                if not size:
+                    raise self._closed()
+                continue
+            end_at = time.perf_counter()
+            with memoryview(buffer) as view, view[:end] as frame:
+                try:
+                    response = (
+                        orjson.loads(frame)
+                        if orjson is not None
+                        else json.loads(str(frame, "utf-8"))
+                    )
+                except ValueError:
+                    # Only blank lines so far, or a blank line within the response, keep reading
+                    response = _NOTHING
+            if response is _NOTHING:
+                scan = end + 1
+                continue
+            if self._tracing is not None:
+                self._tracing.frame(
+                    end, buffer.count(b"\n", 0, end) + 1, first_at, end_at
+                )
+                self._tracing.response()
+            del buffer[: end + len(_FRAME_END)]
+            return response
+
+    def _expired(self, timeout: Optional[float]) -> LeanREPLTimeoutError:
+        message = self._stderr.annotate(
+            f"Lean REPL did not respond within {timeout} seconds and was restarted."
+        )
+        # A late response would be read as the answer to the next request, start over instead
+        self.restart()
+        return LeanREPLTimeoutError(message)
+
+    def _closed(self) -> RuntimeError:
+        self._stderr_thread.join(REPL_STDERR_GRACE)
+        return RuntimeError(self._stderr.annotate("Lean REPL closed its output."))
+
+    @property
+    def recent_stderr(self) -> str:
+        """The last lines the current REPL process wrote to stderr, at most `REPL_STDERR_LINES`."""
+        return self._stderr.text()
+
+    def _take_trace(self) -> Optional[LeanREPLTrace]:
+        """Take the trace of the response just read, to emit it once the response is parsed."""
+        return self._tracing.take() if self._tracing is not None else None
+
+    def _readline(self, deadline: Optional[float]) -> Optional[str]:
+        """Read the next line of output, or return None if the deadline passed first."""
+        if self._read_buffer is None:
+            return self.process.stdout.readline()
+        start = 0
+        while True:
+            end = self._read_buffer.find(b"\n", start)
+            if end != -1:
+                line = self._read_buffer[: end + 1].decode()
+                del self._read_buffer[: end + 1]
+                return line
+            start = len(self._read_buffer)
+            size = self._fill(deadline)
+            if size is None:
+                return None
+            if not size:
+                line = self._read_buffer.decode()
+                self._read_buffer.clear()
+                return line
+
+    def _fill(self, deadline: Optional[float]) -> Optional[int]:
+        """Append the next chunk of output to the read buffer, returning its size, 0 at its end or None on timeout."""
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._selector.select(remaining):
+                return None
+        size = self._stdout.readinto(self._chunk)
+        self._read_buffer += self._chunk[:size]
+        return size
 
     def _has_sorries(self, response: Dict[str, str]):
         return "sorries" in response
 
     def _parse_sorries(self, response: Dict[str, str]) -> None:
+        if self.lazy_responses:
+            response["sorries"] = [
+                LeanREPLProofStateView(sorry) for sorry in response["sorries"]
+            ]
+            return
         for idx, sorry in enumerate(response["sorries"]):
             response["sorries"][idx] = LeanREPLProofState.model_validate(sorry)
 
@@ -146,39 +894,320 @@ class LeanREPLHandler:
         return "messages" in response
 
     def _parse_messages(self, response: Dict[str, str]) -> None:
+        if self.lazy_responses:
+            response["messages"] = [
+                LeanREPLMessageView(message) for message in response["messages"]
+            ]
+            return
         for idx, message in enumerate(response["messages"]):
             response["messages"][idx] = LeanREPLMessage.model_validate(message)
 
     def receive_json(
-        self,
+        self, timeout: Optional[float] = None
     ) -> Optional[
         Tuple[
             Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
             Optional[LeanREPLEnvironment],
         ]
     ]:
-        """Read a JSON object from the Lean REPL."""
-        output = self._get_output()
-        try:
-            response = json.loads(output)
-            # Env is not send in tactic mode
-            if "env" in response:
-                env = response["env"]
-                del response["env"]
+        """Read a JSON object from the Lean REPL.
+
+        :param timeout: The maximum time to wait for the response, defaults to the handler's timeout.
+        """
+        response = self._get_output(self._timeout(timeout))
+        return self._parse_response(response, self._take_trace())
+
+    def _parse_response(
+        self, response: Dict[str, Any], trace: Optional[LeanREPLTrace] = None
+    ) -> Tuple[
+        Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+        Optional[LeanREPLEnvironment],
+    ]:
+        if trace is not None:
+            start = time.perf_counter()
+            result = self._parse_response(response)
+            self._tracing.parsed(trace, start)
+            return result
+        # Env is not send in tactic mode
+        if "env" in response:
+            env = response["env"]
+            del response["env"]
+        else:
+            env = None
+        env = LeanREPLEnvironment(env_index=int(env)) if env is not None else None
+        # If we have top level proof states, we can simply return this
+        if self._is_next_proof_state(response):
+            if self.lazy_responses:
+                response = LeanREPLNextProofStateView(response)
             else:
-                env = None
-            env = LeanREPLEnvironment(env_index=int(env)) if env is not None else None
-            # If we have top level proof states, we can simply return this
-            if self._is_next_proof_state(response):
-                return LeanREPLNextProofState.model_validate(response), env
+                response = LeanREPLNextProofState.model_validate(response)
+        else:
             # If we have sorries, we can return proof states
             if self._has_sorries(response):
                 self._parse_sorries(response)
             if self._has_messages(response):
                 self._parse_messages(response)
-            return response, env
-        except json.JSONDecodeError:
-            return None
+        if self.supervisor is not None:
+            self.supervisor.track(response, env)
+        return response, env
+
+    def _raw_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        timeout = self._timeout(timeout)
+        self._send_json(data)
+        return self._get_output(timeout)
+
+    def _raw_requests(
+        self,
+        requests: List[Dict[str, Union[str, int]]],
+        timings: Optional[List[float]] = None,
+        timeout: Optional[float] = None,
+        parse: bool = False,
+    ) -> List[Any]:
+        """Send several requests, keeping up to `REPL_PIPELINE_WINDOW` in flight, and return their decoded responses.
+
+        :param timings: An optional list to append the time each response took to, counted from when the request
+            was sent or the previous response was read, whichever was later.
+        :param timeout: The maximum time to wait for each response, counted the same way.
+        :param parse: Return parsed responses, see `receive_json`, instead of decoded JSON.
+        """
+        timeout = self._timeout(timeout)
+        responses = []
+        sent_at = []
+        read_at = 0.0
+
+        def read() -> None:
+            nonlocal read_at
+            response = self._get_output(timeout)
+            now = time.perf_counter()
+            if timings is not None:
+                timings.append(now - max(sent_at[len(responses)], read_at))
+            read_at = now
+            if parse:
+                response = self._parse_response(response, self._take_trace())
+            responses.append(response)
+
+        for idx, data in enumerate(requests):
+            if idx - len(responses) >= REPL_PIPELINE_WINDOW:
+                read()
+            self._send_json(data)
+            sent_at.append(time.perf_counter())
+        while len(responses) < len(requests):
+            read()
+        return responses
+
+    def _request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[
+        Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+        Optional[LeanREPLEnvironment],
+    ]:
+        """Send a JSON object to the Lean REPL and return its parsed response, going through the cache if set."""
+        result = self._cached_request(data, timeout)
+        if self.supervisor is not None:
+            # Only recycle once the response is tracked, so its indices are valid when returned
+            self.supervisor.after_request(self)
+        return result
+
+    def _cached_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ) -> Tuple[
+        Union[Dict[str, Union[str, LeanREPLProofState]], LeanREPLNextProofState],
+        Optional[LeanREPLEnvironment],
+    ]:
+        session = self._cache_session
+        if session is None:
+            response = self._raw_request(data, timeout)
+            return self._parse_response(response, self._take_trace())
+        if "cmd" in data and "env" not in data and self.env is not None:
+            data["env"] = self.env.env_index
+        key = session.key(data)
+        request = data
+        if key is not None:
+            response = session.lookup(key, request)
+            if response is not None:
+                return self._parse_response(response)
+        # Create the env or proof state the request runs on, if it was only served from the cache so far
+        steps = session.prepare(data)
+        step_response = None
+        try:
+            while True:
+                step_response = self._raw_request(steps.send(step_response))
+        except StopIteration as stop:
+            data = stop.value
+        response = self._raw_request(data, timeout)
+        trace = self._take_trace()
+        session.record(key, request, response)
+        return self._parse_response(response, trace)
+
+    def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Run a command and return its response, see `receive_json`.
+
+        :param command: The Lean command to run.
+        :param env: The environment to run the command in, defaults to the handler's environment.
+        :param timeout: The maximum time to wait for the response, defaults to the handler's timeout.
+        """
+        if env is None and self.env is None and self.header_cache_size:
+            return self._run_with_header(command, timeout)
+        data: Dict[str, Union[str, int]] = {"cmd": command}
+        if env is not None:
+            data["env"] = env.env_index if isinstance(env, LeanREPLEnvironment) else env
+        return self._request(data, timeout)
+
+    def _run_with_header(self, command: str, timeout: Optional[float] = None):
+        header, body, offset = split_header(command, opens=True)
+        env = self._header_env(header, timeout) if header else None
+        if env is None:
+            # No header, or one that does not elaborate on its own, whose errors are reported as usual
+            return self._request({"cmd": command}, timeout)
+        response, body_env = self._request({"cmd": body, "env": env.env_index}, timeout)
+        _shift_response(response, offset)
+        return response, body_env
+
+    def _header_env(
+        self, header: str, timeout: Optional[float] = None
+    ) -> Optional[LeanREPLEnvironment]:
+        """The environment of a header, elaborated on first use, or None if it has errors."""
+        envs = self._header_envs
+        if header in envs:
+            envs.move_to_end(header)
+            return envs[header]
+        response, env = self._request({"cmd": header}, timeout)
+        if _header_failed(response):
+            env = None
+        envs[header] = env
+        if len(envs) > self.header_cache_size:
+            envs.popitem(last=False)
+        return env
+
+    def run_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ):
+        """Run a tactic on a proof state and return its response, see `receive_json`."""
+        return self._request({"tactic": tactic, "proofState": proof_state_idx}, timeout)
+
+    def run_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ):
+        """Check a file and return its response, see `receive_json`."""
+        return self._request(
+            {"path": str(path.absolute()), "allTactics": all_tactics}, timeout
+        )
+
+    def stream_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """Check a file and yield its response piece by piece, while it is being read from the REPL.
+
+        Yields `(field, value)` pairs in the order of the response. The `messages`, `sorries` and `tactics`
+        lists are yielded one element at a time, converted like in `receive_json`, and `env` as a
+        `LeanREPLEnvironment`. Only the element being read is kept in memory, so huge `allTactics` outputs can
+        be processed as they arrive. The request is sent once iteration starts and bypasses the response cache.
+        No other request can be sent until the iterator is exhausted or closed, closing it early reads and
+        discards the rest of the response.
+
+        :param timeout: The maximum time to wait for the whole response, defaults to the handler's timeout.
+        """
+        timeout = self._timeout(timeout)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._send_json({"path": str(path.absolute()), "allTactics": all_tactics})
+        self._streaming = True
+        stream = _ResponseStream()
+        try:
+            while not stream.done:
+                for field, value in stream.feed(self._next_line(deadline, timeout)):
+                    item = _parse_stream_item(field, value, self.lazy_responses)
+                    if self.supervisor is not None:
+                        if field == "env":
+                            self.supervisor.track({}, item)
+                        elif field == "sorries":
+                            self.supervisor.track(item, None)
+                    yield field, item
+        except GeneratorExit:
+            # Keep the pipe in sync, the next request must not read the rest of this response
+            try:
+                while not stream.done:
+                    stream.feed(self._next_line(deadline, timeout))
+            except LeanREPLTimeoutError:
+                return
+            self._streamed()
+            raise
+        finally:
+            self._streaming = False
+        self._streamed()
+        if self.supervisor is not None:
+            self.supervisor.after_request(self)
+
+    def _streamed(self) -> None:
+        if self._tracing is not None:
+            self._tracing.response()
+            self._tracing.emit(self._take_trace())
+
+    def run_tactics(
+        self,
+        proof_state_idx: int,
+        tactics: List[str],
+        timeout: Optional[float] = None,
+    ) -> List[LeanREPLTacticResult]:
+        """Run several candidate tactics on one proof state, pipelined, see `run_tactics_many`.
+
+        :return: One result per tactic, in input order.
+        """
+        results = self.run_tactics_many({proof_state_idx: tactics}, timeout)
+        return results[proof_state_idx]
+
+    def run_tactics_many(
+        self, candidates: Dict[int, List[str]], timeout: Optional[float] = None
+    ) -> Dict[int, List[LeanREPLTacticResult]]:
+        """Run candidate tactics on several proof states, writing requests ahead of the responses read.
+
+        :param candidates: The tactics to try, by the proof state to try them on.
+        :param timeout: The maximum time for each tactic, defaults to the handler's timeout. A timeout restarts
+            the REPL, so the proof states are lost and `LeanREPLTimeoutError` is raised for the whole batch.
+        :return: One result per tactic, by proof state and in input order. A rejected tactic gives a result with
+            `error` set instead of raising.
+        """
+        requests = _tactic_requests(candidates)
+        if self._cache_session is not None:
+            # Cached requests might need materializing, which cannot be pipelined
+            results = []
+            for proof_state_idx, tactic in requests:
+                start = time.perf_counter()
+                response, _ = self.run_tactic(tactic, proof_state_idx, timeout)
+                results.append(
+                    _tactic_result(
+                        tactic,
+                        proof_state_idx,
+                        response,
+                        time.perf_counter() - start,
+                    )
+                )
+            return _group_tactic_results(candidates, results)
+        timings: List[float] = []
+        responses = self._raw_requests(
+            [
+                {"tactic": tactic, "proofState": proof_state_idx}
+                for proof_state_idx, tactic in requests
+            ],
+            timings,
+            timeout,
+            parse=True,
+        )
+        results = [
+            _tactic_result(tactic, proof_state_idx, response, elapsed)
+            for (proof_state_idx, tactic), (response, _), elapsed in zip(
+                requests, responses, timings
+            )
+        ]
+        if self.supervisor is not None:
+            self.supervisor.after_request(self, len(requests))
+        return _group_tactic_results(candidates, results)
 
     def pickle_env(
         self, pickle_to: Path, env: LeanREPLEnvironment
@@ -205,8 +1234,50 @@ class LeanREPLHandler:
         self._send_json({"unpickleProofStateFrom": str(proof_state_from.absolute())})
         return self.receive_json()
 
+    def checkpoint_proof_states(
+        self, proof_states: Iterable[int], directory: Path
+    ) -> LeanREPLProofStateCheckpoint:
+        """Pickle several proof states into a directory in one batch, to restore them with `restore_proof_states`.
+
+        :param proof_states: The indices of the proof states to checkpoint.
+        :param directory: The directory to write the pickled proof states to, created if missing.
+        """
+        paths = _checkpoint_paths(proof_states, directory)
+        responses = self._raw_requests(
+            [
+                {"pickleTo": str(path.absolute()), "proofState": idx}
+                for idx, path in paths.items()
+            ]
+        )
+        _check_pickle_responses(responses, "pickle")
+        return LeanREPLProofStateCheckpoint(paths=paths)
+
+    def restore_proof_states(
+        self, checkpoint: LeanREPLProofStateCheckpoint
+    ) -> Dict[int, int]:
+        """Unpickle checkpointed proof states, e.g. into another handler, in one batch.
+
+        :return: A mapping from the proof state indices at checkpoint time to the indices in this handler.
+        """
+        responses = self._raw_requests(
+            [
+                {"unpickleProofStateFrom": str(path.absolute())}
+                for path in checkpoint.paths.values()
+            ]
+        )
+        _check_pickle_responses(responses, "unpickle")
+        return {
+            old_idx: response["proofState"]
+            for old_idx, response in zip(checkpoint.paths, responses)
+        }
+
     def close(self):
         """Close the subprocess."""
+        if self._tracing is not None:
+            self._tracing.reset()
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
         self.process.terminate()
         self.process.wait()
 
@@ -0,0 +1,196 @@
+import re
+import time
+from typing import Optional, Union, Tuple, List, Any
+from pydantic import BaseModel, ConfigDict
+from lean_repl_py.handler import (
+    LeanREPLHandler,
+    LeanREPLEnvironment,
+    LeanREPLMessage,
+    LeanREPLMessageView,
+    LeanREPLProofState,
+    LeanREPLProofStateView,
+    split_header,
+    _shift_response,
+)
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+
+# Keywords starting a top-level command when they begin a line
+_COMMAND_KEYWORDS = (
+    "abbrev attribute axiom builtin_initialize class coinductive declare_syntax_cat def elab elab_rules "
+    "end example export infix infixl infixr initialize inductive instance lemma local macro macro_rules mutual "
+    "namespace noncomputable nonrec notation omit opaque open partial postfix prefix private protected scoped "
+    "section set_option structure syntax theorem universe unsafe variable"
+).split()
+# A bare `deriving` in the first column ends the structure or inductive before it, only `deriving instance` starts
+_COMMAND_START = re.compile(
+    r"(?:@\[|/--|#[a-z]|deriving\s+instance\b|(?:%s)\b)" % "|".join(_COMMAND_KEYWORDS)
+)
+# Lines holding only what precedes a declaration, which belongs to the command on the next line, like `open ... in`
+_PREFIX_ONLY = re.compile(
+    r"(?:@\[[^\]]*\]\s*|(?:private|protected|noncomputable|partial|unsafe|nonrec|scoped|local)\s+)*"
+    r"(?:@\[[^\]]*\]|/--.*|private|protected|noncomputable|partial|unsafe|nonrec|scoped|local)?"
+)
+
+
+def split_commands(body: str) -> List[str]:
+    """Split Lean code without imports into its top-level commands, e.g. to run them one by one.
+
+    A command starts at a line beginning with a command keyword, an attribute, a doc comment or a `#` command.
+    Doc comments, attributes and modifiers on lines of their own stay with the declaration after them, and
+    `mutual ... end` blocks stay whole. Lines before the first command belong to it, comments between commands
+    to the command before them. Joining the commands gives back the body.
+    """
+    commands: List[List[str]] = []
+    comment_depth = 0
+    prefix_only = False
+    in_mutual = False
+    # Lines before the first command belong to it
+    started = False
+    for line in body.splitlines(keepends=True):
+        starts = comment_depth == 0 and _COMMAND_START.match(line) is not None
+        if not commands or (starts and started and not in_mutual and not prefix_only):
+            commands.append([])
+        started = started or starts
+        commands[-1].append(line)
+        if starts:
+            stripped = line.strip()
+            prefix_only = stripped.endswith(" in") or bool(
+                _PREFIX_ONLY.fullmatch(stripped)
+            )
+            if line.startswith("mutual"):
+                in_mutual = True
+            elif line.startswith("end") and in_mutual:
+                in_mutual = False
+        elif comment_depth == 0 and line.strip() and not line.strip().startswith("--"):
+            prefix_only = False
+        comment_depth = max(comment_depth + line.count("/-") - line.count("-/"), 0)
+    return ["".join(lines) for lines in commands]
+
+
+class LeanREPLIncrementalResult(BaseModel):
+    """The outcome of checking a file with `LeanREPLIncrementalChecker`, positions refer to the whole file."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    messages: List[Union[LeanREPLMessage, LeanREPLMessageView]] = []
+    sorries: List[Union[LeanREPLProofState, LeanREPLProofStateView]] = []
+    # The environment after the last command, None if the file has no commands
+    env: Optional[LeanREPLEnvironment] = None
+    commands: int
+    # Commands run by this check, the others were reused from the previous check
+    rerun: int
+    elapsed: float
+
+
+class _CheckedCommand:
+    __slots__ = ("text", "env", "response")
+
+    def __init__(self, text: str, env: LeanREPLEnvironment, response: Any):
+        self.text = text
+        self.env = env
+        self.response = response
+
+
+class _IncrementalChain:
+    """The commands of the last check with the env after each, to resume from the first changed command."""
+
+    def __init__(self, handler: Union[LeanREPLHandler, LeanREPLAsyncHandler]):
+        self.handler = handler
+        self.chain: List[_CheckedCommand] = []
+        # The REPL process the envs in the chain live in
+        self._process: Any = None
+
+    def _plan(self, content: str) -> Tuple[List[Tuple[str, int]], int]:
+        """Split the content into commands with their line offsets, and count the commands to reuse."""
+        header, body, offset = split_header(content)
+        commands = [(header, 0)] if header else []
+        for command in split_commands(body):
+            commands.append((command, offset))
+            offset += command.count("\n")
+        if self.handler.process is not self._process:
+            # Restarted, the envs are gone with the old process
+            self.chain = []
+        reused = 0
+        for (command, _), checked in zip(commands, self.chain):
+            if command != checked.text:
+                break
+            reused += 1
+        del self.chain[reused:]
+        return commands, reused
+
+    def _record(self, command: str, offset: int, response: Any, env: Any) -> None:
+        if env is None:
+            raise RuntimeError(
+                f"Lean REPL rejected the command at line {offset + 1}: {response.get('message')}"
+            )
+        _shift_response(response, offset)
+        self.chain.append(_CheckedCommand(command, env, response))
+        self._process = self.handler.process
+
+    def _result(
+        self, commands: int, rerun: int, start: float
+    ) -> LeanREPLIncrementalResult:
+        return LeanREPLIncrementalResult(
+            messages=[
+                message
+                for checked in self.chain
+                for message in checked.response.get("messages", [])
+            ],
+            sorries=[
+                sorry
+                for checked in self.chain
+                for sorry in checked.response.get("sorries", [])
+            ],
+            env=self.chain[-1].env if self.chain else None,
+            commands=commands,
+            rerun=rerun,
+            elapsed=time.monotonic() - start,
+        )
+
+
+class LeanREPLIncrementalChecker(_IncrementalChain):
+    def __init__(self, handler: LeanREPLHandler):
+        """Check edited versions of a file, only re-running the commands from the first changed one onward.
+
+        The file is split into its import header and top-level commands, see `split_commands`, each run in the
+        environment of the one before it. The environment after each command is remembered, so when the file is
+        checked again, the unchanged commands at its start are reused and the time taken tracks the size of the
+        edit rather than of the file. The envs stay alive in the handler's REPL, a restart starts over.
+
+        :param handler: The handler to run the commands on, used by one checker at a time.
+        """
+        super().__init__(handler)
+
+    def check(
+        self, content: str, timeout: Optional[float] = None
+    ) -> LeanREPLIncrementalResult:
+        """Check the current content of the file.
+
+        :param timeout: The maximum time for each command, see `LeanREPLHandler.run_command`.
+        """
+        start = time.monotonic()
+        commands, reused = self._plan(content)
+        for command, offset in commands[reused:]:
+            env = self.chain[-1].env if self.chain else None
+            response, env = self.handler.run_command(command, env, timeout)
+            self._record(command, offset, response, env)
+        return self._result(len(commands), len(commands) - reused, start)
+
+
+class LeanREPLAsyncIncrementalChecker(_IncrementalChain):
+    def __init__(self, handler: LeanREPLAsyncHandler):
+        """Check edited versions of a file on an async handler, see `LeanREPLIncrementalChecker`."""
+        super().__init__(handler)
+
+    async def check(
+        self, content: str, timeout: Optional[float] = None
+    ) -> LeanREPLIncrementalResult:
+        """Check the current content of the file, see `LeanREPLIncrementalChecker.check`."""
+        start = time.monotonic()
+        await self.handler.await_process()
+        commands, reused = self._plan(content)
+        for command, offset in commands[reused:]:
+            env = self.chain[-1].env if self.chain else None
+            response, env = await self.handler.run_command(command, env, timeout)
+            self._record(command, offset, response, env)
+        return self._result(len(commands), len(commands) - reused, start)
@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Dict, List
+from pydantic import BaseModel
+from lean_repl_py.cache import toolchain_version
+
+# Path to the Lean REPL submodule
+LEAN_REPL_PATH = Path(__file__).parent.parent / "repl"
+# Resolved launch specs of previous runs, kept next to the build output so `lake clean` removes them
+_LAUNCH_CACHE_PATH = LEAN_REPL_PATH / ".lake" / "lean-repl-py-launch.json"
+
+
+class LeanREPLLaunchSpec(BaseModel):
+    """How to start the REPL binary directly, without going through lake.
+
+    `env` only holds the variables lake sets or changes, e.g. `LEAN_PATH`, and `prepend` the entries lake puts in
+    front of search paths like `PATH`, so the rest is taken from the environment at spawn time, see `process_env`.
+    """
+
+    command: List[str]
+    env: Dict[str, str]
+    cwd: Path
+    prepend: Dict[str, str] = {}
+
+    def process_env(self) -> Dict[str, str]:
+        """The full environment to start the REPL process with."""
+        env = {**os.environ, **self.env}
+        for name, entries in self.prepend.items():
+            env[name] = entries + os.pathsep + env[name] if env.get(name) else entries
+        return env
+
+
+_resolved: Dict[str, LeanREPLLaunchSpec] = {}
+_lock = threading.Lock()
+
+
+def _binary_path() -> Path:
+    return (LEAN_REPL_PATH / ".lake" / "build" / "bin" / "repl").resolve()
+
+
+def _cache_key(project_path: Optional[Path]) -> str:
+    return str(project_path.resolve()) if project_path is not None else ""
+
+
+def _load_cached(
+    key: str, project_path: Optional[Path]
+) -> Optional[LeanREPLLaunchSpec]:
+    try:
+        entry = json.loads(_LAUNCH_CACHE_PATH.read_text()).get(key)
+    except (OSError, ValueError):
+        return None
+    if entry is None:
+        return None
+    binary = _binary_path()
+    # Only trust the entry for the exact binary it was resolved for
+    if not binary.exists() or entry.get("binary_mtime") != binary.stat().st_mtime:
+        return None
+    # Nor after the project changed its toolchain or dependencies, which changes e.g. `LEAN_PATH`
+    if entry.get("toolchain") != toolchain_version(project_path):
+        return None
+    return LeanREPLLaunchSpec.model_validate(entry["spec"])
+
+
+def _store_cached(
+    key: str, project_path: Optional[Path], spec: LeanREPLLaunchSpec
+) -> None:
+    try:
+        entries = json.loads(_LAUNCH_CACHE_PATH.read_text())
+    except (OSError, ValueError):
+        entries = {}
+    entries[key] = {
+        "binary_mtime": _binary_path().stat().st_mtime,
+        "toolchain": toolchain_version(project_path),
+        "spec": spec.model_dump(mode="json"),
+    }
+    tmp_path = _LAUNCH_CACHE_PATH.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(entries))
+    os.replace(tmp_path, _LAUNCH_CACHE_PATH)
+
+
+def resolve_repl(
+    project_path: Optional[Path] = None, refresh: bool = False
+) -> LeanREPLLaunchSpec:
+    """Build the REPL once and resolve how to exec its binary directly.
+
+    Runs `lake build` for the bundled repl and captures the environment `lake env` sets up in the project (or
+    the repl itself), so handlers can spawn the binary without a lake invocation each. The result is cached in
+    this process and on disk, until the binary is rebuilt or the project's `lean-toolchain` or `lake-manifest.json`
+    change.
+
+    :param project_path: An optional path for a Lean project directory, containing the desired Lean environment.
+    :param refresh: Ignore cached results and resolve again.
+    """
+    key = _cache_key(project_path)
+    with _lock:
+        if not refresh:
+            spec = _resolved.get(key) or _load_cached(key, project_path)
+            if spec is not None:
+                _resolved[key] = spec
+                return spec
+        subprocess.check_call(["lake", "build"], cwd=LEAN_REPL_PATH)
+        cwd = project_path if project_path is not None else LEAN_REPL_PATH
+        # Let the current interpreter print the environment, this works on any platform lake runs on
+        output = subprocess.check_output(
+            [
+                "lake",
+                "env",
+                sys.executable,
+                "-c",
+                "import json, os; print(json.dumps(dict(os.environ)))",
+            ],
+            cwd=cwd,
+            text=True,
+        )
+        lake_env = json.loads(output.strip().splitlines()[-1])
+        env = {}
+        prepend = {}
+        for name, value in lake_env.items():
+            current = os.environ.get(name)
+            if current == value:
+                continue
+            if current and value.endswith(os.pathsep + current):
+                # Lake put its entries in front of a search path, keep only those
+                prepend[name] = value[: -len(os.pathsep + current)]
+            else:
+                env[name] = value
+        spec = LeanREPLLaunchSpec(
+            command=[str(_binary_path())], env=env, cwd=cwd.resolve(), prepend=prepend
+        )
+        _resolved[key] = spec
+        try:
+            _store_cached(key, project_path, spec)
+        except OSError:
+            # A read-only install can still use the in-process cache
+            pass
+        return spec
@@ -0,0 +1,475 @@
+import asyncio
+import itertools
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Dict, Union, Tuple, List, Any, AsyncIterator, Iterator
+from pydantic import BaseModel
+from lean_repl_py.cache import LeanREPLCache
+from lean_repl_py.coalesce import _SingleFlight, _request_key
+from lean_repl_py.launch import resolve_repl
+from lean_repl_py.tracing import LeanREPLTracer
+from lean_repl_py.handler import (
+    LeanREPLEnvironment,
+    LeanREPLTimeoutError,
+    LeanREPLProofState,
+    LeanREPLNextProofState,
+    LeanREPLTacticResult,
+)
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+from lean_repl_py.snapshot import EnvSnapshotStore
+
+
+class LeanREPLPoolStats(BaseModel):
+    workers: int
+    busy_workers: int
+    queue_depth: int
+    worker_queue_depths: List[int]
+    completed: int
+    failed: int
+    uptime: float
+    throughput: float
+    # Requests that shared the response of an identical request in flight, instead of running
+    coalesced: int = 0
+    # Workers restarted after a timeout or crash, see `restart_failed`
+    restarts: int = 0
+
+
+class _WorkerHandles:
+    """Routing over `size` workers, each numbering its envs and proof states from 0, with pool-wide handles."""
+
+    size: int
+    # Requests in flight per worker
+    _queue_depths: List[int]
+    _round_robin: Iterator[int]
+
+    def _least_loaded(self) -> int:
+        # Start from a rotating offset, so ties are broken round robin
+        offset = next(self._round_robin)
+        order = [(offset + i) % self.size for i in range(self.size)]
+        return min(order, key=lambda idx: self._queue_depths[idx])
+
+    def _to_handle(self, worker_idx: int, index: int) -> int:
+        return index * self.size + worker_idx
+
+    def _from_handle(self, handle: int) -> Tuple[int, int]:
+        index, worker_idx = divmod(handle, self.size)
+        return worker_idx, index
+
+    def _translate(
+        self,
+        worker_idx: int,
+        response: Union[Dict[str, Any], LeanREPLNextProofState],
+        env: Optional[LeanREPLEnvironment],
+    ) -> Tuple[
+        Union[Dict[str, Any], LeanREPLNextProofState], Optional[LeanREPLEnvironment]
+    ]:
+        """Rewrite worker-local indices in a response into pool-wide handles."""
+        if env is not None:
+            env = LeanREPLEnvironment(
+                env_index=self._to_handle(worker_idx, env.env_index)
+            )
+        if isinstance(response, LeanREPLNextProofState):
+            response.proof_state = self._to_handle(worker_idx, response.proof_state)
+            return response, env
+        for sorry in response.get("sorries", []):
+            if isinstance(sorry, LeanREPLProofState):
+                sorry.proof_state = self._to_handle(worker_idx, sorry.proof_state)
+        for tactic in response.get("tactics", []):
+            if "proofState" in tactic:
+                tactic["proofState"] = self._to_handle(worker_idx, tactic["proofState"])
+        return response, env
+
+
+class LeanREPLPool(_WorkerHandles):
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        project_path: Optional[Path] = None,
+        cache: Optional[LeanREPLCache] = None,
+        tracer: Optional[LeanREPLTracer] = None,
+        coalesce: bool = False,
+        restart_failed: bool = False,
+    ):
+        """Initialize a pool of warm Lean REPL processes.
+
+        Environment and proof state indices returned by the pool are pool-wide handles. They encode the worker
+        owning the index, so requests referencing them are always routed to that worker. Requests without an
+        environment or proof state go to the worker with the fewest requests in flight.
+        Requests on one worker are pipelined, see `LeanREPLAsyncHandler.run_command`.
+
+        :param size: The number of REPL processes to keep alive, defaults to the number of CPUs.
+        :param project_path: An optional path for a Lean project directory, passed on to every worker.
+            The repl is built and resolved once here, with a blocking `lake build` if needed, not per worker.
+        :param cache: An optional response cache shared by all workers.
+        :param tracer: An optional tracer shared by all workers, see `LeanREPLAsyncHandler`.
+        :param coalesce: Let identical concurrent requests share one evaluation, see `LeanREPLAsyncHandler`.
+            Requests without an env or proof state are coalesced before picking a worker, so they share one too.
+        :param restart_failed: Restart a worker once one of its requests times out or its process exits, instead
+            of leaving it busy with the request or dead. The worker's envs and proof states are lost, and its other
+            pending requests fail with a `LeanREPLAbortedError`, so they can be sent again. `restarts` counts the
+            restarts of each worker.
+        """
+        self.size = size if size is not None else os.cpu_count() or 1
+        if self.size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        resolve_repl(project_path)
+        self.workers = [
+            LeanREPLAsyncHandler(
+                project_path, cache=cache, tracer=tracer, coalesce=coalesce
+            )
+            for _ in range(self.size)
+        ]
+        self._single_flight = _SingleFlight() if coalesce else None
+        self.restart_failed = restart_failed
+        self.restarts = [0] * self.size
+        # Restarts in progress, by worker
+        self._restarting: Dict[int, asyncio.Future] = {}
+        self._queue_depths = [0] * self.size
+        self._round_robin = itertools.cycle(range(self.size))
+        self._completed = 0
+        self._failed = 0
+        self._started = time.monotonic()
+
+    async def start(self) -> None:
+        """Spawn all worker processes, instead of lazily on their first request."""
+        await asyncio.gather(*(worker.await_process() for worker in self.workers))
+
+    async def _request(
+        self,
+        worker_idx: int,
+        data: Dict[str, Union[str, int]],
+        timeout: Optional[float] = None,
+    ) -> Optional[
+        Tuple[
+            Union[Dict[str, Any], LeanREPLNextProofState],
+            Optional[LeanREPLEnvironment],
+        ]
+    ]:
+        self._queue_depths[worker_idx] += 1
+        try:
+            result = await self.workers[worker_idx]._request(data, timeout)
+        except BaseException as e:
+            self._failed += 1
+            await self._after_failure(worker_idx, e)
+            raise
+        finally:
+            self._queue_depths[worker_idx] -= 1
+        self._completed += 1
+        if result is None:
+            return None
+        return self._translate(worker_idx, *result)
+
+    async def _after_failure(self, worker_idx: int, error: BaseException) -> None:
+        if self.restart_failed and self._failed_worker(worker_idx, error):
+            await self._restart(worker_idx)
+
+    def _failed_worker(self, worker_idx: int, error: BaseException) -> bool:
+        """Whether a request failed because its worker hangs or its process exited."""
+        if isinstance(error, LeanREPLTimeoutError):
+            return True
+        process = self.workers[worker_idx].process
+        # The reader fails the requests on the end of the output, possibly before the exit is noticed
+        return (
+            isinstance(error, RuntimeError)
+            and process is not None
+            and (process.returncode is not None or process.stdout.at_eof())
+        )
+
+    async def _restart(self, worker_idx: int) -> None:
+        """Restart a worker, or wait for the restart already in progress."""
+        restart = self._restarting.get(worker_idx)
+        if restart is None:
+            self.restarts[worker_idx] += 1
+            restart = self._restarting[worker_idx] = asyncio.ensure_future(
+                self.workers[worker_idx].restart(abort=True)
+            )
+            restart.add_done_callback(lambda _: self._restarting.pop(worker_idx, None))
+        await asyncio.shield(restart)
+
+    async def _unrouted_request(
+        self, data: Dict[str, Union[str, int]], timeout: Optional[float] = None
+    ):
+        """Run a request needing no particular worker on the least loaded one, see `coalesce`."""
+        if self._single_flight is None:
+            return await self._request(self._least_loaded(), data, timeout)
+        return await self._single_flight.run(
+            _request_key(data, timeout),
+            lambda: self._request(self._least_loaded(), data, timeout),
+        )
+
+    async def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Run a command on the worker owning `env`, or on the least loaded worker if no env is given."""
+        data: Dict[str, Union[str, int]] = {"cmd": command}
+        if env is None:
+            return await self._unrouted_request(data, timeout)
+        handle = env.env_index if isinstance(env, LeanREPLEnvironment) else env
+        worker_idx, data["env"] = self._from_handle(handle)
+        return await self._request(worker_idx, data, timeout)
+
+    async def run_command_replicated(
+        self,
+        command: str,
+        envs: List[LeanREPLEnvironment],
+        timeout: Optional[float] = None,
+        all_tactics: bool = False,
+    ):
+        """Run a command on the least loaded worker, in its copy of an environment that every worker has.
+
+        :param envs: One handle per worker of the same environment, e.g. from `restore_env`.
+        :param all_tactics: Also return the tactics of the command.
+        """
+        worker_idx = self._least_loaded()
+        owner, local_idx = self._from_handle(envs[worker_idx].env_index)
+        if owner != worker_idx:
+            raise ValueError("Pass one env per worker, in worker order.")
+        data: Dict[str, Union[str, int]] = {"cmd": command, "env": local_idx}
+        if all_tactics:
+            data["allTactics"] = True
+        return await self._request(worker_idx, data, timeout)
+
+    async def run_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ):
+        """Run a tactic on the worker owning the proof state."""
+        worker_idx, local_idx = self._from_handle(proof_state_idx)
+        return await self._request(
+            worker_idx, {"tactic": tactic, "proofState": local_idx}, timeout
+        )
+
+    async def run_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ):
+        """Check a file on the least loaded worker."""
+        return await self._unrouted_request(
+            {"path": str(path.absolute()), "allTactics": all_tactics}, timeout
+        )
+
+    async def stream_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Check a file on the least loaded worker, yielding its response piece by piece.
+
+        See `LeanREPLAsyncHandler.stream_file`, envs and proof states are yielded as pool-wide handles.
+        """
+        worker_idx = self._least_loaded()
+        items = self.workers[worker_idx].stream_file(path, all_tactics, timeout)
+        self._queue_depths[worker_idx] += 1
+        try:
+            async for field, value in items:
+                yield field, self._translate_item(worker_idx, field, value)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._queue_depths[worker_idx] -= 1
+            await items.aclose()
+        self._completed += 1
+
+    def _translate_item(self, worker_idx: int, field: str, value: Any) -> Any:
+        """Rewrite the worker-local index in a streamed item into a pool-wide handle."""
+        if field == "env":
+            return LeanREPLEnvironment(
+                env_index=self._to_handle(worker_idx, value.env_index)
+            )
+        if field == "sorries":
+            value.proof_state = self._to_handle(worker_idx, value.proof_state)
+        elif field == "tactics" and "proofState" in value:
+            value["proofState"] = self._to_handle(worker_idx, value["proofState"])
+        return value
+
+    async def run_tactics(
+        self,
+        proof_state_idx: int,
+        tactics: List[str],
+        timeout: Optional[float] = None,
+        spread: bool = False,
+    ) -> List[LeanREPLTacticResult]:
+        """Run several candidate tactics on one proof state, see `run_tactics_many`.
+
+        :return: One result per tactic, in input order.
+        """
+        results = await self.run_tactics_many(
+            {proof_state_idx: tactics}, timeout, spread
+        )
+        return results[proof_state_idx]
+
+    async def run_tactics_many(
+        self,
+        candidates: Dict[int, List[str]],
+        timeout: Optional[float] = None,
+        spread: bool = False,
+    ) -> Dict[int, List[LeanREPLTacticResult]]:
+        """Run candidate tactics on several proof states, each batch pipelined on the worker owning the state.
+
+        :param candidates: The tactics to try, by the proof state handle to try them on.
+        :param timeout: The maximum time for each tactic, see `LeanREPLAsyncHandler.run_command`.
+        :param spread: Copy the proof states to all workers first, by pickling them, and split the tactics
+            evenly among the workers. Worth it if a few states get many slow tactics. The copies stay alive in
+            the workers.
+        :return: One result per tactic, by proof state and in input order. `proof_state` of each result is the
+            handle it was requested on, the next proof state is a handle on the worker that ran the tactic.
+        """
+        if spread and self.size > 1:
+            copies = await self._copy_proof_states(list(candidates))
+        else:
+            copies = {}
+            for handle in candidates:
+                worker_idx, local_idx = self._from_handle(handle)
+                copies[handle] = {worker_idx: local_idx}
+        batches: Dict[int, Dict[int, List[str]]] = {}
+        # Where each tactic ends up, as (worker, local proof state, position in that batch)
+        placements: Dict[int, List[Tuple[int, int, int]]] = {}
+        next_worker = 0
+        for handle, tactics in candidates.items():
+            placements[handle] = []
+            workers = sorted(copies[handle])
+            for tactic in tactics:
+                worker_idx = workers[next_worker % len(workers)]
+                next_worker += 1
+                local_idx = copies[handle][worker_idx]
+                batch = batches.setdefault(worker_idx, {}).setdefault(local_idx, [])
+                placements[handle].append((worker_idx, local_idx, len(batch)))
+                batch.append(tactic)
+        worker_results = dict(
+            zip(
+                batches,
+                await asyncio.gather(
+                    *(
+                        self._run_tactics(worker_idx, batch, timeout)
+                        for worker_idx, batch in batches.items()
+                    )
+                ),
+            )
+        )
+        results: Dict[int, List[LeanREPLTacticResult]] = {}
+        for handle, handle_placements in placements.items():
+            results[handle] = []
+            for worker_idx, local_idx, position in handle_placements:
+                result = worker_results[worker_idx][local_idx][position]
+                result.proof_state = handle
+                results[handle].append(result)
+        return results
+
+    async def _run_tactics(
+        self,
+        worker_idx: int,
+        candidates: Dict[int, List[str]],
+        timeout: Optional[float] = None,
+    ) -> Dict[int, List[LeanREPLTacticResult]]:
+        count = sum(len(tactics) for tactics in candidates.values())
+        self._queue_depths[worker_idx] += count
+        try:
+            results = await self.workers[worker_idx].run_tactics_many(
+                candidates, timeout
+            )
+        except BaseException:
+            self._failed += count
+            raise
+        finally:
+            self._queue_depths[worker_idx] -= count
+        self._completed += count
+        for batch in results.values():
+            for result in batch:
+                if result.next_proof_state is not None:
+                    result.next_proof_state.proof_state = self._to_handle(
+                        worker_idx, result.next_proof_state.proof_state
+                    )
+        return results
+
+    async def _copy_proof_states(self, handles: List[int]) -> Dict[int, Dict[int, int]]:
+        """Pickle proof states on their workers and unpickle them on all others.
+
+        :return: For each handle, the local proof state index on every worker.
+        """
+        by_owner: Dict[int, List[int]] = {}
+        copies: Dict[int, Dict[int, int]] = {}
+        for handle in handles:
+            worker_idx, local_idx = self._from_handle(handle)
+            by_owner.setdefault(worker_idx, []).append(local_idx)
+            copies[handle] = {worker_idx: local_idx}
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoints = await asyncio.gather(
+                *(
+                    self.workers[owner].checkpoint_proof_states(
+                        local_indices, Path(directory) / str(owner)
+                    )
+                    for owner, local_indices in by_owner.items()
+                )
+            )
+            targets = [
+                (owner, checkpoint, worker_idx)
+                for owner, checkpoint in zip(by_owner, checkpoints)
+                for worker_idx in range(self.size)
+                if worker_idx != owner
+            ]
+            restored = await asyncio.gather(
+                *(
+                    self.workers[worker_idx].restore_proof_states(checkpoint)
+                    for _, checkpoint, worker_idx in targets
+                )
+            )
+        for (owner, _, worker_idx), mapping in zip(targets, restored):
+            for local_idx, copy_idx in mapping.items():
+                copies[self._to_handle(owner, local_idx)][worker_idx] = copy_idx
+        return copies
+
+    async def restore_env(
+        self, store: EnvSnapshotStore, header: str
+    ) -> List[LeanREPLEnvironment]:
+        """Restore the environment for `header` on every worker from a snapshot store.
+
+        The first worker elaborates and pickles the header if the store has no snapshot yet, all others unpickle.
+
+        :return: One pool-wide environment handle per worker.
+        """
+
+        async def restore(worker_idx: int) -> LeanREPLEnvironment:
+            try:
+                return await store.restore_async(self.workers[worker_idx], header)
+            except BaseException as e:
+                await self._after_failure(worker_idx, e)
+                raise
+
+        envs = [await restore(0)]
+        envs += await asyncio.gather(*(restore(idx) for idx in range(1, self.size)))
+        return [
+            LeanREPLEnvironment(env_index=self._to_handle(worker_idx, env.env_index))
+            for worker_idx, env in enumerate(envs)
+        ]
+
+    def stats(self) -> LeanREPLPoolStats:
+        uptime = time.monotonic() - self._started
+        return LeanREPLPoolStats(
+            workers=self.size,
+            busy_workers=sum(1 for depth in self._queue_depths if depth),
+            queue_depth=sum(self._queue_depths),
+            worker_queue_depths=list(self._queue_depths),
+            completed=self._completed,
+            failed=self._failed,
+            uptime=uptime,
+            throughput=self._completed / uptime if uptime > 0 else 0.0,
+            restarts=sum(self.restarts),
+            coalesced=sum(worker.coalesced for worker in self.workers)
+            + (self._single_flight.coalesced if self._single_flight is not None else 0),
+        )
+
+    async def close(self):
+        """Close all worker processes."""
+        for worker in self.workers:
+            if worker.process is None and worker._process_task is None:
+                # Never spawned, discard the pending coroutine
+                worker.process_future.close()
+        spawning = [
+            worker for worker in self.workers if worker._process_task is not None
+        ]
+        await asyncio.gather(*(worker.await_process() for worker in spawning))
+        await asyncio.gather(
+            *(worker.close() for worker in self.workers if worker.process is not None)
+        )
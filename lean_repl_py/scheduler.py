@@ -0,0 +1,271 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from pathlib import Path
+from typing import Optional, Dict, Union, Tuple, List, Any
+from pydantic import BaseModel
+from lean_repl_py.handler import LeanREPLEnvironment, LeanREPLTimeoutError
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+from lean_repl_py.pool import LeanREPLPool
+
+
+class LeanREPLSchedulerStats(BaseModel):
+    queued: int
+    running: int
+    completed: int
+    failed: int
+    # Dropped from the queue as their deadline passed before they were sent
+    expired: int
+    # Cancelled by the caller, while queued or running
+    cancelled: int
+    # Process restarts after a request was cancelled or timed out while Lean was running it
+    restarts: int
+
+
+class _Scheduled:
+    __slots__ = ("data", "timeout", "deadline", "future", "timer", "task")
+
+    def __init__(
+        self,
+        data: Dict[str, Union[str, int]],
+        timeout: Optional[float],
+        deadline: Optional[float],
+        future: asyncio.Future,
+    ):
+        self.data = data
+        self.timeout = timeout
+        self.deadline = deadline
+        self.future = future
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+# Heap entries, ordered by priority, then deadline, then submission
+_QueueEntry = Tuple[int, float, int, _Scheduled]
+
+
+class LeanREPLScheduler:
+    def __init__(
+        self,
+        runner: Union[LeanREPLAsyncHandler, LeanREPLPool],
+        restart_abandoned: bool = True,
+    ):
+        """Send requests to a handler or pool by priority and deadline, instead of first come, first served.
+
+        Each REPL process gets one request at a time, so the queued ones can still be reordered: the highest
+        priority goes first, ties go to the earliest deadline and then to the earliest request. A request whose
+        deadline passes while it is queued fails with a `LeanREPLTimeoutError` without reaching Lean, once sent,
+        its timeout is capped to the time left. Cancelling the task awaiting a request removes it from the queue.
+        Requests on a pool run on the worker owning their env or proof state, others on the next free worker.
+
+        :param runner: The handler or pool to send the requests to, not used by anything else at the same time.
+        :param restart_abandoned: Restart the process of a request that is cancelled or times out while Lean runs
+            it, so Lean does not keep working on it. All envs and proof states of the process are lost. If not set,
+            the process stays busy until Lean answers the abandoned request.
+        """
+        self.runner = runner
+        self.restart_abandoned = restart_abandoned
+        self.size = runner.size if isinstance(runner, LeanREPLPool) else 1
+        self._queues: List[List[_QueueEntry]] = [[] for _ in range(self.size)]
+        # Requests that can run on any worker
+        self._unrouted: List[_QueueEntry] = []
+        self._running: List[Optional[_Scheduled]] = [None] * self.size
+        self._order = itertools.count()
+        self._completed = 0
+        self._failed = 0
+        self._expired = 0
+        self._cancelled = 0
+        self._restarts = 0
+
+    def _route(self, handle: int) -> Tuple[int, int]:
+        if isinstance(self.runner, LeanREPLPool):
+            return self.runner._from_handle(handle)
+        return 0, handle
+
+    async def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ):
+        """Run a command once it is its turn, see `LeanREPLAsyncHandler.run_command`.
+
+        :param priority: Requests with a higher priority are sent first.
+        :param deadline: The `time.monotonic()` time by which the response is needed.
+        """
+        data: Dict[str, Union[str, int]] = {"cmd": command}
+        if env is None:
+            return await self._schedule(None, data, timeout, priority, deadline)
+        handle = env.env_index if isinstance(env, LeanREPLEnvironment) else env
+        worker_idx, data["env"] = self._route(handle)
+        return await self._schedule(worker_idx, data, timeout, priority, deadline)
+
+    async def run_tactic(
+        self,
+        tactic: str,
+        proof_state_idx: int,
+        timeout: Optional[float] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ):
+        """Run a tactic once it is its turn, see `run_command`."""
+        worker_idx, local_idx = self._route(proof_state_idx)
+        data: Dict[str, Union[str, int]] = {"tactic": tactic, "proofState": local_idx}
+        return await self._schedule(worker_idx, data, timeout, priority, deadline)
+
+    async def run_file(
+        self,
+        path: Path,
+        all_tactics: bool = True,
+        timeout: Optional[float] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ):
+        """Check a file once it is its turn, see `run_command`."""
+        data: Dict[str, Union[str, int]] = {
+            "path": str(path.absolute()),
+            "allTactics": all_tactics,
+        }
+        return await self._schedule(None, data, timeout, priority, deadline)
+
+    async def _schedule(
+        self,
+        worker_idx: Optional[int],
+        data: Dict[str, Union[str, int]],
+        timeout: Optional[float],
+        priority: int,
+        deadline: Optional[float],
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        item = _Scheduled(data, timeout, deadline, loop.create_future())
+        if deadline is not None:
+            item.timer = loop.call_later(
+                max(deadline - time.monotonic(), 0), self._expire, item
+            )
+        queue = self._unrouted if worker_idx is None else self._queues[worker_idx]
+        order = deadline if deadline is not None else math.inf
+        heapq.heappush(queue, (-priority, order, next(self._order), item))
+        self._dispatch()
+        try:
+            return await item.future
+        except asyncio.CancelledError:
+            if item.task is None:
+                # Still queued, it is skipped once it comes up
+                self._cancelled += 1
+                if item.timer is not None:
+                    item.timer.cancel()
+            elif not item.task.done():
+                item.task.cancel()
+            raise
+
+    def _expire(self, item: _Scheduled) -> None:
+        if item.task is None and not item.future.done():
+            self._expired += 1
+            item.future.set_exception(
+                LeanREPLTimeoutError("Deadline passed before the request was sent.")
+            )
+
+    def _next(self, worker_idx: int) -> Optional[_Scheduled]:
+        """Pop the most urgent queued request that can run on the worker."""
+        queues = [self._queues[worker_idx], self._unrouted]
+        while True:
+            for queue in queues:
+                # Drop cancelled and expired requests
+                while queue and queue[0][3].future.done():
+                    heapq.heappop(queue)
+            candidates = [queue for queue in queues if queue]
+            if not candidates:
+                return None
+            item = heapq.heappop(min(candidates, key=lambda queue: queue[0]))[3]
+            if item.deadline is not None and item.deadline <= time.monotonic():
+                # The timer did not get to run yet
+                self._expire(item)
+                continue
+            return item
+
+    def _dispatch(self) -> None:
+        """Start the most urgent requests on the idle workers."""
+        for worker_idx in range(self.size):
+            if self._running[worker_idx] is not None:
+                continue
+            item = self._next(worker_idx)
+            if item is None:
+                continue
+            if item.timer is not None:
+                item.timer.cancel()
+            self._running[worker_idx] = item
+            item.task = asyncio.ensure_future(self._run(worker_idx, item))
+
+    async def _send(
+        self,
+        worker_idx: int,
+        data: Dict[str, Union[str, int]],
+        timeout: Optional[float],
+    ) -> Any:
+        if isinstance(self.runner, LeanREPLPool):
+            return await self.runner._request(worker_idx, data, timeout)
+        return await self.runner._request(data, timeout)
+
+    async def _restart(self, worker_idx: int) -> None:
+        if isinstance(self.runner, LeanREPLPool):
+            await self.runner.workers[worker_idx].restart(abort=True)
+        else:
+            await self.runner.restart(abort=True)
+        self._restarts += 1
+
+    async def _run(self, worker_idx: int, item: _Scheduled) -> None:
+        timeout = item.timeout
+        if item.deadline is not None:
+            left = max(item.deadline - time.monotonic(), 0)
+            timeout = left if timeout is None else min(timeout, left)
+        abandoned = False
+        try:
+            try:
+                result = await self._send(worker_idx, item.data, timeout)
+            except asyncio.CancelledError:
+                abandoned = True
+                self._cancelled += 1
+            except Exception as e:
+                abandoned = isinstance(e, LeanREPLTimeoutError)
+                self._failed += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+            else:
+                self._completed += 1
+                if not item.future.done():
+                    item.future.set_result(result)
+            if abandoned and self.restart_abandoned:
+                await self._restart(worker_idx)
+        finally:
+            self._running[worker_idx] = None
+            self._dispatch()
+
+    def stats(self) -> LeanREPLSchedulerStats:
+        return LeanREPLSchedulerStats(
+            queued=sum(
+                1
+                for queue in self._queues + [self._unrouted]
+                for entry in queue
+                if not entry[3].future.done()
+            ),
+            running=sum(1 for item in self._running if item is not None),
+            completed=self._completed,
+            failed=self._failed,
+            expired=self._expired,
+            cancelled=self._cancelled,
+            restarts=self._restarts,
+        )
+
+    async def close(self) -> None:
+        """Cancel the queued requests and wait for the running ones, the runner is left open."""
+        for queue in self._queues + [self._unrouted]:
+            for entry in queue:
+                entry[3].future.cancel()
+            queue.clear()
+        running = [item.task for item in self._running if item is not None]
+        if running:
+            await asyncio.wait(running)
@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+from typing import (
+    Optional,
+    Dict,
+    Union,
+    Tuple,
+    List,
+    Callable,
+    Awaitable,
+    Set,
+)
+from pydantic import BaseModel
+from lean_repl_py.handler import LeanREPLTacticResult
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+from lean_repl_py.pool import LeanREPLPool
+from lean_repl_py.server import LeanREPLClient
+
+
+def goals_key(goals: List[str]) -> Tuple[str, ...]:
+    """Normalize goals for the transposition table, ignoring differences in whitespace."""
+    return tuple(" ".join(goal.split()) for goal in goals)
+
+
+class LeanREPLSearchNode:
+    """A proof state in the search tree, shared by all tactic sequences reaching the same goals."""
+
+    __slots__ = ("proof_state", "goals", "parent", "tactic", "depth", "expanded")
+
+    def __init__(
+        self,
+        proof_state: int,
+        goals: List[str],
+        parent: Optional["LeanREPLSearchNode"] = None,
+        tactic: Optional[str] = None,
+    ):
+        self.proof_state = proof_state
+        self.goals = goals
+        self.parent = parent
+        self.tactic = tactic
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.expanded = False
+
+    def tactics(self) -> List[str]:
+        """The tactics leading from the root to this node, along the shortest path found so far."""
+        tactics = []
+        node = self
+        while node.parent is not None:
+            tactics.append(node.tactic)
+            node = node.parent
+        return tactics[::-1]
+
+    def __repr__(self) -> str:
+        return f"LeanREPLSearchNode(proof_state={self.proof_state}, depth={self.depth}, goals={self.goals!r})"
+
+
+# Proposes candidate tactics for a node, sync or async
+LeanREPLTacticProposer = Callable[
+    [LeanREPLSearchNode], Union[List[str], Awaitable[List[str]]]
+]
+# Scores a node for the frontier, higher is expanded first
+LeanREPLNodeScorer = Callable[[LeanREPLSearchNode], float]
+
+
+def default_score(node: LeanREPLSearchNode) -> float:
+    """Prefer few remaining goals, then shallow nodes."""
+    return -(len(node.goals) + node.depth)
+
+
+class LeanREPLSearchResult(BaseModel):
+    # The tactics proving the root, None if no proof was found
+    proof: Optional[List[str]]
+    expanded: int
+    # Distinct proof states by their goals, including the root
+    states: int
+    # Tactic results that reached the goals of a known state and were merged into it
+    merged: int
+    tactics_run: int
+    elapsed: float
+
+    @property
+    def proved(self) -> bool:
+        return self.proof is not None
+
+
+class LeanREPLProofSearch:
+    def __init__(
+        self,
+        runner: Union[LeanREPLAsyncHandler, LeanREPLPool, LeanREPLClient],
+        propose: LeanREPLTacticProposer,
+        score: LeanREPLNodeScorer = default_score,
+        max_expansions: int = 100,
+        parallel: Optional[int] = None,
+        tactic_timeout: Optional[float] = None,
+    ):
+        """Best-first proof search with a transposition table on goals.
+
+        Nodes are expanded in order of their score: the proposer suggests tactics for the node, which are run
+        as one batch with `run_tactics`. A tactic reaching goals that are already in the table, after normalizing
+        whitespace, is merged into the existing node instead of being expanded again, and the node keeps the
+        shorter of the two paths. The search stops at the first proof, i.e. a tactic leaving no goals.
+
+        :param runner: The async handler, pool or server client to run tactics on. A pool spreads parallel
+            expansions over its workers by proof state.
+        :param propose: Returns the candidate tactics for a node, e.g. from a language model.
+        :param score: Orders the frontier, higher scores are expanded first. Called once per node when it is
+            discovered, and again if a shorter path to it is found.
+        :param max_expansions: The maximum number of nodes to expand.
+        :param parallel: The maximum number of nodes expanded at the same time, defaults to the pool size or 1.
+        :param tactic_timeout: The maximum time for each tactic, a timed out tactic counts as failed.
+        """
+        self.runner = runner
+        self.propose = propose
+        self.score = score
+        self.max_expansions = max_expansions
+        if parallel is None:
+            parallel = runner.size if isinstance(runner, LeanREPLPool) else 1
+        self.parallel = parallel
+        self.tactic_timeout = tactic_timeout
+        # The nodes of the last run, by their normalized goals
+        self.table: Dict[Tuple[str, ...], LeanREPLSearchNode] = {}
+        self._frontier: List[Tuple[float, int, LeanREPLSearchNode]] = []
+        self._counter = itertools.count()
+        self._merged = 0
+        self._tactics_run = 0
+
+    def _push(self, node: LeanREPLSearchNode) -> None:
+        heapq.heappush(self._frontier, (-self.score(node), next(self._counter), node))
+
+    def _pop(self) -> Optional[LeanREPLSearchNode]:
+        while self._frontier:
+            _, _, node = heapq.heappop(self._frontier)
+            # Nodes are pushed again when a shorter path is found, skip the stale entries
+            if not node.expanded:
+                return node
+        return None
+
+    async def _expand(
+        self, node: LeanREPLSearchNode
+    ) -> Tuple[LeanREPLSearchNode, List[LeanREPLTacticResult]]:
+        tactics = self.propose(node)
+        if inspect.isawaitable(tactics):
+            tactics = await tactics
+        # Proposers often repeat themselves, run each tactic once
+        tactics = list(dict.fromkeys(tactics))
+        if not tactics:
+            return node, []
+        results = await self.runner.run_tactics(
+            node.proof_state, tactics, self.tactic_timeout
+        )
+        self._tactics_run += len(results)
+        return node, results
+
+    def _add(
+        self, parent: LeanREPLSearchNode, result: LeanREPLTacticResult
+    ) -> Optional[LeanREPLSearchNode]:
+        """Add the state a tactic reached, returning the node if it has no goals left."""
+        next_state = result.next_proof_state
+        if next_state is None or any(
+            message.severity == "error" for message in next_state.messages
+        ):
+            return None
+        key = goals_key(next_state.goals)
+        node = self.table.get(key)
+        if node is not None:
+            self._merged += 1
+            if parent.depth + 1 < node.depth:
+                # A shorter path to a known state, cannot be a descendant of the node
+                node.parent = parent
+                node.tactic = result.tactic
+                node.depth = parent.depth + 1
+                if not node.expanded:
+                    self._push(node)
+            return None
+        node = LeanREPLSearchNode(
+            next_state.proof_state, list(next_state.goals), parent, result.tactic
+        )
+        self.table[key] = node
+        if not node.goals:
+            return node
+        self._push(node)
+        return None
+
+    async def run(
+        self,
+        proof_state: int,
+        goals: List[str],
+        timeout: Optional[float] = None,
+    ) -> LeanREPLSearchResult:
+        """Search for a proof of a proof state, e.g. of a sorry returned by `run_command`.
+
+        :param proof_state: The proof state to prove, or a pool-wide handle if the runner is a pool.
+        :param goals: The goals of the proof state, e.g. `[sorry.goal]`.
+        :param timeout: The maximum time for the whole search, expansions still running are cancelled.
+        """
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        expanded = 0
+        self._merged = self._tactics_run = 0
+        root = LeanREPLSearchNode(proof_state, goals)
+        self.table = {goals_key(goals): root}
+        self._frontier = []
+        self._push(root)
+        proof: Optional[List[str]] = None
+        running: Set[asyncio.Future] = set()
+        try:
+            while proof is None:
+                while (
+                    len(running) < self.parallel
+                    and expanded + len(running) < self.max_expansions
+                ):
+                    node = self._pop()
+                    if node is None:
+                        break
+                    node.expanded = True
+                    running.add(asyncio.ensure_future(self._expand(node)))
+                if not running:
+                    break
+                remaining = (
+                    deadline - time.monotonic() if deadline is not None else None
+                )
+                if remaining is not None and remaining <= 0:
+                    break
+                done, running = await asyncio.wait(
+                    running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    node, results = task.result()
+                    expanded += 1
+                    for result in results:
+                        solved = self._add(node, result)
+                        if solved is not None and proof is None:
+                            proof = solved.tactics()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        return LeanREPLSearchResult(
+            proof=proof,
+            expanded=expanded,
+            states=len(self.table),
+            merged=self._merged,
+            tactics_run=self._tactics_run,
+            elapsed=time.monotonic() - start,
+        )
@@ -0,0 +1,688 @@
+import argparse
+import asyncio
+import hmac
+import itertools
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Optional, Dict, Union, Tuple, List, Any, Set
+from pydantic import BaseModel
+from lean_repl_py.handler import (
+    LeanREPLEnvironment,
+    LeanREPLNextProofState,
+    LeanREPLNextProofStateView,
+    LeanREPLTacticResult,
+    LeanREPLTimeoutError,
+    _parse_stream_item,
+)
+from lean_repl_py.pool import LeanREPLPool, LeanREPLPoolStats
+
+# Longest request or response line, files and huge `allTactics` responses are sent as one line
+SERVER_LINE_LIMIT = 1 << 28
+# Requests of one session in flight before the server stops reading from its connection
+SERVER_SESSION_WINDOW = 64
+# Requests in flight on the server per pool worker before new ones are rejected
+SERVER_PENDING_PER_WORKER = 256
+
+
+class LeanREPLServerError(RuntimeError):
+    """Raised by `LeanREPLClient` if the server rejected or failed a request.
+
+    `kind` is "overloaded" if the server is at its session or request limit and the request can be retried later,
+    "invalid" if the server could not make sense of it, e.g. it references a handle of another session,
+    "unauthorized" if the client did not send the server's token, and "error" otherwise.
+    """
+
+    def __init__(self, message: str, kind: str = "error"):
+        super().__init__(message)
+        self.kind = kind
+
+
+class LeanREPLServerStats(BaseModel):
+    sessions: int
+    pending: int
+    # Requests and connections turned away because the server was at its limits
+    rejected: int
+    pool: LeanREPLPoolStats
+
+
+def _dump(item: Any) -> Any:
+    return item.model_dump(by_alias=True) if isinstance(item, BaseModel) else item
+
+
+def _dump_response(
+    response: Union[Dict[str, Any], LeanREPLNextProofState],
+    env: Optional[LeanREPLEnvironment],
+) -> Dict[str, Any]:
+    """Turn a parsed response back into the JSON the REPL sent, with pool-wide handles."""
+    if isinstance(response, BaseModel):
+        data = response.model_dump(by_alias=True)
+    else:
+        data = {
+            field: [_dump(item) for item in value] if isinstance(value, list) else value
+            for field, value in response.items()
+        }
+    if env is not None:
+        data["env"] = env.env_index
+    return data
+
+
+class _Session:
+    """The envs and proof states of one connection, numbered from 0 in the order they were created."""
+
+    def __init__(self):
+        self.envs: List[int] = []
+        self.proof_states: List[int] = []
+
+    @staticmethod
+    def _handle(handles: List[int], idx: Any, what: str) -> int:
+        if not isinstance(idx, int) or not 0 <= idx < len(handles):
+            raise ValueError(f"Unknown {what} {idx!r} in this session.")
+        return handles[idx]
+
+    def env(self, idx: Any) -> int:
+        return self._handle(self.envs, idx, "environment")
+
+    def proof_state(self, idx: Any) -> int:
+        return self._handle(self.proof_states, idx, "proof state")
+
+    def _add_proof_state(self, handle: int) -> int:
+        self.proof_states.append(handle)
+        return len(self.proof_states) - 1
+
+    def export(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the pool-wide handles in a dumped response with new session indices, in place."""
+        if "env" in data:
+            self.envs.append(data["env"])
+            data["env"] = len(self.envs) - 1
+        if "proofState" in data:
+            data["proofState"] = self._add_proof_state(data["proofState"])
+        for item in data.get("sorries", []) + data.get("tactics", []):
+            if "proofState" in item:
+                item["proofState"] = self._add_proof_state(item["proofState"])
+        return data
+
+
+class LeanREPLServer:
+    def __init__(
+        self,
+        pool: LeanREPLPool,
+        max_sessions: int = 64,
+        max_pending: Optional[int] = None,
+        session_window: int = SERVER_SESSION_WINDOW,
+        token: Optional[str] = None,
+    ):
+        """Serve a pool to `LeanREPLClient`s over TCP or a Unix socket, with newline-delimited JSON.
+
+        Every connection is a session with its own env and proof state indices, counting from 0, so clients only
+        see and can only use what they created. Requests of a session run concurrently and are answered as they
+        finish, each tagged with the id of its request.
+
+        Clients can run arbitrary code on the server, e.g. with `#eval`, and `run_file` reads any file the server
+        can. Never make the server reachable from untrusted networks, and set a token if anyone but you can
+        connect to it.
+
+        :param pool: The pool to run requests on, the server does not close it.
+        :param max_sessions: Connections beyond this many are refused.
+        :param max_pending: Requests in flight on the whole server beyond this many are rejected with an
+            "overloaded" error, defaults to `SERVER_PENDING_PER_WORKER` per pool worker.
+        :param session_window: Requests of one session in flight before the server stops reading from its
+            connection, so a client sending faster than the pool answers is slowed down by TCP flow control.
+        :param token: If set, a shared secret clients must send before their first request, see `LeanREPLClient`.
+            Connections sending anything else are dropped. The token is sent in plain text.
+        """
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.max_pending = (
+            max_pending
+            if max_pending is not None
+            else pool.size * SERVER_PENDING_PER_WORKER
+        )
+        self.session_window = session_window
+        self.token = token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._pending = 0
+        self._rejected = 0
+
+    async def start(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        path: Optional[Path] = None,
+    ) -> None:
+        """Start listening on a TCP port, or on a Unix socket if `path` is given."""
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._connection, str(path), limit=SERVER_LINE_LIMIT
+            )
+        else:
+            self._server = await asyncio.start_server(
+                self._connection, host, port, limit=SERVER_LINE_LIMIT
+            )
+
+    @property
+    def address(self) -> Any:
+        """The address the server listens on, e.g. to find the port picked for port 0."""
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self) -> None:
+        await self._server.serve_forever()
+
+    def stats(self) -> LeanREPLServerStats:
+        return LeanREPLServerStats(
+            sessions=len(self._connections),
+            pending=self._pending,
+            rejected=self._rejected,
+            pool=self.pool.stats(),
+        )
+
+    async def close(self) -> None:
+        """Stop listening and drop all connections."""
+        if self._server is not None:
+            self._server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Concurrent drains on one stream fail before Python 3.10
+        lock = asyncio.Lock()
+        if len(self._connections) >= self.max_sessions:
+            self._rejected += 1
+            await self._write(
+                writer,
+                lock,
+                {"id": None, "error": _error("overloaded", "Too many sessions.")},
+            )
+            writer.close()
+            return
+        self._connections.add(asyncio.current_task())
+        if self.token is not None and not await self._authenticate(reader):
+            self._connections.discard(asyncio.current_task())
+            await self._write(
+                writer,
+                lock,
+                {"id": None, "error": _error("unauthorized", "Invalid token.")},
+            )
+            writer.close()
+            return
+        session = _Session()
+        window = asyncio.Semaphore(self.session_window)
+        requests: Set[asyncio.Task] = set()
+        try:
+            while True:
+                await window.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # Longer than the line limit, or the client went away
+                    break
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._serve(session, line, writer, lock))
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+                task.add_done_callback(lambda _: window.release())
+        finally:
+            self._connections.discard(asyncio.current_task())
+            for task in requests:
+                task.cancel()
+            writer.close()
+
+    async def _authenticate(self, reader: asyncio.StreamReader) -> bool:
+        """Read the first line of a connection and check that it holds the token."""
+        try:
+            token = json.loads(await reader.readline())["token"]
+        except (ValueError, KeyError, TypeError, ConnectionError):
+            return False
+        return isinstance(token, str) and hmac.compare_digest(
+            token.encode(), self.token.encode()
+        )
+
+    async def _serve(
+        self,
+        session: _Session,
+        line: bytes,
+        writer: asyncio.StreamWriter,
+        lock: asyncio.Lock,
+    ) -> None:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request["id"]
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise _Overloaded("Too many requests in flight, retry later.")
+            method = _METHODS[request["method"]]
+            self._pending += 1
+            try:
+                message = {
+                    "id": request_id,
+                    "result": await method(self, session, request.get("params", {})),
+                }
+            finally:
+                self._pending -= 1
+        except _Overloaded as e:
+            message = {"id": request_id, "error": _error("overloaded", str(e))}
+        except LeanREPLTimeoutError as e:
+            message = {"id": request_id, "error": _error("timeout", str(e))}
+        except (ValueError, KeyError, TypeError) as e:
+            message = {"id": request_id, "error": _error("invalid", str(e))}
+        except Exception as e:
+            message = {"id": request_id, "error": _error("error", str(e))}
+        try:
+            await self._write(writer, lock, message)
+        except ConnectionError:
+            # The client is gone, there is nobody to answer
+            pass
+
+    @staticmethod
+    async def _write(
+        writer: asyncio.StreamWriter, lock: asyncio.Lock, message: Dict[str, Any]
+    ) -> None:
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode())
+        async with lock:
+            await writer.drain()
+
+    async def _run_command(
+        self, session: _Session, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        env = session.env(params["env"]) if params.get("env") is not None else None
+        response, env = await self.pool.run_command(
+            params["command"], env, params.get("timeout")
+        )
+        return session.export(_dump_response(response, env))
+
+    async def _run_tactic(
+        self, session: _Session, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        response, env = await self.pool.run_tactic(
+            params["tactic"],
+            session.proof_state(params["proof_state"]),
+            params.get("timeout"),
+        )
+        return session.export(_dump_response(response, env))
+
+    async def _run_file(
+        self, session: _Session, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        response, env = await self.pool.run_file(
+            Path(params["path"]), params.get("all_tactics", True), params.get("timeout")
+        )
+        return session.export(_dump_response(response, env))
+
+    async def _run_tactics_many(
+        self, session: _Session, params: Dict[str, Any]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        # JSON object keys are strings
+        candidates = {
+            session.proof_state(int(idx)): tactics
+            for idx, tactics in params["candidates"].items()
+        }
+        handles = dict(zip(candidates, params["candidates"]))
+        results = await self.pool.run_tactics_many(
+            candidates, params.get("timeout"), params.get("spread", False)
+        )
+        return {
+            handles[handle]: [
+                {
+                    "tactic": result.tactic,
+                    "nextProofState": (
+                        session.export(_dump_response(result.next_proof_state, None))
+                        if result.next_proof_state is not None
+                        else None
+                    ),
+                    "error": result.error,
+                    "elapsed": result.elapsed,
+                }
+                for result in batch
+            ]
+            for handle, batch in results.items()
+        }
+
+    async def _stats(self, session: _Session, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self.stats().model_dump()
+
+
+class _Overloaded(Exception):
+    pass
+
+
+def _error(kind: str, message: str) -> Dict[str, str]:
+    return {"kind": kind, "message": message}
+
+
+_METHODS = {
+    "run_command": LeanREPLServer._run_command,
+    "run_tactic": LeanREPLServer._run_tactic,
+    "run_file": LeanREPLServer._run_file,
+    "run_tactics_many": LeanREPLServer._run_tactics_many,
+    "stats": LeanREPLServer._stats,
+}
+
+
+class LeanREPLClient:
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        path: Optional[Path] = None,
+        lazy_responses: bool = False,
+        token: Optional[str] = None,
+    ):
+        """Connect to a `LeanREPLServer`, to run commands, tactics and files on its pool.
+
+        `run_command`, `run_tactic`, `run_file`, `run_tactics` and `run_tactics_many` work like those of
+        `LeanREPLAsyncHandler`, streaming, pickling and snapshots are not available over the connection. Envs and proof states are
+        indices of this client's session, they are only valid on this connection. The connection is opened on
+        first use, requests can be sent concurrently and are answered as they finish. Paths passed to `run_file`
+        refer to files on the server.
+
+        :param host: The host of a TCP server.
+        :param port: The port of a TCP server.
+        :param path: The path of a Unix socket, instead of a host and port.
+        :param lazy_responses: Return views instead of models, see `LeanREPLAsyncHandler`.
+        :param token: The token of the server, if it has one.
+        """
+        if (path is None) == (port is None):
+            raise ValueError("Pass either a port or a Unix socket path.")
+        self.host = host
+        self.port = port
+        self.path = path
+        self.lazy_responses = lazy_responses
+        self.token = token
+        self._env: Optional[LeanREPLEnvironment] = None
+        self._connection_task: Optional[asyncio.Future] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._ids = itertools.count()
+        # Why the connection broke, raised for any later request
+        self._error: Optional[Exception] = None
+        # Futures of requests sent but not answered yet, by request id
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    @property
+    def env(self):
+        return self._env
+
+    @env.setter
+    def env(self, environment: Union[LeanREPLEnvironment, int, None]):
+        if isinstance(environment, LeanREPLEnvironment) or environment is None:
+            self._env = environment
+        elif isinstance(environment, int):
+            self._env = LeanREPLEnvironment(env_index=environment)
+        else:
+            raise ValueError("Environment must be a LeanREPLEnvironment object.")
+
+    async def connect(self) -> None:
+        """Open the connection, instead of lazily on the first request."""
+        # Concurrent callers all wait for the same connection
+        if self._connection_task is None:
+            self._connection_task = asyncio.ensure_future(self._open())
+        await asyncio.shield(self._connection_task)
+
+    async def _open(self) -> None:
+        if self.path is not None:
+            reader, writer = await asyncio.open_unix_connection(
+                str(self.path), limit=SERVER_LINE_LIMIT
+            )
+        else:
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, limit=SERVER_LINE_LIMIT
+            )
+        if self.token is not None:
+            writer.write((json.dumps({"token": self.token}) + "\n").encode())
+        self._writer = writer
+        self._lock = asyncio.Lock()
+        self._reader_task = asyncio.ensure_future(self._read_responses(reader))
+
+    async def _call(self, method: str, params: Dict[str, Any]) -> Any:
+        await self.connect()
+        if self._error is not None:
+            raise self._error
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(
+                (
+                    json.dumps(
+                        {"id": request_id, "method": method, "params": params},
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                ).encode()
+            )
+            async with self._lock:
+                await self._writer.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        """Resolve request futures with the answers of the server, until the connection closes."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise RuntimeError("The Lean REPL server closed the connection.")
+                message = json.loads(line)
+                if message["id"] is None:
+                    # Not about one request, e.g. the session was refused
+                    raise _remote_error(message["error"])
+                future = self._pending.get(message["id"])
+                # The caller might have been cancelled in the meantime
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(_remote_error(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except BaseException as e:
+            error = (
+                e
+                if isinstance(e, Exception)
+                else RuntimeError("Lean REPL server reader was cancelled.")
+            )
+            self._error = error
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            if not isinstance(e, Exception):
+                raise
+
+    def _parse_response(
+        self, data: Dict[str, Any]
+    ) -> Tuple[
+        Union[Dict[str, Any], LeanREPLNextProofState, LeanREPLNextProofStateView],
+        Optional[LeanREPLEnvironment],
+    ]:
+        env = data.pop("env", None)
+        env = LeanREPLEnvironment(env_index=env) if env is not None else None
+        if "proofState" in data:
+            if self.lazy_responses:
+                return LeanREPLNextProofStateView(data), env
+            return LeanREPLNextProofState.model_validate(data), env
+        for field in ("sorries", "messages"):
+            if field in data:
+                data[field] = [
+                    _parse_stream_item(field, item, self.lazy_responses)
+                    for item in data[field]
+                ]
+        return data, env
+
+    async def run_command(
+        self,
+        command: str,
+        env: Union[LeanREPLEnvironment, int, None] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Run a command and return its response, see `LeanREPLAsyncHandler.run_command`."""
+        if env is None:
+            env = self.env
+        if isinstance(env, LeanREPLEnvironment):
+            env = env.env_index
+        return self._parse_response(
+            await self._call(
+                "run_command", {"command": command, "env": env, "timeout": timeout}
+            )
+        )
+
+    async def run_tactic(
+        self, tactic: str, proof_state_idx: int, timeout: Optional[float] = None
+    ):
+        """Run a tactic on a proof state and return its response."""
+        return self._parse_response(
+            await self._call(
+                "run_tactic",
+                {"tactic": tactic, "proof_state": proof_state_idx, "timeout": timeout},
+            )
+        )
+
+    async def run_file(
+        self, path: Path, all_tactics: bool = True, timeout: Optional[float] = None
+    ):
+        """Check a file on the server and return its response."""
+        return self._parse_response(
+            await self._call(
+                "run_file",
+                {"path": str(path), "all_tactics": all_tactics, "timeout": timeout},
+            )
+        )
+
+    async def run_tactics(
+        self,
+        proof_state_idx: int,
+        tactics: List[str],
+        timeout: Optional[float] = None,
+    ) -> List[LeanREPLTacticResult]:
+        """Run several candidate tactics on one proof state, see `run_tactics_many`.
+
+        :return: One result per tactic, in input order.
+        """
+        results = await self.run_tactics_many({proof_state_idx: tactics}, timeout)
+        return results[proof_state_idx]
+
+    async def run_tactics_many(
+        self,
+        candidates: Dict[int, List[str]],
+        timeout: Optional[float] = None,
+        spread: bool = False,
+    ) -> Dict[int, List[LeanREPLTacticResult]]:
+        """Run candidate tactics on several proof states, see `LeanREPLPool.run_tactics_many`."""
+        batches = await self._call(
+            "run_tactics_many",
+            {
+                "candidates": {
+                    str(idx): tactics for idx, tactics in candidates.items()
+                },
+                "timeout": timeout,
+                "spread": spread,
+            },
+        )
+        return {
+            int(idx): [
+                LeanREPLTacticResult(
+                    tactic=result["tactic"],
+                    proof_state=int(idx),
+                    next_proof_state=(
+                        self._parse_response(result["nextProofState"])[0]
+                        if result["nextProofState"] is not None
+                        else None
+                    ),
+                    error=result["error"],
+                    elapsed=result["elapsed"],
+                )
+                for result in batch
+            ]
+            for idx, batch in batches.items()
+        }
+
+    async def stats(self) -> LeanREPLServerStats:
+        return LeanREPLServerStats.model_validate(await self._call("stats", {}))
+
+    async def close(self) -> None:
+        """Close the connection, failing requests still waiting for an answer."""
+        if self._connection_task is None:
+            return
+        await asyncio.gather(self._connection_task, return_exceptions=True)
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _remote_error(error: Dict[str, str]) -> Exception:
+    if error["kind"] == "timeout":
+        return LeanREPLTimeoutError(error["message"])
+    return LeanREPLServerError(error["message"], error["kind"])
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    pool = LeanREPLPool(args.workers, args.project, coalesce=args.coalesce)
+    server = LeanREPLServer(pool, args.max_sessions, args.max_pending, token=args.token)
+    try:
+        await pool.start()
+        await server.start(args.host, args.port, args.unix)
+        print(f"Serving {pool.size} Lean REPL workers on {server.address}.", flush=True)
+        await server.serve_forever()
+    finally:
+        await server.close()
+        await pool.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="lean-repl-py-serve",
+        description="Serve a pool of Lean REPL processes to LeanREPLClient over a socket. Clients can run "
+        "arbitrary code and read any file on this machine, never make the server reachable from untrusted "
+        "networks.",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The address to listen on, only bind to networks you trust.",
+    )
+    parser.add_argument("--port", type=int, default=7171)
+    parser.add_argument("--unix", type=Path, help="Listen on this Unix socket.")
+    parser.add_argument("-j", "--workers", type=int)
+    parser.add_argument("--project", type=Path, help="A Lean project directory.")
+    parser.add_argument("--max-sessions", type=int, default=64)
+    parser.add_argument("--max-pending", type=int)
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Let identical concurrent requests share one evaluation.",
+    )
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("LEAN_REPL_PY_TOKEN"),
+        help="A shared secret clients must send, defaults to $LEAN_REPL_PY_TOKEN.",
+    )
+    args = parser.parse_args(argv)
+    if (
+        args.token is None
+        and args.unix is None
+        and args.host not in ("127.0.0.1", "localhost", "::1")
+    ):
+        print(
+            f"Warning: serving on {args.host} without a token, anyone who can connect can run code here.",
+            file=sys.stderr,
+        )
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+from lean_repl_py.cache import toolchain_version
+from lean_repl_py.handler import LeanREPLHandler, LeanREPLEnvironment
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+
+
+def _check_header_response(header: str, response: Dict[str, Any]) -> None:
+    if "message" in response:
+        raise ValueError(
+            f"Could not elaborate header {header!r}: {response['message']}"
+        )
+    for message in response.get("messages", []):
+        if message.severity == "error":
+            raise ValueError(f"Could not elaborate header {header!r}: {message.data}")
+
+
+def _check_pickle_response(tmp_path: Path, response: Dict[str, Any]) -> None:
+    if "message" in response or not tmp_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        raise RuntimeError(
+            f"Could not pickle environment: {response.get('message', 'no file written')}"
+        )
+
+
+class EnvSnapshotStore:
+    def __init__(
+        self,
+        directory: Path,
+        project_path: Optional[Path] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """A managed directory of pickled environments, keyed on the header that produced them.
+
+        The first `restore` of a header elaborates it and pickles the resulting environment, later restores, in
+        any handler or process, unpickle it instead of elaborating the header again.
+
+        :param directory: The directory to keep the `.olean` snapshots in, created if missing.
+        :param project_path: The Lean project the handlers using this store run in, part of the snapshot key.
+        :param max_bytes: An optional bound on the total snapshot size. The least recently used snapshots are
+            deleted once it is exceeded.
+        """
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        project = str(project_path.resolve()) if project_path is not None else ""
+        self._salt = project + "\0" + toolchain_version(project_path)
+
+    def key(self, header: str) -> str:
+        return hashlib.sha256((self._salt + "\0" + header).encode()).hexdigest()
+
+    def path(self, header: str) -> Path:
+        return self.directory / f"{self.key(header)}.olean"
+
+    def __contains__(self, header: str) -> bool:
+        return self.path(header).exists()
+
+    def _tmp_path(self, header: str) -> Path:
+        # Unique per writer, the snapshot is only moved into place once complete
+        return self.directory / f"{self.key(header)}.{uuid.uuid4().hex}.tmp"
+
+    def _touch(self, path: Path) -> None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _snapshots(self) -> List[Path]:
+        return list(self.directory.glob("*.olean"))
+
+    def size(self) -> int:
+        """The total size of all snapshots in bytes."""
+        total = 0
+        for path in self._snapshots():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Delete the least recently used snapshots until the store fits into `max_bytes`."""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for path in self._snapshots():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _store(self, header: str, tmp_path: Path) -> None:
+        path = self.path(header)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def restore(self, handler: LeanREPLHandler, header: str) -> LeanREPLEnvironment:
+        """Return an environment for `header` in the handler, unpickling it if a snapshot exists."""
+        path = self.path(header)
+        if path.exists():
+            self._touch(path)
+            response, env = handler.unpickle_env(path)
+            if env is not None:
+                return env
+            # Unreadable snapshot, e.g. from an incompatible Lean version, elaborate again
+            path.unlink(missing_ok=True)
+        response, env = handler.run_command(header)
+        _check_header_response(header, response)
+        tmp_path = self._tmp_path(header)
+        response, _ = handler.pickle_env(tmp_path, env)
+        _check_pickle_response(tmp_path, response)
+        self._store(header, tmp_path)
+        return env
+
+    async def restore_async(
+        self, handler: LeanREPLAsyncHandler, header: str
+    ) -> LeanREPLEnvironment:
+        """Return an environment for `header` in the async handler, unpickling it if a snapshot exists."""
+        path = self.path(header)
+        if path.exists():
+            self._touch(path)
+            response, env = await handler.unpickle_env(path)
+            if env is not None:
+                return env
+            path.unlink(missing_ok=True)
+        response, env = await handler.run_command(header)
+        _check_header_response(header, response)
+        tmp_path = self._tmp_path(header)
+        response, _ = await handler.pickle_env(tmp_path, env)
+        _check_pickle_response(tmp_path, response)
+        self._store(header, tmp_path)
+        return env
@@ -0,0 +1,290 @@
+import asyncio
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Tuple, Union
+from pydantic import BaseModel
+from lean_repl_py.handler import (
+    LeanREPLHandler,
+    LeanREPLEnvironment,
+    LeanREPLProofState,
+    LeanREPLNextProofState,
+    _LeanREPLView,
+    _check_pickle_responses,
+)
+from lean_repl_py.async_handler import LeanREPLAsyncHandler
+
+# Objects holding a proof state index, which is updated in place on recycling
+_ProofStateHolder = Union[LeanREPLProofState, LeanREPLNextProofState, _LeanREPLView]
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """The resident set size of a process in bytes, read from `/proc`, or None where it is not available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _set_proof_state(holder: _ProofStateHolder, proof_state_idx: int) -> None:
+    if isinstance(holder, _LeanREPLView):
+        holder.raw["proofState"] = proof_state_idx
+    else:
+        holder.proof_state = proof_state_idx
+
+
+class LeanREPLSupervisorStats(BaseModel):
+    recycles: int
+    requests: int
+    rss: Optional[int]
+    live_envs: int
+    live_proof_states: int
+
+
+class LeanREPLSupervisor:
+    def __init__(
+        self,
+        max_rss: Optional[int] = None,
+        max_requests: Optional[int] = None,
+        directory: Optional[Path] = None,
+    ):
+        """Recycle the REPL process of a handler once it exceeds a memory or request budget.
+
+        Lean keeps every env and proof state it ever created, so a long running REPL only grows. The supervisor
+        tracks the env and proof state objects its handler returned with weak references. Once a request
+        exceeds the budget, it pickles the envs and proof states of the objects still alive, starts a new
+        process, unpickles them there and updates the indices of those objects in place. Everything else is
+        dropped with the old process.
+
+        Pass each handler its own supervisor. Read indices from the returned objects, e.g. `sorry.proof_state`,
+        when sending a request, as plain ints kept from before a recycle are stale. Proof states in the `tactics`
+        of a file response are not tracked.
+
+        :param max_rss: The maximum resident set size of the REPL process in bytes, sampled from `/proc` after
+            every request. Ignored where `/proc` is not available.
+        :param max_requests: The maximum number of requests a process serves before it is recycled.
+        :param directory: Where to write the pickles while recycling, defaults to the system temp directory.
+        """
+        self.max_rss = max_rss
+        self.max_requests = max_requests
+        self.directory = directory
+        self.recycles = 0
+        self.requests = 0
+        self.rss: Optional[int] = None
+        # Weak references by object id, to envs and to objects holding a proof state
+        self._envs: Dict[int, weakref.ref] = {}
+        self._proof_states: Dict[int, weakref.ref] = {}
+        self._recycling: Optional[asyncio.Future] = None
+        # Requests of the async handler between `before_request_async` and `request_finished`
+        self._in_flight = 0
+        self._drained: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def _add(refs: Dict[int, weakref.ref], obj: Any) -> None:
+        key = id(obj)
+
+        def forget(ref: weakref.ref) -> None:
+            if refs.get(key) is ref:
+                del refs[key]
+
+        refs[key] = weakref.ref(obj, forget)
+
+    @staticmethod
+    def _alive(refs: Dict[int, weakref.ref]) -> List[Any]:
+        return [
+            obj for obj in (ref() for ref in list(refs.values())) if obj is not None
+        ]
+
+    def track(
+        self,
+        response: Union[Dict[str, Any], _ProofStateHolder],
+        env: Optional[LeanREPLEnvironment],
+    ) -> None:
+        """Track the envs and proof states of a parsed response, called by the handler."""
+        if env is not None:
+            self._add(self._envs, env)
+        if isinstance(response, dict):
+            for sorry in response.get("sorries", []):
+                self._add(self._proof_states, sorry)
+        else:
+            self._add(self._proof_states, response)
+
+    def reset(self) -> None:
+        """Forget all tracked objects, after the handler restarted its process and lost them."""
+        self._envs.clear()
+        self._proof_states.clear()
+        self.requests = 0
+
+    def _live(
+        self, handler: Union[LeanREPLHandler, LeanREPLAsyncHandler]
+    ) -> Tuple[
+        Dict[int, List[LeanREPLEnvironment]], Dict[int, List[_ProofStateHolder]]
+    ]:
+        envs: Dict[int, List[LeanREPLEnvironment]] = {}
+        env_objects = {id(env): env for env in self._alive(self._envs)}
+        if handler.env is not None:
+            env_objects[id(handler.env)] = handler.env
+        for env in env_objects.values():
+            # Negative indices are virtual, from a response cache, and do not exist in the process
+            if env.env_index >= 0:
+                envs.setdefault(env.env_index, []).append(env)
+        proof_states: Dict[int, List[_ProofStateHolder]] = {}
+        for holder in self._alive(self._proof_states):
+            if holder.proof_state >= 0:
+                proof_states.setdefault(holder.proof_state, []).append(holder)
+        return envs, proof_states
+
+    def _over_budget(self, pid: int) -> bool:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        if self.max_rss is not None:
+            self.rss = process_rss(pid)
+            return self.rss is not None and self.rss > self.max_rss
+        return False
+
+    def after_request(self, handler: LeanREPLHandler, requests: int = 1) -> None:
+        """Count finished requests and recycle the handler's process if it is over budget."""
+        self.requests += requests
+        if self._over_budget(handler.process.pid):
+            self.recycle(handler)
+
+    async def wait_recycled(self) -> None:
+        """Wait for a running recycle to finish, so no request is sent to the old process."""
+        while self._recycling is not None:
+            await asyncio.shield(self._recycling)
+
+    async def before_request_async(self) -> None:
+        """Wait for a running recycle to finish and count the request as in flight, called by the async handler.
+
+        Each call must be followed by `request_finished`, also if the request fails.
+        """
+        await self.wait_recycled()
+        self._in_flight += 1
+
+    def request_finished(self) -> None:
+        self._in_flight -= 1
+        if not self._in_flight and self._drained is not None:
+            if not self._drained.done():
+                self._drained.set_result(None)
+
+    async def after_request_async(
+        self, handler: LeanREPLAsyncHandler, requests: int = 1
+    ) -> None:
+        """Count finished requests and recycle the handler's process if it is over budget."""
+        self.requests += requests
+        if self._recycling is not None:
+            return
+        if self._over_budget(handler.process.pid):
+            await self.recycle_async(handler)
+
+    @staticmethod
+    def _env_paths(envs: Dict[int, Any], directory: Path) -> Dict[int, Path]:
+        return {idx: directory / f"env_{idx}.olean" for idx in envs}
+
+    def recycle(self, handler: LeanREPLHandler) -> None:
+        """Replace the handler's process by a new one, carrying over all live envs and proof states."""
+        envs, proof_states = self._live(handler)
+        env = handler.env
+        with tempfile.TemporaryDirectory(dir=self.directory) as directory:
+            env_paths = self._env_paths(envs, Path(directory))
+            responses = handler._raw_requests(
+                [{"pickleTo": str(path), "env": idx} for idx, path in env_paths.items()]
+            )
+            _check_pickle_responses(responses, "pickle", "environment")
+            checkpoint = handler.checkpoint_proof_states(proof_states, Path(directory))
+            handler._stop()
+            handler._start()
+            responses = handler._raw_requests(
+                [{"unpickleEnvFrom": str(path)} for path in env_paths.values()]
+            )
+            _check_pickle_responses(responses, "unpickle", "environment")
+            proof_state_map = handler.restore_proof_states(checkpoint)
+        if env is not None:
+            handler.env = env
+        self._remap(handler, envs, responses, proof_states, proof_state_map)
+
+    async def recycle_async(self, handler: LeanREPLAsyncHandler) -> None:
+        """Replace the async handler's process by a new one, carrying over all live envs and proof states.
+
+        New requests wait for the new process, the requests in flight are answered by the old one first.
+        """
+        if self._recycling is None:
+            # Set before anything is awaited, so no request slips in between
+            self._recycling = asyncio.ensure_future(self._recycle_async(handler))
+            self._recycling.add_done_callback(
+                lambda _: setattr(self, "_recycling", None)
+            )
+        await asyncio.shield(self._recycling)
+
+    async def _recycle_async(self, handler: LeanREPLAsyncHandler) -> None:
+        while self._in_flight:
+            self._drained = asyncio.get_running_loop().create_future()
+            await self._drained
+        envs, proof_states = self._live(handler)
+        env = handler.env
+        with tempfile.TemporaryDirectory(dir=self.directory) as directory:
+            env_paths = self._env_paths(envs, Path(directory))
+            responses = await asyncio.gather(
+                *(
+                    handler._raw_request({"pickleTo": str(path), "env": idx})
+                    for idx, path in env_paths.items()
+                )
+            )
+            _check_pickle_responses(responses, "pickle", "environment")
+            checkpoint = await handler.checkpoint_proof_states(
+                proof_states, Path(directory)
+            )
+            await handler._stop()
+            # The old env does not exist in the new process, do not send it along
+            handler.env = None
+            responses = await asyncio.gather(
+                *(
+                    handler._raw_request({"unpickleEnvFrom": str(path)})
+                    for path in env_paths.values()
+                )
+            )
+            _check_pickle_responses(responses, "unpickle", "environment")
+            proof_state_map = await handler.restore_proof_states(checkpoint)
+        handler.env = env
+        self._remap(handler, envs, responses, proof_states, proof_state_map)
+
+    def _remap(
+        self,
+        handler: Union[LeanREPLHandler, LeanREPLAsyncHandler],
+        envs: Dict[int, List[LeanREPLEnvironment]],
+        env_responses: List[Dict[str, Any]],
+        proof_states: Dict[int, List[_ProofStateHolder]],
+        proof_state_map: Dict[int, int],
+    ) -> None:
+        env_map = {idx: response["env"] for idx, response in zip(envs, env_responses)}
+        for idx, env_objects in envs.items():
+            for env in env_objects:
+                env.env_index = env_map[idx]
+        for idx, holders in proof_states.items():
+            for holder in holders:
+                _set_proof_state(holder, proof_state_map[idx])
+        if handler._cache_session is not None:
+            handler._cache_session.forget_process(
+                {
+                    **{("env", idx): new_idx for idx, new_idx in env_map.items()},
+                    **{
+                        ("proofState", idx): new_idx
+                        for idx, new_idx in proof_state_map.items()
+                    },
+                }
+            )
+        self.recycles += 1
+        self.requests = 0
+
+    def stats(self) -> LeanREPLSupervisorStats:
+        return LeanREPLSupervisorStats(
+            recycles=self.recycles,
+            requests=self.requests,
+            rss=self.rss,
+            live_envs=len(self._alive(self._envs)),
+            live_proof_states=len(self._alive(self._proof_states)),
+        )
@@ -0,0 +1,236 @@
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Union, Tuple, Deque, Any, List, Callable
+from pydantic import BaseModel
+
+# Request kinds, by the field identifying them
+_KINDS = (
+    ("cmd", "cmd"),
+    ("tactic", "tactic"),
+    ("path", "file"),
+    ("pickleTo", "pickle"),
+    ("unpickleEnvFrom", "unpickle"),
+    ("unpickleProofStateFrom", "unpickle"),
+)
+_PHASES = ("send", "wait", "read", "decode", "parse")
+# Histogram bucket upper bounds in seconds, from 1µs to ~20 minutes in steps of ~19%
+_BUCKETS = [1e-6 * 2 ** (i / 4) for i in range(121)]
+
+
+def request_kind(data: Dict[str, Any]) -> str:
+    for field, kind in _KINDS:
+        if field in data:
+            return kind
+    return "other"
+
+
+class LeanREPLTrace(BaseModel):
+    """Timings in seconds and sizes of one REPL round-trip."""
+
+    kind: str
+    # Serializing and writing the request
+    send: float = 0.0
+    # Until the first line of the response arrived, not counting time queued behind earlier requests. Mostly Lean
+    # elaborating.
+    wait: float = 0.0
+    # Reading and framing the remaining lines of the response
+    read: float = 0.0
+    # Decoding the JSON
+    decode: float = 0.0
+    # Converting the response into models or views, None if it was not parsed, e.g. for internal requests
+    parse: Optional[float] = None
+    bytes_out: int = 0
+    bytes_in: int = 0
+    lines: int = 0
+
+
+LeanREPLTracer = Callable[[LeanREPLTrace], None]
+
+
+class _TraceRecorder:
+    """Per-handler bookkeeping for a tracer, matching requests written to the responses read in FIFO order."""
+
+    def __init__(self, tracer: LeanREPLTracer):
+        self.tracer = tracer
+        self._sent: Deque[Tuple[LeanREPLTrace, float]] = deque()
+        self._last_read_at = 0.0
+        # The trace of the response being read, and of the last response read, until it is taken
+        self._reading: Optional[LeanREPLTrace] = None
+        self._read: Optional[LeanREPLTrace] = None
+        self._first_line_at = 0.0
+        self._line_at = 0.0
+
+    def request(
+        self, data: Dict[str, Any], json_data: Union[str, bytes], start: float
+    ) -> None:
+        end = time.perf_counter()
+        trace = LeanREPLTrace(
+            kind=request_kind(data),
+            send=end - start,
+            bytes_out=len(
+                json_data if isinstance(json_data, bytes) else json_data.encode()
+            )
+            + 2,
+        )
+        self._sent.append((trace, end))
+
+    def line(self, line: Union[str, bytes]) -> None:
+        """Record a non-empty line of output."""
+        now = time.perf_counter()
+        if self._reading is None:
+            self._begin(now)
+        self._reading.lines += 1
+        self._reading.bytes_in += len(
+            line if isinstance(line, bytes) else line.encode()
+        )
+        self._line_at = now
+
+    def frame(self, size: int, lines: int, first_at: float, end_at: float) -> None:
+        """Record a response read as a whole, from when its first byte arrived until its end was found."""
+        self._begin(first_at)
+        self._reading.bytes_in = size
+        self._reading.lines = lines
+        self._line_at = end_at
+
+    def _begin(self, now: float) -> None:
+        # Nobody took the trace of the previous response, it was not parsed
+        self.emit(self.take())
+        trace, sent_at = (
+            self._sent.popleft() if self._sent else (LeanREPLTrace(kind="other"), now)
+        )
+        trace.wait = now - max(sent_at, self._last_read_at)
+        self._reading = trace
+        self._first_line_at = now
+
+    def response(self) -> None:
+        """Record that the last line was decoded into a complete response."""
+        now = time.perf_counter()
+        trace = self._reading
+        trace.read = self._line_at - self._first_line_at
+        trace.decode = now - self._line_at
+        self._last_read_at = now
+        self._reading = None
+        self._read = trace
+
+    def take(self) -> Optional[LeanREPLTrace]:
+        """Take the trace of the last response read, to emit it once the response is parsed."""
+        trace, self._read = self._read, None
+        return trace
+
+    def parsed(self, trace: LeanREPLTrace, start: float) -> None:
+        trace.parse = time.perf_counter() - start
+        self.tracer(trace)
+
+    def emit(self, trace: Optional[LeanREPLTrace]) -> None:
+        if trace is not None:
+            self.tracer(trace)
+
+    def reset(self) -> None:
+        """Drop traces of requests that will never be answered, after the process was replaced."""
+        self._sent.clear()
+        self._reading = None
+        self.emit(self.take())
+
+
+class LeanREPLPhaseStats(BaseModel):
+    count: int
+    mean: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class LeanREPLTraceStats(BaseModel):
+    count: int
+    bytes_out: int
+    bytes_in: int
+    lines: int
+    phases: Dict[str, LeanREPLPhaseStats]
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                # The bucket's upper bound, but never more than the largest value seen
+                return min(_BUCKETS[idx], self.max) if idx < len(_BUCKETS) else self.max
+        return self.max
+
+    def stats(self) -> LeanREPLPhaseStats:
+        return LeanREPLPhaseStats(
+            count=self.count,
+            mean=self.total / self.count,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            max=self.max,
+        )
+
+
+class LeanREPLTraceHistogram:
+    def __init__(self):
+        """A tracer aggregating traces into per-kind, per-phase latency histograms.
+
+        Pass it as `tracer` to a handler or pool, and read the aggregates with `stats`. Buckets grow
+        geometrically, so quantiles are accurate to about 20%.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms: Dict[Tuple[str, str], _Histogram] = {}
+            # kind -> [count, bytes out, bytes in, lines]
+            self._totals: Dict[str, List[int]] = {}
+
+    def __call__(self, trace: LeanREPLTrace) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(trace.kind, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += trace.bytes_out
+            totals[2] += trace.bytes_in
+            totals[3] += trace.lines
+            for phase in _PHASES:
+                value = getattr(trace, phase)
+                if value is None:
+                    continue
+                histogram = self._histograms.get((trace.kind, phase))
+                if histogram is None:
+                    histogram = self._histograms[(trace.kind, phase)] = _Histogram()
+                histogram.add(value)
+
+    def stats(self) -> Dict[str, LeanREPLTraceStats]:
+        """Aggregates by request kind (cmd, tactic, file, pickle, unpickle or other)."""
+        with self._lock:
+            return {
+                kind: LeanREPLTraceStats(
+                    count=count,
+                    bytes_out=bytes_out,
+                    bytes_in=bytes_in,
+                    lines=lines,
+                    phases={
+                        phase: self._histograms[(kind, phase)].stats()
+                        for phase in _PHASES
+                        if (kind, phase) in self._histograms
+                    },
+                )
+                for kind, (count, bytes_out, bytes_in, lines) in self._totals.items()
+            }
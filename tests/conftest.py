@@ -1,6 +1,10 @@
+import sys
 import pytest
 from pathlib import Path
 from lean_repl_py import LeanREPLHandler, LeanREPLAsyncHandler
+from lean_repl_py.launch import LeanREPLLaunchSpec
+
+FAKE_REPL_PATH = Path(__file__).parent / "fake_repl.py"
 
 
 @pytest.fixture
@@ -11,3 +15,18 @@ def handler():
 @pytest.fixture
 def async_handler():
     yield LeanREPLAsyncHandler(Path(__file__).parent.parent / "repl")
+
+
+@pytest.fixture
+def fake_repl(monkeypatch):
+    """Launch tests/fake_repl.py instead of the Lean REPL, so tests can run without Lean."""
+    spec = LeanREPLLaunchSpec(
+        command=[sys.executable, str(FAKE_REPL_PATH)],
+        env={},
+        cwd=FAKE_REPL_PATH.parent,
+    )
+    for module in ("handler", "async_handler", "pool", "executor"):
+        monkeypatch.setattr(
+            f"lean_repl_py.{module}.resolve_repl", lambda project_path=None: spec
+        )
+    yield FAKE_REPL_PATH
@@ -0,0 +1,200 @@
+"""A minimal stand-in for the Lean REPL, used to exercise the handlers without Lean.
+
+Reads blank-line separated JSON requests from stdin and answers with multi-line JSON
+followed by a blank line, just like `lake exe repl`. Environments and proof states are
+tracked per process, so requests referencing unknown indices fail as they would in Lean.
+"""
+
+import json
+import sys
+import time
+
+envs = set()
+proof_states = {}
+
+
+def respond(response):
+    sys.stdout.write(json.dumps(response, indent=1, ensure_ascii=False) + "\n\n")
+    sys.stdout.flush()
+
+
+def new_env():
+    idx = len(envs)
+    envs.add(idx)
+    return idx
+
+
+def new_proof_state(goals):
+    idx = len(proof_states)
+    proof_states[idx] = goals
+    return idx
+
+
+def pos(line, column):
+    return {"line": line, "column": column}
+
+
+def run_command(request):
+    if "env" in request and request["env"] not in envs:
+        return {"message": "Unknown environment."}
+    cmd = request["cmd"]
+    if cmd.startswith("sleep "):
+        time.sleep(float(cmd.split()[1]))
+    if cmd.startswith("stderr "):
+        # Lean and lake print diagnostics to stderr, often more than fits into the pipe
+        for idx in range(int(cmd.split()[1])):
+            sys.stderr.write(f"diagnostic {idx}\n")
+        sys.stderr.flush()
+    if cmd.strip() == "crash":
+        sys.stderr.write("PANIC at Lean.Elab.Command: out of memory\n")
+        sys.stderr.flush()
+        sys.exit(1)
+    response = {}
+    sorries = []
+    messages = []
+    lines = cmd.splitlines()
+    for line_idx, line in enumerate(lines, start=1):
+        if line.startswith('#print "'):
+            messages.append(
+                {
+                    "severity": "info",
+                    "pos": pos(line_idx, 0),
+                    "endPos": pos(line_idx, len(line)),
+                    "data": line[len('#print "') : -1],
+                }
+            )
+            continue
+        if "/-" in line and "-/" not in line:
+            # An unterminated comment swallows the rest of the command, reported at its end
+            messages.append(
+                {
+                    "severity": "error",
+                    "pos": pos(len(lines) + 1, 0),
+                    "endPos": None,
+                    "data": "unterminated comment",
+                }
+            )
+            break
+        column = line.find("sorry")
+        if column != -1:
+            goal = "⊢ " + line[:column].split(":", 1)[-1].replace(":= by", "").strip()
+            sorries.append(
+                {
+                    "proofState": new_proof_state([goal]),
+                    "goal": goal,
+                    "pos": pos(line_idx, column),
+                    "endPos": pos(line_idx, column + 5),
+                }
+            )
+            messages.append(
+                {
+                    "severity": "warning",
+                    "pos": pos(line_idx, 0),
+                    "endPos": pos(line_idx, len(line)),
+                    "data": "declaration uses 'sorry'",
+                }
+            )
+        column = line.find("error")
+        if column != -1:
+            messages.append(
+                {
+                    "severity": "error",
+                    "pos": pos(line_idx, column),
+                    "endPos": None,
+                    "data": "unexpected error",
+                }
+            )
+    if sorries:
+        response["sorries"] = sorries
+    if messages:
+        response["messages"] = messages
+    response["env"] = new_env()
+    if request.get("allTactics"):
+        response["tactics"] = [
+            {
+                "tactic": line.strip(),
+                "proofState": new_proof_state([line.strip()]),
+                "pos": pos(line_idx, 0),
+                "goals": "⊢ " + line.strip(),
+                "endPos": pos(line_idx, len(line)),
+            }
+            for line_idx, line in enumerate(cmd.splitlines(), start=1)
+            if line.strip()
+        ]
+    return response
+
+
+def run_tactic(request):
+    if request["proofState"] not in proof_states:
+        return {"message": "Unknown proof state."}
+    tactic = request["tactic"]
+    if tactic.startswith("sleep "):
+        time.sleep(float(tactic.split()[1]))
+    if tactic == "fail":
+        return {"message": "Lean error:\ntactic failed"}
+    goals = [] if tactic in ("rfl", "done") else ["⊢ " + tactic]
+    return {"proofState": new_proof_state(goals), "goals": goals}
+
+
+def run_file(request):
+    with open(request["path"]) as f:
+        content = f.read()
+    return run_command({"cmd": content, "allTactics": request.get("allTactics")})
+
+
+def pickle(request):
+    with open(request["pickleTo"], "w") as f:
+        # Like the REPL, which parses an env pickle first, an env wins over a proof state
+        if "proofState" in request and "env" not in request:
+            if request["proofState"] not in proof_states:
+                return {"message": "Unknown proof state."}
+            goals = proof_states[request["proofState"]]
+            json.dump({"goals": goals}, f)
+            return {"proofState": request["proofState"], "goals": goals}
+        if request["env"] not in envs:
+            return {"message": "Unknown environment."}
+        json.dump({"env": request["env"]}, f)
+    return {"env": request["env"]}
+
+
+def unpickle_env(request):
+    with open(request["unpickleEnvFrom"]) as f:
+        json.load(f)
+    return {"env": new_env()}
+
+
+def unpickle_proof_state(request):
+    with open(request["unpickleProofStateFrom"]) as f:
+        goals = json.load(f)["goals"]
+    return {"proofState": new_proof_state(goals), "goals": goals}
+
+
+def handle(request):
+    if "cmd" in request:
+        return run_command(request)
+    if "tactic" in request:
+        return run_tactic(request)
+    if "path" in request:
+        return run_file(request)
+    if "pickleTo" in request:
+        return pickle(request)
+    if "unpickleEnvFrom" in request:
+        return unpickle_env(request)
+    if "unpickleProofStateFrom" in request:
+        return unpickle_proof_state(request)
+    return {"message": "Could not parse as a valid JSON command."}
+
+
+def main():
+    buffer = ""
+    for line in sys.stdin:
+        if line.strip():
+            buffer += line
+            continue
+        if buffer:
+            respond(handle(json.loads(buffer)))
+            buffer = ""
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLPool,
+    LeanREPLProofState,
+    verify_candidates,
+    verify_candidates_async,
+)
+
+CANDIDATES = [
+    "theorem t : 1 = 1 := rfl",
+    "theorem t : 1 = 1 := by\n  sorry",
+    "theorem t : 1 = 1 := by\n  simp\n  error",
+    "theorem u : 2 = 2 := rfl",
+]
+
+
+def test_verify_candidates_demultiplexes(fake_repl):
+    traces = []
+    handler = LeanREPLHandler(tracer=traces.append)
+    results = verify_candidates(handler, CANDIDATES)
+    # All candidates in one command
+    assert len(traces) == 1
+    assert [result.ok for result in results] == [True, False, False, True]
+    assert not results[0].messages and not results[3].messages
+    # Positions as if each candidate ran alone
+    sorry = results[1].sorries[0]
+    assert isinstance(sorry, LeanREPLProofState)
+    assert (sorry.pos.line, sorry.pos.column) == (2, 2)
+    assert [message.pos.line for message in results[1].messages] == [2]
+    assert [message.pos.line for message in results[2].messages] == [3]
+    assert results[2].messages[0].severity == "error"
+    # Proof states of sorries stay usable
+    result, _ = handler.run_tactic("rfl", sorry.proof_state)
+    assert not result.goals
+    handler.close()
+
+
+def test_verify_candidates_isolates_runaway_candidate(fake_repl):
+    traces = []
+    handler = LeanREPLHandler(tracer=traces.append)
+    candidates = CANDIDATES[:2] + ["/- unterminated\ntheorem t : 1 = 1 := rfl"]
+    candidates += CANDIDATES[2:]
+    results = verify_candidates(handler, candidates, batch_size=10)
+    # The packed command, the culprit alone, and the candidates after it packed again
+    assert len(traces) == 3
+    assert [result.ok for result in results] == [True, False, False, False, True]
+    assert results[2].messages[0].data == "unterminated comment"
+    assert results[2].messages[0].pos.line == 3
+    assert [message.pos.line for message in results[3].messages] == [3]
+    handler.close()
+
+
+def test_verify_candidates_batches_and_errors(fake_repl):
+    traces = []
+    handler = LeanREPLHandler(lazy_responses=True, tracer=traces.append)
+    results = verify_candidates(handler, CANDIDATES * 2, batch_size=3)
+    assert len(traces) == 3
+    assert [result.ok for result in results] == [True, False, False, True] * 2
+    assert results[5].sorries[0].pos.line == 2
+    results = verify_candidates(handler, CANDIDATES, env=100)
+    assert all(result.error == "Unknown environment." for result in results)
+    assert not any(result.ok for result in results)
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_verify_candidates_on_pool(fake_repl):
+    pool = LeanREPLPool(size=2)
+    try:
+        results = await verify_candidates_async(pool, CANDIDATES * 3, batch_size=4)
+        assert [result.ok for result in results] == [True, False, False, True] * 3
+        assert pool.stats().completed == 3
+        sorry = results[5].sorries[0]
+        result, _ = await pool.run_tactic("rfl", sorry.proof_state)
+        assert not result.goals
+    finally:
+        await pool.close()
@@ -0,0 +1,67 @@
+import pytest
+
+from lean_repl_py import LeanREPLHandler, LeanREPLProofState, LeanREPLTimeoutError
+
+
+@pytest.fixture(params=["orjson", "json"])
+def decoder(request, monkeypatch):
+    """Run each test with orjson, if installed, and with the standard library fallback."""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr("lean_repl_py.handler.orjson", None)
+    return request.param
+
+
+def test_binary_io_round_trips(fake_repl, decoder, tmp_path):
+    handler = LeanREPLHandler(binary_io=True)
+    response, env = handler.run_command("theorem a : 1 = 1 := by sorry -- ∀")
+    assert env.env_index == 0
+    assert isinstance(response["sorries"][0], LeanREPLProofState)
+    results = handler.run_tactics(response["sorries"][0].proof_state, ["rfl", "simp"])
+    assert [result.tactic for result in results] == ["rfl", "simp"]
+    path = tmp_path / "test.lean"
+    path.write_text("def f := 1\n  rfl\n")
+    response, env = handler.run_file(path)
+    assert env.env_index == 1
+    assert len(response["tactics"]) == 2
+    # Streaming reads the same buffer line by line
+    items = list(handler.stream_file(path))
+    assert [field for field, _ in items] == ["env", "tactics", "tactics"]
+    _, env = handler.run_command("def g := 1")
+    assert env.env_index == 3
+    handler.close()
+
+
+def test_binary_io_frames_split_reads(fake_repl, decoder, monkeypatch):
+    # A tiny chunk splits the blank line ending each response between reads
+    monkeypatch.setattr("lean_repl_py.handler.REPL_READ_CHUNK", 7)
+    handler = LeanREPLHandler(binary_io=True, lazy_responses=True)
+    for _ in range(3):
+        handler.send_command("theorem a : 1 = 1 := by sorry")
+    for env_index in range(3):
+        assert handler.receive_json()[1].env_index == env_index
+    handler.close()
+
+
+def test_binary_io_timeout(fake_repl, decoder):
+    # Only the slow request gets the short timeout, the restarted process takes longer to start
+    handler = LeanREPLHandler(binary_io=True, timeout=5)
+    with pytest.raises(LeanREPLTimeoutError):
+        handler.run_command("sleep 0.3", timeout=0.05)
+    _, env = handler.run_command("def f := 1")
+    assert env.env_index == 0
+    handler.close()
+
+
+def test_binary_io_traces(fake_repl, decoder):
+    traces = []
+    handler = LeanREPLHandler(binary_io=True, tracer=traces.append)
+    handler.run_command("theorem a : 1 = 1 := by sorry")
+    handler.run_command("sleep 0.1")
+    handler.close()
+    assert [trace.kind for trace in traces] == ["cmd", "cmd"]
+    for trace in traces:
+        assert trace.bytes_out > 0 and trace.bytes_in > 0 and trace.lines > 1
+        assert min(trace.send, trace.wait, trace.read, trace.decode) >= 0
+    assert traces[1].wait >= 0.1
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from lean_repl_py import check_files, LeanREPLFileResult
+from lean_repl_py.bulk import split_header, main
+
+
+def test_split_header():
+    header, body, offset = split_header(
+        "-- A file\nimport Foo\n\nimport Bar\ntheorem a : 1 = 1 := by sorry\n"
+    )
+    assert header == "import Foo\nimport Bar"
+    assert body == "theorem a : 1 = 1 := by sorry\n"
+    assert offset == 4
+    assert split_header("def f := 1\n") == ("", "def f := 1\n", 0)
+    # Imports after a block comment stay in the file
+    content = "/- doc -/\nimport Foo\ndef f := 1\n"
+    assert split_header(content) == ("", content, 0)
+
+
+@pytest.fixture
+def lean_dir(tmp_path):
+    directory = tmp_path / "src"
+    (directory / "nested").mkdir(parents=True)
+    (directory / "a.lean").write_text("import Foo\ntheorem a : 1 = 1 := by sorry\n")
+    (directory / "nested" / "b.lean").write_text("import Foo\ndef b := error\n")
+    (directory / "c.lean").write_text("def c := 1\n")
+    (directory / ".lake").mkdir()
+    (directory / ".lake" / "skipped.lean").write_text("def d := error\n")
+    return directory
+
+
+def read_results(output):
+    return {
+        result.path: result
+        for result in map(
+            LeanREPLFileResult.model_validate_json, output.read_text().splitlines()
+        )
+    }
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_check_files(fake_repl, lean_dir, tmp_path):
+    output = tmp_path / "results.jsonl"
+    stats = await check_files([lean_dir], output, workers=2, all_tactics=True)
+    assert (stats.checked, stats.skipped, stats.failed) == (3, 0, 1)
+    results = read_results(output)
+    assert len(results) == 3
+    a = results[str(lean_dir / "a.lean")]
+    assert a.ok
+    # Positions are in the whole file, although only the body ran after the header
+    assert a.sorries[0].pos.line == 2
+    assert [tactic["pos"]["line"] for tactic in a.tactics] == [2]
+    b = results[str(lean_dir / "nested" / "b.lean")]
+    assert not b.ok
+    assert b.messages[0].pos.line == 2
+    assert results[str(lean_dir / "c.lean")].ok
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_check_files_resumes(fake_repl, lean_dir, tmp_path):
+    output = tmp_path / "results.jsonl"
+    done = LeanREPLFileResult(path=str(lean_dir / "c.lean"), elapsed=0.1)
+    # A result cut off by an interruption is dropped and checked again
+    output.write_text(
+        done.model_dump_json(by_alias=True)
+        + "\n"
+        + json.dumps({"path": str(lean_dir / "a.lean")})[:10]
+    )
+    stats = await check_files([lean_dir], output, workers=1)
+    assert (stats.checked, stats.skipped) == (2, 1)
+    assert len(read_results(output)) == 3
+
+
+def test_cli(fake_repl, lean_dir, tmp_path, capsys):
+    output = tmp_path / "results.jsonl"
+    assert main([str(lean_dir / "a.lean"), "-o", str(output), "-j", "1"]) == 0
+    assert "Checked 1 files" in capsys.readouterr().out
+    assert main([str(lean_dir), "-o", str(output), "-j", "1"]) == 1
+    assert len(read_results(output)) == 3
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_check_files_restarts_failed_workers(fake_repl, tmp_path):
+    directory = tmp_path / "src"
+    directory.mkdir()
+    (directory / "a_hangs.lean").write_text("import Foo\nsleep 30\n")
+    (directory / "b_crashes.lean").write_text("crash\n")
+    for name in "cdef":
+        (directory / f"{name}.lean").write_text(f"import Foo\ndef {name} := 1\n")
+    output = tmp_path / "results.jsonl"
+    stats = await check_files([directory], output, workers=1, timeout=1)
+    # The files queued behind the hanging and the crashing one still get checked
+    assert (stats.checked, stats.failed) == (6, 2)
+    assert stats.elapsed < 10
+    results = read_results(output)
+    assert "Timeout" in results[str(directory / "a_hangs.lean")].error
+    assert "closed its output" in results[str(directory / "b_crashes.lean")].error
+    assert all(results[str(directory / f"{name}.lean")].ok for name in "cdef")
@@ -0,0 +1,87 @@
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLCache,
+    LeanREPLNextProofState,
+)
+
+
+def test_cache_hit_in_process(fake_repl):
+    cache = LeanREPLCache(max_memory_entries=1)
+    handler = LeanREPLHandler(cache=cache)
+    try:
+        _, env = handler.run_command("def f := 2")
+        _, cached_env = handler.run_command("def f := 2")
+        assert cached_env == env
+        # The hit never reached Lean, so the next env is 1
+        _, next_env = handler.run_command("def g := 3", env=env)
+        assert next_env.env_index == 1
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, stats.evictions) == (1, 2, 1)
+    finally:
+        handler.close()
+
+
+def test_cache_across_runs(fake_repl, tmp_path):
+    db_path = tmp_path / "cache.sqlite"
+    theorem = "theorem test : 1 = 1 := by sorry"
+    first = LeanREPLHandler(cache=LeanREPLCache(db_path))
+    try:
+        response, _ = first.run_command(theorem)
+        first_state, _ = first.run_tactic("rfl", response["sorries"][0].proof_state)
+    finally:
+        first.close()
+
+    cache = LeanREPLCache(db_path)
+    second = LeanREPLHandler(cache=cache)
+    try:
+        response, env = second.run_command(theorem)
+        proof_state = response["sorries"][0].proof_state
+        # Served from disk, the env and proof state do not exist in this process yet
+        assert env.env_index < 0 and proof_state < 0
+        state, _ = second.run_tactic("rfl", proof_state)
+        assert state.goals == first_state.goals
+        assert cache.stats().misses == 0
+        # A new tactic misses, so the command is replayed to create the proof state
+        state, _ = second.run_tactic("simp", proof_state)
+        assert isinstance(state, LeanREPLNextProofState)
+        assert state.proof_state >= 0
+        assert state.goals == ["⊢ simp"]
+        assert cache.stats().misses == 1
+    finally:
+        second.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_cache(fake_repl):
+    cache = LeanREPLCache()
+    handler = LeanREPLAsyncHandler(cache=cache)
+    try:
+        response, _ = await handler.run_command("theorem test : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        first, _ = await handler.run_tactic("rfl", proof_state)
+        second, _ = await handler.run_tactic("rfl", proof_state)
+        assert first.proof_state == second.proof_state
+        assert cache.stats().hits == 1
+    finally:
+        await handler.close()
+
+
+def test_cache_session_is_bounded(fake_repl):
+    handler = LeanREPLHandler(cache=LeanREPLCache(max_memory_entries=2))
+    try:
+        response, _ = handler.run_command("theorem test : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        session = handler._cache_session
+        # Responses that produce no env or proof state are never replayed, so they keep no recipe
+        handler.run_tactic("fail", proof_state)
+        assert len(session._recipes) == 1
+        for i in range(5):
+            handler.run_command(f"def f{i} := {i}")
+        assert len(session._recipes) == 2
+        assert len(session._identities) == 2
+        assert len(session._real) == 2
+    finally:
+        handler.close()
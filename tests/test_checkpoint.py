@@ -0,0 +1,53 @@
+import pytest
+
+from lean_repl_py import LeanREPLHandler, LeanREPLAsyncHandler
+
+THEOREMS = "\n".join(f"theorem t{i} : {i} = {i} := by sorry" for i in range(3))
+
+
+def test_checkpoint_and_restore(fake_repl, tmp_path):
+    source = LeanREPLHandler()
+    target = LeanREPLHandler()
+    try:
+        # Shift proof state indices in the target, so the mapping is not the identity
+        target.run_command("theorem other : 0 = 0 := by sorry")
+        response, _ = source.run_command(THEOREMS)
+        proof_states = [sorry.proof_state for sorry in response["sorries"]]
+        state, _ = source.run_tactic("constructor", proof_states[0])
+        proof_states.append(state.proof_state)
+
+        checkpoint = source.checkpoint_proof_states(proof_states, tmp_path)
+        assert set(checkpoint.paths) == set(proof_states)
+        mapping = target.restore_proof_states(checkpoint)
+        assert set(mapping) == set(proof_states)
+        assert sorted(mapping.values()) == [1, 2, 3, 4]
+
+        state, _ = target.run_tactic("simp", mapping[proof_states[-1]])
+        assert state.goals == ["⊢ simp"]
+    finally:
+        source.close()
+        target.close()
+
+
+def test_checkpoint_unknown_proof_state(fake_repl, tmp_path):
+    handler = LeanREPLHandler()
+    try:
+        with pytest.raises(RuntimeError):
+            handler.checkpoint_proof_states([42], tmp_path)
+    finally:
+        handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_checkpoint_and_restore(fake_repl, tmp_path):
+    source = LeanREPLAsyncHandler()
+    target = LeanREPLAsyncHandler()
+    try:
+        response, _ = await source.run_command(THEOREMS)
+        proof_states = [sorry.proof_state for sorry in response["sorries"]]
+        checkpoint = await source.checkpoint_proof_states(proof_states, tmp_path)
+        mapping = await target.restore_proof_states(checkpoint)
+        assert mapping == {0: 0, 1: 1, 2: 2}
+    finally:
+        await source.close()
+        await target.close()
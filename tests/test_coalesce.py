@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLAsyncHandler,
+    LeanREPLExecutor,
+    LeanREPLPool,
+    LeanREPLTimeoutError,
+)
+
+COMMAND = "sleep 0.1\ntheorem a : 1 = 1 := by sorry"
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_handler_coalesces_identical_requests(fake_repl):
+    traces = []
+    handler = LeanREPLAsyncHandler(coalesce=True, tracer=traces.append)
+    try:
+        results = await asyncio.gather(
+            *(handler.run_command(COMMAND) for _ in range(3))
+        )
+        assert {env.env_index for _, env in results} == {0}
+        assert handler.coalesced == 2
+        # One evaluation, traced once, and every caller gets its own copy
+        assert len(traces) == 1
+        assert results[0][0] is not results[1][0]
+        assert results[0][0]["sorries"] == results[1][0]["sorries"]
+        # Different timeouts might give different outcomes, they are not shared
+        results = await asyncio.gather(
+            handler.run_command(COMMAND), handler.run_command(COMMAND, timeout=5)
+        )
+        assert [env.env_index for _, env in results] == [1, 2]
+        proof_state = results[0][0]["sorries"][0].proof_state
+        tactic_results = await handler.run_tactics(
+            proof_state, ["sleep 0.1", "rfl", "sleep 0.1"]
+        )
+        assert tactic_results[0].next_proof_state == tactic_results[2].next_proof_state
+        assert handler.coalesced == 3
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_handler_coalesced_errors_and_cancellation(fake_repl):
+    handler = LeanREPLAsyncHandler(coalesce=True)
+    try:
+        # Spawn first, so the timeout does not count the process start
+        await handler.await_process()
+        results = await asyncio.gather(
+            *(handler.run_command("sleep 0.3", timeout=0.05) for _ in range(2)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, LeanREPLTimeoutError) for result in results)
+        # Cancelling the request that runs leaves the evaluation to the others
+        first = asyncio.ensure_future(handler.run_command(COMMAND))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(handler.run_command(COMMAND))
+        await asyncio.sleep(0)
+        first.cancel()
+        response, env = await second
+        assert response["sorries"][0].goal == "⊢ 1 = 1"
+        assert handler.coalesced == 2
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_coalesces_before_routing(fake_repl):
+    pool = LeanREPLPool(size=2, coalesce=True)
+    try:
+        results = await asyncio.gather(*(pool.run_command(COMMAND) for _ in range(4)))
+        assert len({env.env_index for _, env in results}) == 1
+        stats = pool.stats()
+        assert stats.coalesced == 3
+        assert stats.completed == 1
+    finally:
+        await pool.close()
+
+
+def test_executor_coalesces(fake_repl):
+    with LeanREPLExecutor(workers=2, coalesce=True) as executor:
+        futures = [executor.run_command(COMMAND) for _ in range(3)]
+        results = [future.result() for future in futures]
+        assert len({env.env_index for _, env in results}) == 1
+        assert results[0][0] is not results[1][0]
+        assert executor.stats().coalesced == 2
+        _, env = executor.run_command(COMMAND).result()
+        assert env.env_index != results[0][1].env_index
@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import CancelledError, wait
+
+import pytest
+
+from lean_repl_py import LeanREPLExecutor, LeanREPLHandler, LeanREPLProofState
+
+
+def test_executor_routes_handles(fake_repl):
+    with LeanREPLExecutor(workers=2) as executor:
+        first = executor.run_command("theorem a : 1 = 1 := by sorry")
+        second = executor.run_command("def f := 1")
+        (response, env), (_, other_env) = first.result(), second.result()
+        # One command on each worker
+        assert {env.env_index % 2, other_env.env_index % 2} == {0, 1}
+        sorry = response["sorries"][0]
+        assert isinstance(sorry, LeanREPLProofState)
+        assert sorry.proof_state % 2 == env.env_index % 2
+        next_state, _ = executor.run_tactic("simp", sorry.proof_state).result()
+        assert next_state.proof_state % 2 == sorry.proof_state % 2
+        results = executor.run_tactics(sorry.proof_state, ["rfl", "fail"]).result()
+        assert [result.proof_state for result in results] == [sorry.proof_state] * 2
+        assert results[0].next_proof_state.goals == []
+        _, env = executor.run_command("def g := 2", env=env).result()
+        assert env.env_index % 2 == sorry.proof_state % 2
+        assert executor.stats().completed == 5
+
+
+def test_executor_submit_and_map(fake_repl):
+    threads = set()
+
+    def command(handler, command):
+        threads.add(threading.current_thread().name)
+        return handler.run_command(command)[1].env_index
+
+    with LeanREPLExecutor(workers=2) as executor:
+        futures = [executor.submit(command, "sleep 0.1") for _ in range(2)]
+        wait(futures)
+        # Run in parallel, one on each worker thread
+        assert len(threads) == 2
+        assert sorted(executor.map(command, ["def f := 1"] * 4)) == [1, 1, 2, 2]
+        error = executor.submit(lambda handler: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            error.result()
+        assert executor.stats().failed == 1
+    with pytest.raises(RuntimeError):
+        executor.submit(LeanREPLHandler.run_command, "def f := 1")
+
+
+def test_executor_shutdown_cancels(fake_repl):
+    executor = LeanREPLExecutor(workers=1)
+    running = executor.run_command("sleep 0.2")
+    queued = executor.run_command("def f := 1")
+    while not running.running():
+        time.sleep(0.01)
+    executor.shutdown(cancel_futures=True)
+    assert running.result()[1].env_index == 0
+    with pytest.raises(CancelledError):
+        queued.result()
+    # The worker closed its REPL on the way out
+    assert executor.handlers[0].process.poll() is not None
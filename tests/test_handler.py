@@ -6,10 +6,15 @@ from lean_repl_py import LeanREPLHandler, LeanREPLEnvironment
 
 @pytest.fixture
 def handler():
-    with patch("subprocess.Popen") as mock_popen:
+    with (
+        patch("subprocess.Popen") as mock_popen,
+        patch("lean_repl_py.handler.resolve_repl"),
+    ):
         mock_process = MagicMock()
         mock_popen.return_value = mock_process
         mock_process.stdin = MagicMock()
+        # Nothing on stderr, the drainer stops right away
+        mock_process.stderr.buffer.raw.read.return_value = b""
         mock_process.stdout.readline = MagicMock(return_value='{"env": 1}\n')
         yield LeanREPLHandler()
 
@@ -68,3 +73,24 @@ def test_close(handler):
     handler.close()
     handler.process.terminate.assert_called()
     handler.process.wait.assert_called()
+
+
+def test_receive_multiline_json(handler):
+    handler.process.stdout.readline = MagicMock(
+        side_effect=[
+            "\n",
+            '{"messages":\n',
+            ' [{"severity": "info", "pos": {"line": 1, "column": 0},\n',
+            '   "endPos": null, "data": "brackets in strings: }]{["}],\n',
+            ' "env": 3}\n',
+        ]
+    )
+    response, env = handler.receive_json()
+    assert env == LeanREPLEnvironment(env_index=3)
+    assert response["messages"][0].data == "brackets in strings: }]{["
+
+
+def test_receive_closed_output(handler):
+    handler.process.stdout.readline = MagicMock(return_value="")
+    with pytest.raises(RuntimeError):
+        handler.receive_json()
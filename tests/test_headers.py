@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import LeanREPLHandler, LeanREPLAsyncHandler, split_header
+
+HEADER = "import Foo\nopen Bar\n"
+
+
+def test_split_header_opens():
+    command = HEADER + "\nopen Baz in\ntheorem a : 1 = 1 := by sorry\n"
+    header, body, offset = split_header(command, opens=True)
+    assert header == "import Foo\nopen Bar"
+    # `open ... in` belongs to the theorem
+    assert body == "\nopen Baz in\ntheorem a : 1 = 1 := by sorry\n"
+    assert offset == 2
+    assert split_header(command)[0] == "import Foo"
+    # Nothing to run after the header
+    assert split_header(HEADER, opens=True) == ("", HEADER, 0)
+
+
+def test_header_elaborated_once(fake_repl):
+    handler = LeanREPLHandler(header_cache_size=2)
+    response, env = handler.run_command(HEADER + "theorem a : 1 = 1 := by sorry")
+    # The header env 0, then the body
+    assert env.env_index == 1
+    sorry = response["sorries"][0]
+    assert (sorry.pos.line, sorry.end_pos.line) == (3, 3)
+    assert response["messages"][0].pos.line == 3
+    _, env = handler.run_command(HEADER + "def f := 1")
+    assert env.env_index == 2
+    # An explicit env runs the command as is
+    _, env = handler.run_command(HEADER + "def f := 1", env=env)
+    assert env.env_index == 3
+    handler.close()
+
+
+def test_header_lru(fake_repl):
+    handler = LeanREPLHandler(header_cache_size=1)
+    handler.run_command("import A\ndef f := 1")
+    handler.run_command("import B\ndef f := 1")
+    # A was evicted by B, so it is elaborated again
+    _, env = handler.run_command("import A\ndef f := 1")
+    assert env.env_index == 5
+    _, env = handler.run_command("import A\ndef g := 1")
+    assert env.env_index == 6
+    handler.restart()
+    _, env = handler.run_command("import A\ndef f := 1")
+    assert env.env_index == 1
+    handler.close()
+
+
+def test_broken_header_runs_whole_command(fake_repl):
+    handler = LeanREPLHandler(header_cache_size=2, lazy_responses=True)
+    command = "import error\ndef f := 1"
+    response, env = handler.run_command(command)
+    assert env.env_index == 1
+    assert response["messages"][0].pos.line == 1
+    # Not retried, the command runs whole right away
+    _, env = handler.run_command(command)
+    assert env.env_index == 2
+    handler.close()
+
+
+def test_lazy_positions_shifted(fake_repl):
+    handler = LeanREPLHandler(header_cache_size=2, lazy_responses=True)
+    response, _ = handler.run_command(HEADER + "\ndef f := error")
+    assert response["messages"][0].pos.line == 4
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_concurrent_header(fake_repl):
+    handler = LeanREPLAsyncHandler(header_cache_size=4)
+    try:
+        results = await asyncio.gather(
+            *(handler.run_command(HEADER + f"def f{i} := {i}") for i in range(3))
+        )
+        # One elaboration of the header, then the three bodies
+        assert sorted(env.env_index for _, env in results) == [1, 2, 3]
+        response, _ = await handler.run_command(HEADER + "def g := error")
+        assert response["messages"][0].pos.line == 3
+    finally:
+        await handler.close()
@@ -0,0 +1,83 @@
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLIncrementalChecker,
+    LeanREPLAsyncIncrementalChecker,
+    split_commands,
+)
+
+FILE = """import Foo
+
+/-- The answer -/
+@[simp]
+theorem a : 1 = 1 := by sorry
+
+open Nat in
+theorem b : 2 = 2 := rfl
+-- theorem commented
+mutual
+def f := g
+def g := f
+end
+def c := 1
+"""
+
+
+def test_split_commands():
+    body = FILE.split("\n", 1)[1]
+    commands = split_commands(body)
+    assert "".join(commands) == body
+    assert [command.strip().splitlines()[0] for command in commands] == [
+        "/-- The answer -/",
+        "open Nat in",
+        "mutual",
+        "def c := 1",
+    ]
+
+
+def test_split_commands_keeps_deriving_clauses():
+    body = (
+        "structure Foo where\n  x : Nat\nderiving Repr\n"
+        "inductive C\n  | a\nderiving DecidableEq\n"
+        "deriving instance Repr for C\n"
+    )
+    assert split_commands(body) == [
+        "structure Foo where\n  x : Nat\nderiving Repr\n",
+        "inductive C\n  | a\nderiving DecidableEq\n",
+        "deriving instance Repr for C\n",
+    ]
+
+
+def test_recheck_runs_changed_suffix(fake_repl):
+    handler = LeanREPLHandler()
+    checker = LeanREPLIncrementalChecker(handler)
+    result = checker.check(FILE)
+    # The header, then the four commands
+    assert (result.commands, result.rerun) == (5, 5)
+    assert result.env.env_index == 4
+    assert result.sorries[0].pos.line == 5
+    result = checker.check(FILE.replace("def c := 1", "def c := error"))
+    assert result.rerun == 1
+    assert result.env.env_index == 5
+    # Positions of reused and new commands refer to the whole file
+    assert [message.pos.line for message in result.messages] == [5, 14]
+    result = checker.check(FILE.replace("2 = 2", "2 = 3"))
+    assert result.rerun == 3
+    handler.restart()
+    assert checker.check(FILE).rerun == 5
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_recheck(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        checker = LeanREPLAsyncIncrementalChecker(handler)
+        assert (await checker.check(FILE)).rerun == 5
+        result = await checker.check(FILE + "def d := 2\n")
+        assert result.rerun == 1
+        assert result.env.env_index == 5
+    finally:
+        await handler.close()
@@ -0,0 +1,75 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from lean_repl_py import launch
+
+
+@pytest.fixture
+def fake_lake(monkeypatch, tmp_path):
+    monkeypatch.setattr(launch, "_resolved", {})
+    monkeypatch.setattr(launch, "_LAUNCH_CACHE_PATH", tmp_path / "launch.json")
+    check_call = MagicMock()
+    check_output = MagicMock(
+        side_effect=lambda *args, **kwargs: (
+            json.dumps(
+                {
+                    **os.environ,
+                    "LEAN_PATH": "/lean/lib",
+                    "PATH": "/lean/bin" + os.pathsep + os.environ.get("PATH", ""),
+                }
+            )
+            + "\n"
+        )
+    )
+    monkeypatch.setattr(launch.subprocess, "check_call", check_call)
+    monkeypatch.setattr(launch.subprocess, "check_output", check_output)
+    yield check_call, check_output
+
+
+def test_resolve_once(fake_lake, tmp_path):
+    check_call, check_output = fake_lake
+    spec = launch.resolve_repl(tmp_path)
+    assert spec is launch.resolve_repl(tmp_path)
+    assert check_call.call_count == 1
+    assert check_output.call_count == 1
+    # Only what lake changed is kept, the rest is taken from the environment at spawn time
+    assert spec.env == {"LEAN_PATH": "/lean/lib"}
+    assert spec.prepend == {"PATH": "/lean/bin"}
+    assert spec.process_env()["LEAN_PATH"] == "/lean/lib"
+    assert spec.cwd == tmp_path.resolve()
+    assert spec.command[0].endswith("repl")
+
+
+def test_refresh(fake_lake):
+    check_call, _ = fake_lake
+    launch.resolve_repl()
+    launch.resolve_repl(refresh=True)
+    assert check_call.call_count == 2
+
+
+def test_search_paths_follow_the_environment(fake_lake, monkeypatch):
+    spec = launch.resolve_repl()
+    monkeypatch.setenv("PATH", "/changed/bin")
+    assert spec.process_env()["PATH"] == "/lean/bin" + os.pathsep + "/changed/bin"
+
+
+def test_disk_cache(fake_lake, monkeypatch, tmp_path):
+    check_call, _ = fake_lake
+    binary = tmp_path / "repl"
+    binary.write_text("")
+    monkeypatch.setattr(launch, "_binary_path", lambda: binary)
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "lake-manifest.json").write_text('{"packages": []}')
+    launch.resolve_repl(project)
+    monkeypatch.setattr(launch, "_resolved", {})
+    launch.resolve_repl(project)
+    assert check_call.call_count == 1
+    # A dependency update changes what `lake env` sets up
+    (project / "lake-manifest.json").write_text('{"packages": ["mathlib"]}')
+    monkeypatch.setattr(launch, "_resolved", {})
+    launch.resolve_repl(project)
+    assert check_call.call_count == 2
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import LeanREPLAsyncHandler, LeanREPLNextProofState
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_concurrent_requests(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        results = await asyncio.gather(
+            *(handler.run_command(f"def f{i} := {i}") for i in range(20))
+        )
+        # Responses are matched to requests in the order they were written
+        assert [env.env_index for _, env in results] == list(range(20))
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_tactics_in_flight(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        response, env = await handler.run_command("theorem test : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        results = await asyncio.gather(
+            handler.run_tactic("rfl", proof_state),
+            handler.run_tactic("fail", proof_state),
+            handler.run_command("def g := 2", env=env),
+        )
+        assert isinstance(results[0][0], LeanREPLNextProofState)
+        assert "message" in results[1][0]
+        assert results[2][1].env_index == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_timeout_keeps_pipe_in_sync(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        with pytest.raises(TimeoutError):
+            await handler.run_command("sleep 0.3", timeout=0.05)
+        _, env = await handler.run_command("def f := 2")
+        # The late response to the timed out request was discarded, not returned here
+        assert env.env_index == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_manual_receive_while_pending(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        await handler.await_process()
+        task = asyncio.ensure_future(handler.run_command("sleep 0.1"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            await handler.receive_json()
+        await task
+        # Once nothing is pending, manual send/receive works as before
+        await handler.send_command("def f := 2")
+        _, env = await handler.receive_json()
+        assert env.env_index == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_first_requests_share_process_start(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        # No request has spawned the process yet, all of them await the same start
+        results = await asyncio.gather(
+            *(handler.run_command(f"def f{i} := {i}") for i in range(3))
+        )
+        assert [env.env_index for _, env in results] == [0, 1, 2]
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_manual_send_while_pending(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        await handler.await_process()
+        task = asyncio.ensure_future(handler.run_command("sleep 0.1"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            await handler.send_command("def f := 2")
+        _, env = await task
+        assert env.env_index == 0
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_timeout_starts_at_head_of_queue(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        await handler.await_process()
+        slow = asyncio.ensure_future(handler.run_command("sleep 0.3"))
+        await asyncio.sleep(0.01)
+        # Queued behind the slow command for longer than its own timeout
+        _, env = await handler.run_command("def f := 2", timeout=0.2)
+        assert env.env_index == 1
+        await slow
+    finally:
+        await handler.close()
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLPool,
+    LeanREPLProofState,
+    LeanREPLNextProofState,
+    LeanREPLAbortedError,
+    LeanREPLTimeoutError,
+)
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_routes_by_handle(fake_repl):
+    pool = LeanREPLPool(size=3)
+    try:
+        envs = []
+        for _ in range(3):
+            _, env = await pool.run_command("def f := 2")
+            envs.append(env)
+        # Every worker creates its own env 0, the handles must still be distinct
+        assert len({env.env_index for env in envs}) == 3
+        for env in envs:
+            response, next_env = await pool.run_command(
+                "theorem test : 1 = 1 := by sorry", env=env
+            )
+            assert "message" not in response
+            assert next_env.env_index % 3 == env.env_index % 3
+            proof_state = response["sorries"][0]
+            assert isinstance(proof_state, LeanREPLProofState)
+            result, _ = await pool.run_tactic("rfl", proof_state.proof_state)
+            assert isinstance(result, LeanREPLNextProofState)
+            assert not result.goals
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_spreads_load(fake_repl):
+    pool = LeanREPLPool(size=2)
+    try:
+        results = await asyncio.gather(
+            *(pool.run_command("sleep 0.2") for _ in range(4))
+        )
+        assert {env.env_index % 2 for _, env in results} == {0, 1}
+        stats = pool.stats()
+        assert stats.completed == 4
+        assert stats.queue_depth == 0
+        assert stats.worker_queue_depths == [0, 0]
+        assert stats.throughput > 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_queue_depth(fake_repl):
+    pool = LeanREPLPool(size=1)
+    try:
+        tasks = [asyncio.ensure_future(pool.run_command("sleep 0.1")) for _ in range(3)]
+        await asyncio.sleep(0)
+        stats = pool.stats()
+        assert stats.queue_depth == 3
+        assert stats.busy_workers == 1
+        await asyncio.gather(*tasks)
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_restarts_failed_workers(fake_repl):
+    pool = LeanREPLPool(size=1, restart_failed=True)
+    try:
+        results = await asyncio.gather(
+            pool.run_command("crash"),
+            pool.run_command("def f := 1"),
+            return_exceptions=True,
+        )
+        # Only the request queued behind the crash may be sent again
+        assert type(results[0]) is RuntimeError
+        assert isinstance(results[1], LeanREPLAbortedError)
+        with pytest.raises(LeanREPLTimeoutError):
+            await pool.run_command("sleep 30", timeout=0.2)
+        response, _ = await pool.run_command("def f := 1", timeout=5)
+        assert "message" not in response
+        assert pool.restarts == [2]
+        assert pool.stats().restarts == 2
+    finally:
+        await pool.close()
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLPool,
+    LeanREPLNextProofState,
+)
+
+
+def test_run_tactics(fake_repl):
+    handler = LeanREPLHandler()
+    response, _ = handler.run_command(
+        "theorem a : 1 = 1 := by sorry\ntheorem b : 2 = 2 := by sorry"
+    )
+    first, second = (sorry.proof_state for sorry in response["sorries"])
+    results = handler.run_tactics(first, ["rfl", "fail", "simp"])
+    assert [result.tactic for result in results] == ["rfl", "fail", "simp"]
+    assert isinstance(results[0].next_proof_state, LeanREPLNextProofState)
+    assert not results[0].next_proof_state.goals
+    assert results[1].next_proof_state is None
+    assert "tactic failed" in results[1].error
+    assert results[2].next_proof_state.goals == ["⊢ simp"]
+    assert all(
+        result.proof_state == first and result.elapsed >= 0 for result in results
+    )
+
+    many = handler.run_tactics_many({second: ["simp", "rfl"], first: ["ring"]})
+    assert list(many) == [second, first]
+    assert [result.tactic for result in many[second]] == ["simp", "rfl"]
+    assert many[first][0].next_proof_state.goals == ["⊢ ring"]
+    handler.close()
+
+
+def test_run_tactics_beyond_pipeline_window(fake_repl):
+    handler = LeanREPLHandler()
+    response, _ = handler.run_command("theorem a : 1 = 1 := by sorry")
+    proof_state = response["sorries"][0].proof_state
+    tactics = [f"t{i}" for i in range(100)]
+    results = handler.run_tactics(proof_state, tactics)
+    assert [result.next_proof_state.goals for result in results] == [
+        [f"⊢ t{i}"] for i in range(100)
+    ]
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_run_tactics(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        response, _ = await handler.run_command("theorem a : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        results = await handler.run_tactics(
+            proof_state, ["sleep 0.2", "rfl", "fail"], timeout=0.05
+        )
+        assert "Timeout" in results[0].error
+        assert not results[1].next_proof_state.goals
+        assert "tactic failed" in results[2].error
+        # Only the slow tactic counts towards its timeout, not the ones queued behind it
+        assert results[1].elapsed < 0.2
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_run_tactics_many(fake_repl):
+    pool = LeanREPLPool(size=2)
+    try:
+        responses = await asyncio.gather(
+            *(pool.run_command(f"theorem a{i} : 1 = 1 := by sorry") for i in range(2))
+        )
+        handles = [response["sorries"][0].proof_state for response, _ in responses]
+        assert {handle % 2 for handle in handles} == {0, 1}
+        results = await pool.run_tactics_many(
+            {handle: ["simp", "rfl"] for handle in handles}
+        )
+        for handle in handles:
+            assert [result.proof_state for result in results[handle]] == [handle] * 2
+            next_state = results[handle][0].next_proof_state
+            # Next proof states live on the worker owning the proof state
+            assert next_state.proof_state % 2 == handle % 2
+            follow_up, _ = await pool.run_tactic("rfl", next_state.proof_state)
+            assert isinstance(follow_up, LeanREPLNextProofState)
+        assert pool.stats().completed == 2 + 4 + 2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_run_tactics_spread(fake_repl):
+    pool = LeanREPLPool(size=3)
+    try:
+        response, _ = await pool.run_command("theorem a : 1 = 1 := by sorry")
+        handle = response["sorries"][0].proof_state
+        tactics = [f"t{i}" for i in range(6)]
+        results = await pool.run_tactics(handle, tactics, spread=True)
+        assert [result.tactic for result in results] == tactics
+        assert [result.next_proof_state.goals for result in results] == [
+            [f"⊢ {tactic}"] for tactic in tactics
+        ]
+        assert {result.next_proof_state.proof_state % 3 for result in results} == {
+            0,
+            1,
+            2,
+        }
+        for result in results:
+            follow_up, _ = await pool.run_tactic(
+                "rfl", result.next_proof_state.proof_state
+            )
+            assert isinstance(follow_up, LeanREPLNextProofState)
+    finally:
+        await pool.close()
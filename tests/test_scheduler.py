@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLAsyncHandler,
+    LeanREPLPool,
+    LeanREPLScheduler,
+    LeanREPLTimeoutError,
+)
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_scheduler_orders_by_priority_and_deadline(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    scheduler = LeanREPLScheduler(handler)
+    try:
+        now = time.monotonic()
+        blocking = asyncio.ensure_future(scheduler.run_command("sleep 0.2"))
+        await asyncio.sleep(0)
+        names = ["low", "late", "early", "high"]
+        requests = [
+            scheduler.run_command("def low := 1", priority=-1),
+            scheduler.run_command("def late := 1", deadline=now + 20),
+            scheduler.run_command("def early := 1", deadline=now + 10),
+            scheduler.run_command("def high := 1", priority=1),
+        ]
+        tasks = [asyncio.ensure_future(request) for request in requests]
+        await asyncio.sleep(0.05)
+        assert scheduler.stats().queued == 4
+        assert scheduler.stats().running == 1
+        await blocking
+        results = await asyncio.gather(*tasks)
+        order = sorted(names, key=lambda name: results[names.index(name)][1].env_index)
+        assert order == ["high", "early", "late", "low"]
+        assert scheduler.stats().completed == 5
+    finally:
+        await scheduler.close()
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_scheduler_drops_expired_and_cancelled(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    scheduler = LeanREPLScheduler(handler)
+    try:
+        blocking = asyncio.ensure_future(scheduler.run_command("sleep 0.3"))
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        cancelled = asyncio.ensure_future(scheduler.run_command("def c := 1"))
+        with pytest.raises(LeanREPLTimeoutError):
+            await scheduler.run_command("def e := 1", deadline=start + 0.05)
+        # Failed at its deadline, not once the blocking request was done
+        assert time.monotonic() - start < 0.25
+        cancelled.cancel()
+        await blocking
+        # Neither request reached Lean
+        _, env = await scheduler.run_command("def f := 1")
+        assert env.env_index == 1
+        stats = scheduler.stats()
+        assert (stats.expired, stats.cancelled, stats.queued) == (1, 1, 0)
+    finally:
+        await scheduler.close()
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_scheduler_restarts_abandoned_requests(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    scheduler = LeanREPLScheduler(handler)
+    try:
+        await handler.await_process()
+        start = time.monotonic()
+        running = asyncio.ensure_future(scheduler.run_command("sleep 5"))
+        queued = asyncio.ensure_future(scheduler.run_command("def g := 1"))
+        await asyncio.sleep(0.1)
+        running.cancel()
+        # The next request runs on a fresh process instead of waiting for Lean
+        _, env = await queued
+        assert env.env_index == 0
+        with pytest.raises(LeanREPLTimeoutError):
+            await scheduler.run_command("sleep 5", timeout=0.1)
+        _, env = await scheduler.run_command("def h := 1")
+        assert env.env_index == 0
+        assert time.monotonic() - start < 3
+        stats = scheduler.stats()
+        assert (stats.restarts, stats.cancelled, stats.failed) == (2, 1, 1)
+    finally:
+        await scheduler.close()
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_scheduler_on_pool(fake_repl):
+    pool = LeanREPLPool(size=2)
+    scheduler = LeanREPLScheduler(pool)
+    try:
+        results = await asyncio.gather(
+            *(scheduler.run_command("sleep 0.1") for _ in range(2))
+        )
+        assert {env.env_index % 2 for _, env in results} == {0, 1}
+        response, env = await scheduler.run_command(
+            "theorem a : 1 = 1 := by sorry", env=results[1][1], priority=3
+        )
+        assert env.env_index % 2 == results[1][1].env_index % 2
+        proof_state = response["sorries"][0].proof_state
+        result, _ = await scheduler.run_tactic("rfl", proof_state)
+        assert not result.goals
+        assert pool.stats().completed == 4
+    finally:
+        await scheduler.close()
+        await pool.close()
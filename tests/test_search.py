@@ -0,0 +1,70 @@
+import pytest
+
+from lean_repl_py import LeanREPLAsyncHandler, LeanREPLPool, LeanREPLProofSearch
+from lean_repl_py.search import goals_key
+
+# Tactics to propose by goal, the fake REPL's goal after a tactic `t` is `⊢ t`
+PROPOSALS = {
+    "⊢ 1 = 1": ["fail", "simp", "ring", "simp"],
+    "⊢ simp": ["ring", "simp"],
+    "⊢ ring": ["rfl"],
+}
+
+
+def propose(node):
+    return PROPOSALS.get(node.goals[0], [])
+
+
+def test_goals_key():
+    assert goals_key(["⊢  a =\n b", "⊢ c"]) == goals_key(["⊢ a = b", "⊢ c"])
+    assert goals_key(["⊢ a", "⊢ b"]) != goals_key(["⊢ b", "⊢ a"])
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_search_merges_states(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        response, _ = await handler.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+        search = LeanREPLProofSearch(handler, propose)
+        result = await search.run(sorry.proof_state, [sorry.goal])
+        assert result.proof == ["ring", "rfl"]
+        # Root, simp, ring and the solved state; simp reached ring and itself again
+        assert (result.expanded, result.states, result.merged) == (3, 4, 2)
+        # The duplicate simp was only run once
+        assert result.tactics_run == 6
+        assert search.table[goals_key(["⊢ ring"])].depth == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_search_budget(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        response, _ = await handler.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+
+        async def propose_async(node):
+            return propose(node)
+
+        search = LeanREPLProofSearch(handler, propose_async, max_expansions=1)
+        result = await search.run(sorry.proof_state, [sorry.goal])
+        assert not result.proved
+        assert result.expanded == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_search_on_pool(fake_repl):
+    pool = LeanREPLPool(size=2)
+    try:
+        response, _ = await pool.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+        search = LeanREPLProofSearch(pool, propose)
+        assert search.parallel == 2
+        result = await search.run(sorry.proof_state, [sorry.goal])
+        assert result.proof == ["ring", "rfl"]
+    finally:
+        await pool.close()
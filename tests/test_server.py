@@ -0,0 +1,121 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLPool,
+    LeanREPLServer,
+    LeanREPLClient,
+    LeanREPLServerError,
+    LeanREPLProofState,
+    LeanREPLTimeoutError,
+    LeanREPLProofSearch,
+)
+
+
+@asynccontextmanager
+async def serving(tmp_path, token=None):
+    """A server on a Unix socket, yielding a function to connect new clients."""
+    pool = LeanREPLPool(size=2)
+    server = LeanREPLServer(pool, max_sessions=2, max_pending=2, token=token)
+    await server.start(path=tmp_path / "repl.sock")
+    clients = []
+
+    def connect(token=token):
+        clients.append(LeanREPLClient(path=tmp_path / "repl.sock", token=token))
+        return clients[-1]
+
+    try:
+        yield connect
+    finally:
+        for client in clients:
+            await client.close()
+        await server.close()
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_session_handles(fake_repl, tmp_path):
+    async with serving(tmp_path) as connect:
+        first, second = connect(), connect()
+        response, env = await first.run_command("theorem a : 1 = 1 := by sorry")
+        assert env.env_index == 0
+        sorry = response["sorries"][0]
+        assert isinstance(sorry, LeanREPLProofState) and sorry.proof_state == 0
+        # Each session counts from 0, whatever worker ran the request
+        await second.run_command("def f := 1")
+        _, env = await second.run_command("def g := 2")
+        assert env.env_index == 1
+        next_state, env = await first.run_tactic("simp", sorry.proof_state)
+        assert env is None and next_state.proof_state == 1
+        results = await first.run_tactics(sorry.proof_state, ["rfl", "fail"])
+        assert results[0].next_proof_state.goals == []
+        assert results[1].error is not None
+        # Handles of another session are not visible
+        with pytest.raises(LeanREPLServerError) as error:
+            await second.run_tactic("rfl", 3)
+        assert error.value.kind == "invalid"
+        stats = await first.stats()
+        assert stats.sessions == 2 and stats.pool.workers == 2
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_token(fake_repl, tmp_path):
+    async with serving(tmp_path, token="secret") as connect:
+        _, env = await connect().run_command("def f := 1")
+        assert env.env_index == 0
+        for token in (None, "guess"):
+            with pytest.raises(LeanREPLServerError) as error:
+                await connect(token).run_command("def f := 1")
+            assert error.value.kind == "unauthorized"
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_admission_control(fake_repl, tmp_path):
+    async with serving(tmp_path) as connect:
+        client = connect()
+        results = await asyncio.gather(
+            *(client.run_command("sleep 0.2") for _ in range(3)),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        assert len(errors) == 1
+        assert isinstance(errors[0], LeanREPLServerError)
+        assert errors[0].kind == "overloaded"
+        # Accepted again once the server caught up
+        await client.run_command("def f := 1")
+        with pytest.raises(LeanREPLTimeoutError):
+            await client.run_command("sleep 0.3", timeout=0.05)
+        await connect().run_command("def f := 1")
+        with pytest.raises(LeanREPLServerError, match="Too many sessions"):
+            await connect().run_command("def f := 1")
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_backpressure_window(fake_repl):
+    pool = LeanREPLPool(size=1)
+    server = LeanREPLServer(pool, session_window=1)
+    await server.start("127.0.0.1", 0)
+    client = LeanREPLClient("127.0.0.1", server.address[1])
+    try:
+        results = await asyncio.gather(
+            *(client.run_command(f"def f{i} := {i}") for i in range(5))
+        )
+        # One at a time, in the order they were sent
+        assert [env.env_index for _, env in results] == list(range(5))
+    finally:
+        await client.close()
+        await server.close()
+        await pool.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_search_over_client(fake_repl, tmp_path):
+    async with serving(tmp_path) as connect:
+        client = connect()
+        response, _ = await client.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+        search = LeanREPLProofSearch(client, lambda node: ["simp", "rfl"])
+        result = await search.run(sorry.proof_state, [sorry.goal])
+        assert result.proof == ["rfl"]
@@ -0,0 +1,63 @@
+import pytest
+
+from lean_repl_py import LeanREPLHandler, LeanREPLPool, EnvSnapshotStore
+
+HEADER = "def base := 1"
+
+
+def test_restore_creates_and_reuses_snapshot(fake_repl, tmp_path):
+    store = EnvSnapshotStore(tmp_path / "snapshots")
+    assert HEADER not in store
+    first = LeanREPLHandler()
+    try:
+        env = store.restore(first, HEADER)
+        assert HEADER in store
+        assert env.env_index == 0
+    finally:
+        first.close()
+
+    second = LeanREPLHandler()
+    try:
+        env = store.restore(second, HEADER)
+        response, _ = second.run_command("def g := 2", env=env)
+        assert "message" not in response
+    finally:
+        second.close()
+
+
+def test_restore_rejects_broken_header(fake_repl, tmp_path):
+    store = EnvSnapshotStore(tmp_path)
+    handler = LeanREPLHandler()
+    try:
+        with pytest.raises(ValueError):
+            store.restore(handler, "def broken := error")
+        assert "def broken := error" not in store
+    finally:
+        handler.close()
+
+
+def test_eviction(fake_repl, tmp_path):
+    store = EnvSnapshotStore(tmp_path, max_bytes=1)
+    handler = LeanREPLHandler()
+    try:
+        store.restore(handler, "def a := 1")
+        store.restore(handler, "def b := 2")
+        # Only the snapshot just written is kept, even though it exceeds the bound
+        assert "def a := 1" not in store
+        assert "def b := 2" in store
+    finally:
+        handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_restore(fake_repl, tmp_path):
+    store = EnvSnapshotStore(tmp_path)
+    pool = LeanREPLPool(size=2)
+    try:
+        envs = await pool.restore_env(store, HEADER)
+        assert [env.env_index % 2 for env in envs] == [0, 1]
+        for env in envs:
+            response, _ = await pool.run_command("def g := 2", env=env)
+            assert "message" not in response
+    finally:
+        await pool.close()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from lean_repl_py import LeanREPLHandler, LeanREPLAsyncHandler, LeanREPLTimeoutError
+
+# About 300KB, several times the size of a pipe buffer
+NOISY = "stderr 20000"
+LAST = "diagnostic 19999"
+
+
+def wait_for_stderr(handler, line):
+    # The drainer might still be catching up when the response arrives
+    deadline = time.monotonic() + 5
+    while not handler.recent_stderr.endswith(line) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return handler.recent_stderr.splitlines()
+
+
+@pytest.mark.parametrize("binary_io", [False, True])
+def test_stderr_drained(fake_repl, binary_io):
+    # Blocked on a full stderr pipe, the command would time out
+    handler = LeanREPLHandler(timeout=10, binary_io=binary_io)
+    _, env = handler.run_command(NOISY)
+    assert env.env_index == 0
+    lines = wait_for_stderr(handler, LAST)
+    assert len(lines) == 100
+    assert lines[-1] == LAST
+    handler.close()
+
+
+def test_stderr_attached_to_errors(fake_repl):
+    # Starting the process may take longer than the short timeout below when the machine is busy
+    handler = LeanREPLHandler(timeout=5)
+    handler.run_command("stderr 3")
+    wait_for_stderr(handler, "diagnostic 2")
+    with pytest.raises(LeanREPLTimeoutError, match="diagnostic 2"):
+        handler.run_command("sleep 0.3", timeout=0.05)
+    # The new process has its own log
+    assert handler.recent_stderr == ""
+    with pytest.raises(RuntimeError, match="out of memory"):
+        handler.run_command("crash")
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_stderr(fake_repl):
+    handler = LeanREPLAsyncHandler()
+    try:
+        _, env = await handler.run_command(NOISY, timeout=10)
+        assert env.env_index == 0
+        for _ in range(500):
+            if handler.recent_stderr.endswith(LAST):
+                break
+            await asyncio.sleep(0.01)
+        assert handler.recent_stderr.splitlines()[-1] == LAST
+        with pytest.raises(RuntimeError, match="out of memory"):
+            await handler.run_command("crash")
+    finally:
+        await handler.close()
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLPool,
+    LeanREPLEnvironment,
+    LeanREPLMessage,
+    LeanREPLProofState,
+    LeanREPLProofStateView,
+    LeanREPLTimeoutError,
+)
+from lean_repl_py.handler import _ResponseStream
+
+FILE_CONTENT = "theorem a : 1 = 1 := by sorry\n  rfl\n  simp\nerror here\n"
+
+
+@pytest.fixture
+def lean_file(tmp_path):
+    path = tmp_path / "test.lean"
+    path.write_text(FILE_CONTENT)
+    return path
+
+
+def test_response_stream_splits_lines():
+    stream = _ResponseStream()
+    items = []
+    for line in [
+        '{"tactics":\n',
+        ' [{"tactic": "rfl", "proofState": 1}, {"tactic":\n',
+        ' "simp", "proofState": 2}],\n',
+        ' "env": 3, "extra": {"a":\n',
+        " [1, 2]}}\n",
+    ]:
+        assert not stream.done
+        items += stream.feed(line)
+    assert stream.done
+    assert items == [
+        ("tactics", {"tactic": "rfl", "proofState": 1}),
+        ("tactics", {"tactic": "simp", "proofState": 2}),
+        ("env", 3),
+        ("extra", {"a": [1, 2]}),
+    ]
+
+
+def test_response_stream_yields_elements_early():
+    stream = _ResponseStream()
+    assert stream.feed('{"tactics": [\n') == []
+    assert stream.feed('{"tactic": "rfl"},\n') == [("tactics", {"tactic": "rfl"})]
+    # Only the incomplete element is buffered
+    assert stream.feed('{"tactic":\n') == []
+    assert "rfl" not in stream.text
+
+
+def test_stream_file(fake_repl, lean_file):
+    handler = LeanREPLHandler()
+    items = list(handler.stream_file(lean_file))
+    fields = [field for field, _ in items]
+    assert fields == ["sorries", "messages", "messages", "env"] + ["tactics"] * 4
+    assert isinstance(items[0][1], LeanREPLProofState)
+    assert isinstance(items[1][1], LeanREPLMessage)
+    assert items[3][1] == LeanREPLEnvironment(env_index=0)
+    assert [value["tactic"] for field, value in items[4:]] == [
+        line.strip() for line in FILE_CONTENT.splitlines()
+    ]
+    # The same content as the whole response
+    response, env = handler.run_file(lean_file)
+    assert env.env_index == 1
+    assert len(response["tactics"]) == 4
+    handler.close()
+
+
+def test_stream_file_closed_early(fake_repl, lean_file):
+    handler = LeanREPLHandler(lazy_responses=True)
+    items = handler.stream_file(lean_file)
+    field, sorry = next(items)
+    assert field == "sorries" and isinstance(sorry, LeanREPLProofStateView)
+    with pytest.raises(RuntimeError):
+        handler.run_command("def f := 1")
+    items.close()
+    # The rest of the response was discarded, not read as the answer to this command
+    _, env = handler.run_command("def f := 1")
+    assert env.env_index == 1
+    handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_stream_file_async(fake_repl, lean_file):
+    handler = LeanREPLAsyncHandler()
+    try:
+        await handler.await_process()
+        command = asyncio.ensure_future(handler.run_command("def f := 1"))
+        await asyncio.sleep(0)
+        items = [item async for item in handler.stream_file(lean_file)]
+        assert [field for field, _ in items][:4] == [
+            "sorries",
+            "messages",
+            "messages",
+            "env",
+        ]
+        assert len(items) == 8
+        # Pipelined behind the command
+        _, env = await command
+        assert env.env_index == 0
+        assert items[3][1].env_index == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_stream_file_async_closed_early(fake_repl, lean_file, monkeypatch):
+    monkeypatch.setattr("lean_repl_py.async_handler.REPL_STREAM_BUFFER", 1)
+    handler = LeanREPLAsyncHandler()
+    try:
+        items = handler.stream_file(lean_file)
+        async for field, _ in items:
+            assert field == "sorries"
+            break
+        await items.aclose()
+        _, env = await handler.run_command("def f := 1")
+        assert env.env_index == 1
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_stream_file(fake_repl, lean_file):
+    pool = LeanREPLPool(size=2)
+    try:
+        await pool.run_command("def f := 1")
+        items = [item async for item in pool.stream_file(lean_file)]
+        values = dict(items)
+        # Ran on the idle second worker
+        assert values["env"].env_index == 1
+        assert values["sorries"].proof_state % 2 == 1
+        next_state, _ = await pool.run_tactic("rfl", values["sorries"].proof_state)
+        assert next_state.proof_state % 2 == 1
+        assert pool.stats().completed == 3
+    finally:
+        await pool.close()
+
+
+def test_stream_file_timeout(fake_repl, tmp_path):
+    path = tmp_path / "slow.lean"
+    path.write_text("sleep 0.3")
+    # Only the slow request gets the short timeout, the restarted process takes longer to start
+    handler = LeanREPLHandler(timeout=5)
+    with pytest.raises(LeanREPLTimeoutError):
+        list(handler.stream_file(path, timeout=0.05))
+    # Restarted, the late response is gone with the old process
+    _, env = handler.run_command("def f := 1")
+    assert env.env_index == 0
+    handler.close()
@@ -0,0 +1,137 @@
+import asyncio
+import gc
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLSupervisor,
+    LeanREPLCache,
+    LeanREPLNextProofState,
+)
+from lean_repl_py.supervisor import process_rss
+
+
+def test_recycle_keeps_live_indices(fake_repl, tmp_path):
+    supervisor = LeanREPLSupervisor(max_requests=4, directory=tmp_path)
+    handler = LeanREPLHandler(supervisor=supervisor)
+    try:
+        response, env = handler.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+        state, _ = handler.run_tactic("simp", sorry.proof_state)
+        # Dropped right away, so it is not carried over
+        handler.run_command("theorem b : 2 = 2 := by sorry")
+        gc.collect()
+        pid = handler.process.pid
+        _, other_env = handler.run_command("def g := 2", env=env)
+        assert handler.process.pid != pid
+        assert supervisor.stats().recycles == 1
+        assert supervisor.stats().requests == 0
+        # Only the envs and proof states still referenced exist in the new process
+        assert sorted([env.env_index, other_env.env_index]) == [0, 1]
+        assert sorted([sorry.proof_state, state.proof_state]) == [0, 1]
+        result, _ = handler.run_tactic("rfl", state.proof_state)
+        assert isinstance(result, LeanREPLNextProofState)
+        assert state.goals == ["⊢ simp"]
+        response, _ = handler.run_command("def h := 3", env=other_env)
+        assert "message" not in response
+    finally:
+        handler.close()
+
+
+def test_recycle_on_memory(fake_repl):
+    supervisor = LeanREPLSupervisor(max_rss=1)
+    handler = LeanREPLHandler(lazy_responses=True, supervisor=supervisor)
+    try:
+        response, env = handler.run_command("theorem a : 1 = 1 := by sorry")
+        sorry = response["sorries"][0]
+        assert supervisor.stats().recycles == 1
+        assert supervisor.stats().rss > 1
+        handler.env = env
+        response, _ = handler.run_command("theorem b : 2 = 2 := by sorry")
+        assert "message" not in response
+        result, _ = handler.run_tactic("rfl", sorry.proof_state)
+        assert not result.goals
+        assert supervisor.stats().recycles == 3
+    finally:
+        handler.close()
+
+
+def test_recycle_keeps_cache_lineage(fake_repl):
+    cache = LeanREPLCache()
+    supervisor = LeanREPLSupervisor(max_requests=1)
+    handler = LeanREPLHandler(cache=cache, supervisor=supervisor)
+    try:
+        _, env = handler.run_command("def f := 1")
+        assert supervisor.stats().recycles == 1
+        handler.run_command("def g := 2", env=env)
+        other = LeanREPLHandler(cache=cache)
+        _, other_env = other.run_command("def f := 1")
+        # Keyed on the lineage of the recycled env, so served from the cache
+        hits = cache.stats().hits
+        other.run_command("def g := 2", env=other_env)
+        assert cache.stats().hits == hits + 1
+        other.close()
+    finally:
+        handler.close()
+
+
+def test_process_rss(fake_repl):
+    handler = LeanREPLHandler()
+    try:
+        assert process_rss(handler.process.pid) > 0
+    finally:
+        handler.close()
+    assert process_rss(-1) is None
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_recycle(fake_repl):
+    supervisor = LeanREPLSupervisor(max_requests=5)
+    handler = LeanREPLAsyncHandler(supervisor=supervisor)
+    try:
+        results = await asyncio.gather(
+            *(
+                handler.run_command(f"theorem t{i} : 1 = 1 := by sorry")
+                for i in range(8)
+            )
+        )
+        results += await asyncio.gather(
+            *(handler.run_command(f"def f{i} := {i}") for i in range(4))
+        )
+        assert supervisor.stats().recycles >= 1
+        for response, env in results:
+            checked, _ = await handler.run_command("def g := 1", env=env)
+            assert "message" not in checked
+            for sorry in response.get("sorries", []):
+                result, _ = await handler.run_tactic("rfl", sorry.proof_state)
+                assert isinstance(result, LeanREPLNextProofState)
+    finally:
+        await handler.close()
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_recycle_waits_for_requests_in_flight(fake_repl):
+    supervisor = LeanREPLSupervisor(max_requests=2)
+    handler = LeanREPLAsyncHandler(supervisor=supervisor)
+    try:
+        response, env = await handler.run_command("theorem a : 1 = 1 := by sorry")
+        # Proof state pickles must not carry the handler's env along
+        handler.env = env
+        sorry = response["sorries"][0]
+        # Requests still on their way to the REPL when the recycle starts are answered first
+        results = await asyncio.gather(
+            handler.run_command("def f := 1"),
+            handler.run_command("sleep 0.1"),
+            supervisor.recycle_async(handler),
+            handler.run_command("def g := 1"),
+            *(handler.run_command(f"def h{i} := {i}") for i in range(6)),
+        )
+        assert all("message" not in result[0] for result in results if result)
+        assert supervisor.stats().recycles >= 2
+        result, _ = await handler.run_tactic("rfl", sorry.proof_state)
+        assert isinstance(result, LeanREPLNextProofState)
+        assert result.goals == []
+    finally:
+        await handler.close()
@@ -0,0 +1,69 @@
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLTimeoutError,
+    LeanREPLNextProofState,
+)
+
+
+def test_timeout_restarts_repl(fake_repl):
+    handler = LeanREPLHandler(timeout=5)
+    try:
+        response, _ = handler.run_command("theorem a : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        pid = handler.process.pid
+        with pytest.raises(LeanREPLTimeoutError):
+            handler.run_tactic("sleep 10", proof_state, timeout=0.1)
+        assert handler.process.pid != pid
+        # The new process starts from scratch, no late response is left in the pipe
+        _, env = handler.run_command("def f := 2")
+        assert env.env_index == 0
+        with pytest.raises(TimeoutError):
+            handler.run_command("sleep 10", timeout=0.1)
+    finally:
+        handler.close()
+
+
+def test_timeout_in_batch(fake_repl):
+    handler = LeanREPLHandler(timeout=0.5)
+    try:
+        response, _ = handler.run_command("theorem a : 1 = 1 := by sorry")
+        proof_state = response["sorries"][0].proof_state
+        with pytest.raises(LeanREPLTimeoutError):
+            handler.run_tactics(proof_state, ["rfl", "sleep 10", "rfl"])
+        response, _ = handler.run_command("theorem a : 1 = 1 := by sorry")
+        results = handler.run_tactics(response["sorries"][0].proof_state, ["rfl"])
+        assert isinstance(results[0].next_proof_state, LeanREPLNextProofState)
+    finally:
+        handler.close()
+
+
+def test_restart_restores_base_env(fake_repl, tmp_path):
+    source = LeanREPLHandler()
+    _, env = source.run_command("def base := 1")
+    base_env = tmp_path / "base.olean"
+    source.pickle_env(base_env, env)
+    source.close()
+
+    handler = LeanREPLHandler(timeout=5, base_env=base_env)
+    try:
+        assert handler.env.env_index == 0
+        handler.run_command("def f := 2")
+        with pytest.raises(LeanREPLTimeoutError):
+            handler.run_command("sleep 10", timeout=0.1)
+        assert handler.env.env_index == 0
+        response, env = handler.run_command("def f := 2")
+        assert "message" not in response
+        assert env.env_index == 1
+    finally:
+        handler.close()
+
+
+def test_request_timeout_needs_handler_timeout(fake_repl):
+    handler = LeanREPLHandler()
+    try:
+        with pytest.raises(ValueError):
+            handler.run_command("def f := 2", timeout=1)
+    finally:
+        handler.close()
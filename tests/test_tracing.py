@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLAsyncHandler,
+    LeanREPLPool,
+    LeanREPLTrace,
+    LeanREPLTraceHistogram,
+)
+
+
+def test_traces_every_round_trip(fake_repl, tmp_path):
+    traces = []
+    handler = LeanREPLHandler(tracer=traces.append)
+    try:
+        response, _ = handler.run_command("theorem a : 1 = 1 := by sorry")
+        handler.run_command("sleep 0.1")
+        handler.run_tactics(response["sorries"][0].proof_state, ["rfl", "simp"])
+        handler.send_command("def f := 1")
+        handler.receive_json()
+        handler.checkpoint_proof_states([0], tmp_path)
+    finally:
+        handler.close()
+    assert [trace.kind for trace in traces] == [
+        "cmd",
+        "cmd",
+        "tactic",
+        "tactic",
+        "cmd",
+        "pickle",
+    ]
+    for trace in traces:
+        assert isinstance(trace, LeanREPLTrace)
+        assert trace.bytes_out > 0 and trace.bytes_in > 0 and trace.lines > 1
+        assert min(trace.send, trace.wait, trace.read, trace.decode) >= 0
+    assert traces[1].wait >= 0.1
+    # Every response was parsed, except the one for the internal pickle request
+    assert all(trace.parse is not None for trace in traces[:-1])
+    assert traces[-1].parse is None
+
+
+def test_trace_histogram(fake_repl):
+    histogram = LeanREPLTraceHistogram()
+    handler = LeanREPLHandler(tracer=histogram)
+    try:
+        for i in range(10):
+            handler.run_command(f"def f{i} := {i}")
+        handler.run_command("sleep 0.05")
+    finally:
+        handler.close()
+    stats = histogram.stats()
+    assert list(stats) == ["cmd"]
+    assert stats["cmd"].count == 11
+    wait = stats["cmd"].phases["wait"]
+    assert wait.count == 11
+    assert wait.p50 <= wait.p99 <= wait.max
+    assert wait.max >= 0.05
+    histogram.reset()
+    assert histogram.stats() == {}
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_async_traces(fake_repl):
+    traces = []
+    handler = LeanREPLAsyncHandler(tracer=traces.append)
+    try:
+        await asyncio.gather(
+            *(handler.run_command(f"def f{i} := {i}") for i in range(5))
+        )
+        with pytest.raises(TimeoutError):
+            await handler.run_command("sleep 0.2", timeout=0.05)
+        await handler.run_command("def g := 1")
+    finally:
+        await handler.close()
+    assert len(traces) == 7
+    assert all(trace.kind == "cmd" for trace in traces)
+    # The timed out response is still traced when it arrives, but never parsed
+    assert sum(trace.parse is None for trace in traces) == 1
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_pool_shares_tracer(fake_repl):
+    histogram = LeanREPLTraceHistogram()
+    pool = LeanREPLPool(size=2, tracer=histogram)
+    try:
+        await asyncio.gather(*(pool.run_command("def f := 1") for _ in range(4)))
+    finally:
+        await pool.close()
+    assert histogram.stats()["cmd"].count == 4
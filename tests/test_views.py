@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from unittest.mock import MagicMock, patch
+from lean_repl_py import (
+    LeanREPLHandler,
+    LeanREPLEnvironment,
+    LeanREPLProofState,
+    LeanREPLMessage,
+    LeanREPLNextProofState,
+    LeanREPLProofStateView,
+    LeanREPLMessageView,
+    LeanREPLNextProofStateView,
+)
+
+SORRY = {
+    "proofState": 0,
+    "goal": "⊢ 1 = 1",
+    "pos": {"line": 1, "column": 26},
+    "endPos": {"line": 1, "column": 31},
+}
+MESSAGE = {
+    "severity": "warning",
+    "pos": {"line": 1, "column": 8},
+    "endPos": None,
+    "data": "declaration uses 'sorry'",
+}
+
+
+@pytest.fixture
+def lazy_handler():
+    with (
+        patch("subprocess.Popen") as mock_popen,
+        patch("lean_repl_py.handler.resolve_repl"),
+    ):
+        mock_process = MagicMock()
+        mock_popen.return_value = mock_process
+        # Nothing on stderr, the drainer stops right away
+        mock_process.stderr.buffer.raw.read.return_value = b""
+        yield LeanREPLHandler(lazy_responses=True)
+
+
+def test_lazy_command_response(lazy_handler):
+    lazy_handler.process.stdout.readline = MagicMock(
+        side_effect=[
+            json.dumps({"sorries": [SORRY], "messages": [MESSAGE], "env": 0}) + "\n"
+        ]
+    )
+    response, env = lazy_handler.receive_json()
+    assert env == LeanREPLEnvironment(env_index=0)
+    sorry = response["sorries"][0]
+    assert isinstance(sorry, LeanREPLProofStateView)
+    assert sorry.proof_state == 0
+    assert sorry.goal == "⊢ 1 = 1"
+    assert sorry.end_pos.column == 31
+    assert isinstance(sorry.to_model(), LeanREPLProofState)
+    message = response["messages"][0]
+    assert isinstance(message, LeanREPLMessageView)
+    assert message.end_pos is None
+    assert message.to_model() == LeanREPLMessage.model_validate(MESSAGE)
+
+
+def test_lazy_next_proof_state(lazy_handler):
+    lazy_handler.process.stdout.readline = MagicMock(
+        side_effect=['{"proofState": 1, "goals": []}\n']
+    )
+    response, env = lazy_handler.receive_json()
+    assert env is None
+    assert isinstance(response, LeanREPLNextProofStateView)
+    assert response.proof_state == 1
+    assert response.messages == []
+    assert isinstance(response.to_model(), LeanREPLNextProofState)
+    assert "messages" not in response.raw